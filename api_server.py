@@ -0,0 +1,293 @@
+import os
+import sys
+import json
+import signal
+import asyncio
+from urllib.parse import parse_qs, quote
+
+from downloader import (
+    build_command, extract_video_id, normalize_time_format,
+    validate_time_format, validate_youtube_url
+)
+from clip_cache import time_to_seconds
+from progress import LogBuffer
+from video_info import get_info_cache, with_info_json
+from metrics import span, render_prometheus, ProcessSampler, record_child_usage
+from executables import resolve_command
+
+DEFAULT_HOST = "0.0.0.0"
+DEFAULT_PORT = 8503
+DEFAULT_MAX_STREAMS = 4
+CHUNK_SIZE = 64 * 1024
+HEADER_TIMEOUT = 10
+MAX_HEADER_LINES = 100
+
+# 非シーク出力でも再生できるよう、キーフレームごとに断片化したMP4を書き出す
+FFMPEG_FRAGMENT_OPTIONS = ["-movflags", "frag_keyframe+empty_moov+default_base_moof", "-f", "mp4"]
+STREAM_ENCODE_OPTIONS = ["-c:v", "libx264", "-preset", "veryfast", "-c:a", "aac"]
+
+def build_stream_commands(youtube_url, sections, video_info=None):
+    """標準出力に書き出すyt-dlpと、それを断片化MP4に変換するffmpegのコマンドを構築"""
+    # 一時ファイルを使わずに切り出すため、区間の境界はyt-dlpでキーフレームを挿入して正確にする
+    ytdlp_cmd = build_command(youtube_url, sections, "reencode")
+    ytdlp_cmd[ytdlp_cmd.index("-o") + 1] = "-"
+    if sections:
+        # 標準出力（MPEG-TS）への再エンコードはMPEG-2・MP2が既定のため、MP4に格納するH.264・AACを指定する
+        ytdlp_cmd[1:1] = ["--downloader-args", f"ffmpeg_o:{' '.join(STREAM_ENCODE_OPTIONS)}"]
+    if video_info:
+        ytdlp_cmd = with_info_json(ytdlp_cmd, video_info["path"])
+
+    ffmpeg_cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-i", "pipe:0",
+        "-map", "0", "-c", "copy",
+        # yt-dlpが標準出力に書き出すMPEG-TSの音声はADTS形式のため、MP4に格納できる形式に変換する
+        "-bsf:a", "aac_adtstoasc",
+        *FFMPEG_FRAGMENT_OPTIONS,
+        "pipe:1"
+    ]
+    return ytdlp_cmd, ffmpeg_cmd
+
+def parse_clip_query(query):
+    """クエリ文字列（url, start, end）を検証し、（URL, 区間のリスト）を返す（不正な場合はValueError）"""
+    params = parse_qs(query)
+    youtube_url = (params.get("url") or [""])[0].strip()
+    start_time = (params.get("start") or [""])[0].strip()
+    end_time = (params.get("end") or [""])[0].strip()
+
+    if not validate_youtube_url(youtube_url):
+        raise ValueError("無効なYouTubeのURLです。")
+    if (start_time and not validate_time_format(start_time)) or (end_time and not validate_time_format(end_time)):
+        raise ValueError("無効な時間フォーマットです。00:00、01:22:33、0130、012233の形式で指定してください。")
+    if bool(start_time) != bool(end_time):
+        raise ValueError("開始時間と終了時間の両方を指定するか、両方とも省略してください。")
+    if not start_time:
+        return youtube_url, []
+
+    normalized_start = normalize_time_format(start_time)
+    normalized_end = normalize_time_format(end_time)
+    if time_to_seconds(normalized_start) >= time_to_seconds(normalized_end):
+        raise ValueError("終了時間は開始時間より後にしてください。")
+    return youtube_url, [(normalized_start, normalized_end)]
+
+async def read_request(reader):
+    """リクエスト行とヘッダーを読み込み、（メソッド, パス, ヘッダー）を返す"""
+    request_line = await asyncio.wait_for(reader.readline(), HEADER_TIMEOUT)
+    parts = request_line.decode("latin-1").split()
+    if len(parts) != 3:
+        raise ValueError("不正なリクエストです。")
+
+    headers = {}
+    for _ in range(MAX_HEADER_LINES):
+        line = await asyncio.wait_for(reader.readline(), HEADER_TIMEOUT)
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return parts[0], parts[1], headers
+
+async def send_response(writer, status, reason, headers, body=b""):
+    """ヘッダーと本文をまとめて送信"""
+    lines = [f"HTTP/1.1 {status} {reason}"]
+    lines.extend(f"{name}: {value}" for name, value in headers)
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+    await writer.drain()
+
+async def send_json(writer, status, reason, data):
+    body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+    await send_response(writer, status, reason, [
+        ("Content-Type", "application/json; charset=utf-8"),
+        ("Content-Length", str(len(body))),
+        ("Connection", "close"),
+    ], body)
+
+def kill_process_group(process):
+    """子プロセスと、それが起動したプロセス（yt-dlpが使うffmpeg等）をまとめて終了"""
+    if process.returncode is not None:
+        return
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+async def collect_stderr(stream, log):
+    """標準エラー出力を読み続け、パイプが詰まって子プロセスが止まらないようにする"""
+    async for line in stream:
+        log.append(line.decode("utf-8", "replace").rstrip("\n"))
+
+async def wait_for_disconnect(reader):
+    """クライアントが接続を閉じるまで待つ"""
+    while await reader.read(CHUNK_SIZE):
+        pass
+
+class ClipStreamServer:
+    """クリップを生成しながら断片化MP4としてそのままクライアントに送信するHTTPサーバー"""
+
+    def __init__(self, max_streams=None):
+        self.max_streams = int(max_streams or os.environ.get("API_MAX_STREAMS", DEFAULT_MAX_STREAMS))
+        self.active_streams = 0
+
+    async def handle_client(self, reader, writer):
+        try:
+            try:
+                method, target, headers = await read_request(reader)
+            except (ValueError, asyncio.TimeoutError):
+                await send_json(writer, 400, "Bad Request", {"error": "不正なリクエストです。"})
+                return
+
+            path, _, query = target.partition("?")
+            if method != "GET":
+                await send_json(writer, 405, "Method Not Allowed", {"error": "GETのみ対応しています。"})
+            elif path == "/health":
+                await send_json(writer, 200, "OK", {"status": "ok", "active_streams": self.active_streams})
+            elif path == "/metrics":
+                body = render_prometheus().encode("utf-8")
+                await send_response(writer, 200, "OK", [
+                    ("Content-Type", "text/plain; version=0.0.4; charset=utf-8"),
+                    ("Content-Length", str(len(body))),
+                    ("Connection", "close"),
+                ], body)
+            elif path == "/clip":
+                await self.handle_clip(reader, writer, query)
+            else:
+                await send_json(writer, 404, "Not Found", {"error": "見つかりません。"})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass  # クライアントの切断は無視
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def handle_clip(self, reader, writer, query):
+        try:
+            youtube_url, sections = parse_clip_query(query)
+        except ValueError as e:
+            await send_json(writer, 400, "Bad Request", {"error": str(e)})
+            return
+
+        # 同時に生成するストリーム数を制限し、超えた場合は待たせずに再試行を促す
+        if self.active_streams >= self.max_streams:
+            await send_response(writer, 503, "Service Unavailable", [
+                ("Retry-After", "5"), ("Content-Length", "0"), ("Connection", "close")
+            ])
+            return
+
+        self.active_streams += 1
+        try:
+            # 生成と送信が同時に進むため、ストリーム全体を1つの配信区間として計測する
+            with span("stream", video_id=extract_video_id(youtube_url), sections=len(sections)) as stream_span:
+                await self.stream_clip(reader, writer, youtube_url, sections, stream_span)
+        finally:
+            self.active_streams -= 1
+
+    async def stream_clip(self, reader, writer, youtube_url, sections, stream_span):
+        video_id = extract_video_id(youtube_url)
+        # 先読み済みの動画情報があれば、URLからの抽出をやり直さずにinfo JSONを使う
+        video_info = get_info_cache().get(video_id)
+        ytdlp_cmd, ffmpeg_cmd = build_stream_commands(youtube_url, sections, video_info)
+
+        # yt-dlpの出力をPythonを経由せずにffmpegへ直接つなぐ
+        pipe_read, pipe_write = os.pipe()
+        processes = []
+        try:
+            # 切断時にプロセスグループごと終了できるよう、それぞれ新しいセッションで起動
+            ytdlp = await asyncio.create_subprocess_exec(
+                *resolve_command(ytdlp_cmd), stdout=pipe_write, stderr=asyncio.subprocess.PIPE, start_new_session=True
+            )
+            processes.append(ytdlp)
+            ffmpeg = await asyncio.create_subprocess_exec(
+                *resolve_command(ffmpeg_cmd), stdin=pipe_read, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, start_new_session=True
+            )
+            processes.append(ffmpeg)
+        except FileNotFoundError:
+            for process in processes:
+                kill_process_group(process)
+                await process.wait()
+            await send_json(writer, 500, "Internal Server Error", {"error": "yt-dlpまたはffmpegが見つかりません。"})
+            return
+        finally:
+            # 親プロセス側のパイプの端を閉じ、yt-dlpの終了がffmpegにEOFとして伝わるようにする
+            os.close(pipe_read)
+            os.close(pipe_write)
+
+        # asyncioが回収する子プロセスはos.wait4で使用量を取れないため、実行中に調べて配信区間に加える
+        sampler = ProcessSampler([process.pid for process in processes], started_now=True).__enter__()
+        stderr_log = LogBuffer()
+        tasks = [asyncio.ensure_future(collect_stderr(process.stderr, stderr_log)) for process in processes]
+        disconnected = asyncio.ensure_future(wait_for_disconnect(reader))
+        try:
+            # 最初のデータが出るまで待ち、開始前の失敗はエラーとして返す
+            first_chunk = await self.read_or_disconnect(ffmpeg.stdout.read(CHUNK_SIZE), disconnected)
+            if first_chunk is None:
+                return
+            if not first_chunk:
+                await ytdlp.wait()
+                await ffmpeg.wait()
+                await asyncio.gather(*tasks)
+                await send_json(writer, 502, "Bad Gateway", {"error": "クリップの生成に失敗しました。", "detail": stderr_log.text()})
+                return
+
+            file_name = f"{video_info['title']}_({video_id}).mp4" if video_info else f"{video_id}.mp4"
+            await send_response(writer, 200, "OK", [
+                ("Content-Type", "video/mp4"),
+                ("Transfer-Encoding", "chunked"),
+                ("Content-Disposition", f"attachment; filename*=UTF-8''{quote(file_name)}"),
+                ("Cache-Control", "no-store"),
+                ("Connection", "close"),
+            ])
+
+            chunk = first_chunk
+            while chunk:
+                writer.write(b"%x\r\n%b\r\n" % (len(chunk), chunk))
+                stream_span.add_bytes(len(chunk))
+                # クライアントの受信が遅い間は読み出しを止め、パイプ経由でffmpegとyt-dlpも待たせる
+                await writer.drain()
+                chunk = await self.read_or_disconnect(ffmpeg.stdout.read(CHUNK_SIZE), disconnected)
+                if chunk is None:
+                    return
+
+            # 途中で失敗した場合は終端チャンクを送らずに切断し、不完全であることをクライアントに伝える
+            if await ffmpeg.wait() == 0 and await ytdlp.wait() == 0:
+                writer.write(b"0\r\n\r\n")
+                await writer.drain()
+        finally:
+            disconnected.cancel()
+            await asyncio.to_thread(sampler.__exit__, None, None, None)
+            record_child_usage(sampler.cpu_seconds, sampler.peak_rss_bytes)
+            for process in processes:
+                kill_process_group(process)
+            for process in processes:
+                await process.wait()
+            for task in tasks:
+                task.cancel()
+
+    async def read_or_disconnect(self, read, disconnected):
+        """読み込みとクライアントの切断のうち先に起きた方を待つ（切断された場合はNone）"""
+        read_task = asyncio.ensure_future(read)
+        done, _ = await asyncio.wait([read_task, disconnected], return_when=asyncio.FIRST_COMPLETED)
+        if read_task in done:
+            return read_task.result()
+        read_task.cancel()
+        return None
+
+    async def serve(self, host=None, port=None):
+        host = host or os.environ.get("API_SERVER_HOST", DEFAULT_HOST)
+        port = int(port or os.environ.get("API_SERVER_PORT", DEFAULT_PORT))
+        server = await asyncio.start_server(self.handle_client, host, port)
+        print(f"APIサーバーを起動しました: http://{host}:{port}/clip?url=...&start=...&end=...", file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+
+def main():
+    try:
+        asyncio.run(ClipStreamServer().serve())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
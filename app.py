@@ -1,68 +1,335 @@
 import subprocess
 import sys
-import re
 import os
 import tempfile
 import shutil
-import glob
 import platform
+import argparse
+import hashlib
 
-def validate_time_format(time_str):
-    """時間フォーマットを検証（00:00, 00:12, 01:22:33, 0000, 000010形式）"""
-    # MM:SS または HH:MM:SS 形式
-    colon_pattern = r'^\d{1,2}:\d{2}(:\d{2})?$'
-    # MMSS または HHMMSS 形式（4桁または6桁）
-    digit_pattern = r'^\d{4}$|^\d{6}$'
-    
-    return re.match(colon_pattern, time_str) is not None or re.match(digit_pattern, time_str) is not None
+from clip_cache import get_default_cache, make_cache_key, time_to_seconds
+from video_cut import get_cut_mode
+from video_info import get_info_cache, with_info_json
+from progress import format_progress
+from batch import DEFAULT_MAX_WORKERS, DEFAULT_PER_HOST, Journal, load_manifest, run_manifest
+from output_store import get_output_store
+from cookies import get_cookie_options
+from ytdlp_backend import get_rate_limiter
+from playlist import DEFAULT_LOOKAHEAD, validate_playlist_url, fetch_entries, entry_url, entry_sections, parse_entry_ranges, retry_with_backoff
+from sections import merge_sections, parse_section_text
+from downloader import (
+    FORMAT_SORT, build_command, extract_video_id, normalize_time_format, validate_time_format, validate_youtube_url,
+    run_ytdlp, cut_from_cache, trim_download, cache_clip
+)
 
-def normalize_time_format(time_str):
-    """時間フォーマットを正規化（4桁・6桁をMM:SS・HH:MM:SS形式に変換）"""
-    if re.match(r'^\d{4}$', time_str):
-        # 4桁の場合：MMSS -> MM:SS
-        return f"{time_str[:2]}:{time_str[2:]}"
-    elif re.match(r'^\d{6}$', time_str):
-        # 6桁の場合：HHMMSS -> HH:MM:SS
-        return f"{time_str[:2]}:{time_str[2:4]}:{time_str[4:]}"
-    else:
-        # すでに正しい形式の場合はそのまま返す
-        return time_str
+def print_progress(progress):
+    """ダウンロードの進捗を1行で上書き表示"""
+    print(f"\r{format_progress(progress)}\033[K", end="", flush=True)
+
+def save_clip(temp_file):
+    """一時ファイルを出力先（既定は現在のディレクトリ）に一意のファイル名で保存"""
+    # ファイル名は索引から割り当てるため、並列実行時も重複しない
+    return get_output_store().save(temp_file)
 
-def get_unique_filename(base_path):
-    """既存ファイルと重複しない一意のファイル名を生成"""
-    if not os.path.exists(base_path):
-        return base_path
+def download_clips(youtube_url, video_id, sections, cut_mode, video_info=None, on_progress=None, on_message=None):
+    """各区間（空なら動画全体）をキャッシュまたは1回のyt-dlp実行で取得して現在のディレクトリに保存し、区間ごとの保存先のパスを返す"""
+    on_message = on_message or (lambda message: None)
+    requested = list(sections) or [(None, None)]
+    clip_cache = get_default_cache()
+    final_paths = {}
+    
+    # 一意のファイル名生成のため、一時ディレクトリを使用
+    temp_dir = tempfile.mkdtemp()
+    try:
+        pending = []
+        for index, section in enumerate(requested):
+            normalized_start, normalized_end = section
+            
+            # 同じ動画・フォーマット・区間のクリップがキャッシュにあればダウンロードせずに使用
+            cached_entry = clip_cache.get(video_id, make_cache_key(video_id, FORMAT_SORT, normalized_start, normalized_end))
+            if cached_entry:
+                final_path = get_output_store().link(cached_entry["path"], cached_entry["file_name"])
+                on_message(f"キャッシュから取得しました: {final_path}")
+                final_paths[section] = final_path
+                continue
+            
+            # 全体動画やより広い区間がキャッシュにあれば、ネットワークを使わずローカルで切り出す
+            if normalized_start and normalized_end and clip_cache.find_covering(video_id, FORMAT_SORT, normalized_start, normalized_end):
+                section_dir = os.path.join(temp_dir, f"section_{index}")
+                os.makedirs(section_dir)
+                temp_file = cut_from_cache(video_id, section, section_dir, cut_mode)
+                if temp_file:
+                    on_message("キャッシュ済みの動画から切り出しました！")
+                    final_paths[section] = save_clip(temp_file)
+                    on_message(f"ファイルが保存されました: {final_paths[section]}")
+                    continue
+            
+            pending.append(section)
+        
+        if pending:
+            # キャッシュになかった区間だけを、動画情報の抽出1回でまとめてダウンロード
+            cmd = build_command(youtube_url, [section for section in pending if section[0]], cut_mode)
+            
+            # 先読みした動画情報があれば、URLからの抽出をやり直さずにinfo JSONを使う
+            if video_info:
+                cmd = with_info_json(cmd, video_info["path"])
+            
+            download = run_ytdlp(cmd, pending, youtube_url, video_id=video_id, on_progress=on_progress)
+            try:
+                on_message("ダウンロードが完了しました！")
+                if download["output"]:
+                    on_message(f"出力: {download['output']}")
+                
+                for section in pending:
+                    temp_file = download["temp_files"][section]
+                    
+                    # スマートカット・並列エンコードの場合、ダウンロードした区間をローカルで正確に切り出す
+                    if cut_mode != "reencode" and section[0] and section[1]:
+                        trim_download(temp_file, video_id, section, cut_mode)
+                    
+                    # 次回以降の同じリクエストのためにキャッシュへ登録
+                    cache_clip(video_id, section, temp_file)
+                    
+                    final_path = save_clip(temp_file)
+                    on_message(f"ファイルが保存されました: {final_path}")
+                    final_paths[section] = final_path
+            finally:
+                shutil.rmtree(download["temp_dir"], ignore_errors=True)
+        
+        return [final_paths[section] for section in requested]
+    finally:
+        # 一時ディレクトリをクリーンアップ
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def run_batch(manifest_path, journal_path, max_workers, per_host):
+    """マニフェストの各行を並列でダウンロード（ジャーナルにより中断後は未完了の行から再開）"""
+    print(f"マニフェストを読み込んでいます: {manifest_path}")
+    
+    # 実行前に全行を検証し、1行でも不正があれば何もダウンロードしない
+    try:
+        manifest = load_manifest(manifest_path)
+    except (OSError, ValueError) as e:
+        print(f"マニフェストを読み込めませんでした: {e}")
+        sys.exit(1)
+    
+    rows = []
+    errors = []
+    for index, row in enumerate(manifest, 1):
+        if not isinstance(row, dict):
+            errors.append(f"{index}行目: url・start・endを持つオブジェクトを指定してください: {row}")
+            continue
+        # JSONLでは数値等も書けるため、文字列以外の値は不正な行として扱う
+        non_strings = [name for name in ("url", "start", "end") if row.get(name) is not None and not isinstance(row[name], str)]
+        if non_strings:
+            errors.append(f"{index}行目: {'・'.join(non_strings)}は文字列で指定してください（例: \"00:01:30\"）。")
+            continue
+        url = (row.get("url") or "").strip()
+        start_time = (row.get("start") or "").strip()
+        end_time = (row.get("end") or "").strip()
+        if not validate_youtube_url(url):
+            errors.append(f"{index}行目: 無効なYouTubeのURLです: {url}")
+        elif (start_time and not validate_time_format(start_time)) or (end_time and not validate_time_format(end_time)):
+            errors.append(f"{index}行目: 無効な時間フォーマットです: {start_time} ～ {end_time}")
+        elif (start_time and not end_time) or (not start_time and end_time):
+            errors.append(f"{index}行目: 開始時間と終了時間の両方を入力するか、両方とも空欄にしてください。")
+        elif start_time and time_to_seconds(normalize_time_format(start_time)) >= time_to_seconds(normalize_time_format(end_time)):
+            errors.append(f"{index}行目: 終了時間は開始時間より後にしてください: {start_time} ～ {end_time}")
+        else:
+            rows.append({
+                "index": index,
+                "url": url,
+                "start": normalize_time_format(start_time) if start_time else None,
+                "end": normalize_time_format(end_time) if end_time else None,
+            })
+    
+    if errors:
+        for error in errors:
+            print(error)
+        sys.exit(1)
+    
+    process_rows(rows, journal_path, max_workers, per_host, "行目")
+
+def process_rows(rows, journal_path, max_workers, per_host, unit):
+    """各行を並列でダウンロードして結果と集計を表示（ダウンロード中に後続の行の動画情報を抽出しておく）"""
+    info_cache = get_info_cache()
+    positions = {row["index"]: position for position, row in enumerate(rows)}
+    lookahead = max_workers + DEFAULT_LOOKAHEAD
+    
+    def prefetch(position):
+        if position < len(rows):
+            row = rows[position]
+            info_cache.prefetch(extract_video_id(row["url"]), row["url"], get_cookie_options())
+    
+    # 最初に処理する行の情報抽出を始めておく
+    for position in range(lookahead):
+        prefetch(position)
+    
+    cut_mode = get_cut_mode()
+    
+    def process_row(row):
+        # この行をダウンロードしている間に、後続の行の動画情報を抽出しておく
+        prefetch(positions[row["index"]] + lookahead)
+        
+        video_id = extract_video_id(row["url"])
+        video_info = info_cache.wait(video_id)
+        sections = row.get("sections")
+        if sections is None:
+            sections = [(row["start"], row["end"])] if row["start"] else []
+        if video_info and video_info["duration"] and any(time_to_seconds(e) > video_info["duration"] for s, e in sections):
+            raise ValueError(f"終了時間が動画の長さ（{int(video_info['duration'])}秒）を超えています。")
+        
+        def print_retry(attempt, error, delay):
+            reason = error.stderr.strip().splitlines()[-1] if error.stderr and error.stderr.strip() else error
+            print(f"[再試行] {row['index']}{unit} {row['url']}: {delay:.0f}秒後に再試行します（{reason}）")
+        
+        # 一時的なネットワークエラーは間隔を空けて再試行
+        final_paths = retry_with_backoff(
+            lambda: download_clips(row["url"], video_id, sections, cut_mode, video_info),
+            on_retry=print_retry
+        )
+        return final_paths if len(final_paths) > 1 else final_paths[0]
+    
+    def print_result(result):
+        row = result["row"]
+        if "error" in result:
+            print(f"[失敗] {row['index']}{unit} {row['url']}: {result['error']}")
+        else:
+            output = result["output"] if isinstance(result["output"], str) else "、".join(result["output"])
+            print(f"[完了] {row['index']}{unit} → {output}（{result['seconds']:.1f}秒）")
+    
+    summary = run_manifest(rows, process_row, Journal(journal_path), max_workers, per_host, print_result)
+    
+    print("\n" + "=" * 30)
+    print(f"合計: {summary['total']}件（完了済みのためスキップ: {summary['skipped']}件）")
+    print(f"成功: {summary['succeeded']}件 / 失敗: {summary['failed']}件")
+    print(f"所要時間: {summary['elapsed']:.1f}秒")
+    print(f"スループット: {summary['clips_per_minute']:.2f}クリップ/分、{summary['bytes_per_second'] / 1024 / 1024:.2f}MiB/秒")
+    if summary["failed"]:
+        sys.exit(1)
+
+def run_playlist(playlist_url, start_time, end_time, entry_ranges_path, journal_path, max_workers, per_host):
+    """再生リスト・チャンネルの各動画から同じ区間（または動画ごとの区間）を並列でダウンロード"""
+    # 共通の区間も動画ごとの区間と同じく、動画一覧の取得より前に検証する
+    default_sections = []
+    if start_time and end_time:
+        default_sections = [(normalize_time_format(start_time), normalize_time_format(end_time))]
+        if time_to_seconds(default_sections[0][0]) >= time_to_seconds(default_sections[0][1]):
+            print("終了時間は開始時間より後にしてください。")
+            sys.exit(1)
+    
+    print(f"動画一覧を取得しています: {playlist_url}")
+    try:
+        playlist = fetch_entries(playlist_url, get_cookie_options())
+    except subprocess.CalledProcessError as e:
+        print(f"動画一覧の取得に失敗しました: {e}")
+        if e.stderr:
+            print(f"エラー詳細: {e.stderr}")
+        sys.exit(1)
+    except RuntimeError as e:
+        print(f"動画一覧の取得に失敗しました: {e}")
+        sys.exit(1)
     
-    # ファイル名と拡張子を分離
-    name, ext = os.path.splitext(base_path)
-    counter = 2
+    # 動画ごとの区間を読み込み、実行前にすべて検証する
+    entry_ranges = {}
+    if entry_ranges_path:
+        with open(entry_ranges_path, encoding="utf-8-sig") as f:
+            try:
+                entry_ranges = parse_entry_ranges(f.read())
+            except ValueError as e:
+                print(e)
+                sys.exit(1)
+        for key, ranges in entry_ranges.items():
+            if not all(validate_time_format(s) and validate_time_format(e) for s, e in ranges):
+                print(f"{key}: 無効な区間です。開始-終了の形式（例: 02:00-02:30）で指定してください。")
+                sys.exit(1)
+            entry_ranges[key] = [(normalize_time_format(s), normalize_time_format(e)) for s, e in ranges]
+            if any(time_to_seconds(s) >= time_to_seconds(e) for s, e in entry_ranges[key]):
+                print(f"{key}: 終了時間は開始時間より後にしてください。")
+                sys.exit(1)
     
-    while os.path.exists(f"{name}_V{counter}{ext}"):
-        counter += 1
+    rows = []
+    for index, entry in enumerate(playlist["entries"], 1):
+        sections = entry_sections(entry, index, entry_ranges, default_sections)
+        rows.append({
+            "index": index,
+            "url": entry_url(entry),
+            "sections": merge_sections(sections) if sections else [],
+        })
+    print(f"{playlist['title'] or playlist_url}: {len(rows)}本の動画")
     
-    return f"{name}_V{counter}{ext}"
+    process_rows(rows, journal_path, max_workers, per_host, "本目")
 
-def validate_youtube_url(url):
-    """YouTubeのURLを検証"""
-    youtube_patterns = [
-        r'https?://(?:www\.)?youtube\.com/watch\?v=[\w-]+',
-        r'https?://youtu\.be/[\w-]+',
-        r'https?://(?:www\.)?youtube\.com/embed/[\w-]+',
-        r'https?://(?:www\.)?youtube\.com/shorts/[\w-]+'
-    ]
-    return any(re.match(pattern, url) for pattern in youtube_patterns)
+def playlist_journal_path(playlist_url):
+    """再生リストごとの進捗ジャーナルの既定のパス"""
+    return f"playlist_{hashlib.sha256(playlist_url.encode('utf-8')).hexdigest()[:12]}.journal.jsonl"
+
+def input_playlist_section():
+    """再生リストの各動画に共通の区間を入力（両方とも空欄で動画全体）"""
+    while True:
+        start_time = input("各動画の開始時間を入力してください（空欄で動画全体）: ").strip()
+        end_time = input("各動画の終了時間を入力してください（空欄で動画全体）: ").strip()
+        if not start_time and not end_time:
+            return None, None
+        if start_time and end_time and validate_time_format(start_time) and validate_time_format(end_time):
+            if time_to_seconds(normalize_time_format(start_time)) < time_to_seconds(normalize_time_format(end_time)):
+                return start_time, end_time
+            print("終了時間は開始時間より後にしてください。")
+            continue
+        print("開始時間と終了時間の両方を00:00、01:22:33、0130、012233の形式で入力するか、両方とも空欄にしてください。")
 
 def main():
+    parser = argparse.ArgumentParser(description="YouTube動画ダウンローダー")
+    parser.add_argument("--manifest", help="url,start,end列を持つCSVまたはJSONLのマニフェスト（指定時は一括ダウンロード）")
+    parser.add_argument("--journal", help="進捗ジャーナルのパス（既定: マニフェスト名.journal.jsonl）")
+    parser.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS, help="全体の同時ダウンロード数")
+    parser.add_argument("--per-host", type=int, default=DEFAULT_PER_HOST, help="ホストごとの同時ダウンロード数")
+    parser.add_argument("--playlist", help="再生リスト・チャンネルのURL（指定時は各動画を一括ダウンロード）")
+    parser.add_argument("--start", help="再生リストの各動画に共通の開始時間")
+    parser.add_argument("--end", help="再生リストの各動画に共通の終了時間")
+    parser.add_argument("--entry-ranges", help="動画ごとの区間を「動画IDまたは番号: 開始-終了」の形式で1行ずつ書いたファイル")
+    parser.add_argument("--rate", type=float, help="yt-dlpの起動回数の上限（1分あたり、既定: 環境変数YTDLP_RATE_LIMIT）")
+    args = parser.parse_args()
+    
+    if args.rate is not None:
+        get_rate_limiter().set_rate(args.rate)
+    
+    if args.manifest:
+        journal_path = args.journal or f"{os.path.splitext(args.manifest)[0]}.journal.jsonl"
+        run_batch(args.manifest, journal_path, args.workers, args.per_host)
+        return
+    
+    if args.playlist:
+        if not validate_playlist_url(args.playlist):
+            print("無効な再生リスト・チャンネルのURLです。")
+            sys.exit(1)
+        if bool(args.start) != bool(args.end) or not all(validate_time_format(t) for t in (args.start, args.end) if t):
+            print("開始時間と終了時間は両方を正しい形式で指定するか、両方とも省略してください。")
+            sys.exit(1)
+        journal_path = args.journal or playlist_journal_path(args.playlist)
+        run_playlist(args.playlist, args.start, args.end, args.entry_ranges, journal_path, args.workers, args.per_host)
+        return
+    
     print("YouTube動画ダウンローダー")
     print("=" * 30)
     
     # YouTubeのURL入力
     while True:
-        youtube_url = input("YouTubeのURLを入力してください: ").strip()
-        if validate_youtube_url(youtube_url):
+        youtube_url = input("YouTubeのURL（再生リスト・チャンネルも可）を入力してください: ").strip()
+        if validate_youtube_url(youtube_url) or validate_playlist_url(youtube_url):
             break
         print("無効なYouTubeのURLです。正しいURLを入力してください。")
     
+    # 再生リスト・チャンネルの場合は、共通の区間を入力して各動画を一括ダウンロード
+    if validate_playlist_url(youtube_url):
+        start_time, end_time = input_playlist_section()
+        run_playlist(youtube_url, start_time, end_time, None, playlist_journal_path(youtube_url), DEFAULT_MAX_WORKERS, DEFAULT_PER_HOST)
+        return
+    
+    # 時間を入力している間に、動画情報の抽出をバックグラウンドで始めておく
+    video_id = extract_video_id(youtube_url)
+    info_cache = get_info_cache()
+    info_cache.prefetch(video_id, youtube_url, get_cookie_options())
+    
     # ダウンロード区間の入力
     while True:
         start_time = input("開始時間を入力してください（例: 00:00, 01:30, 01:22:33, 0130, 012233、空欄で動画全体）: ").strip()
@@ -81,65 +348,50 @@ def main():
         print("開始時間と終了時間の両方を入力するか、両方とも空欄にしてください。")
         return
     
-    # yt-dlpコマンドを構築
-    cmd = [
-        "yt-dlp",
-        "-S", "codec:avc:aac,res:1080,fps:60,hdr:sdr"
-    ]
-    
-    # Streamlitクラウド環境の検出
-    is_streamlit_cloud = False
-    try:
-        is_streamlit_cloud = (
-            "STREAMLIT_SHARING" in os.environ or 
-            "streamlit" in os.environ.get("HOME", "").lower() or
-            "appuser" in os.environ.get("HOME", "").lower() or
-            os.path.exists("/home/appuser")
-        )
-    except Exception:
-        pass
-    
-    # ローカル環境でのみクッキーオプションを追加
-    if not is_streamlit_cloud:
-        try:
-            cmd.extend(["--cookies-from-browser", "chrome"])
-        except Exception:
-            pass
-    
-    # 時間指定がある場合のみセクションダウンロードを追加
+    sections = []
     if start_time and end_time:
-        # 時間を正規化してからダウンロードセクションの文字列を作成
-        normalized_start = normalize_time_format(start_time)
-        normalized_end = normalize_time_format(end_time)
-        download_sections = f"*{normalized_start}-{normalized_end}"
-        cmd.extend([
-            "--download-sections", download_sections,
-            "--force-keyframes-at-cuts"
-        ])
-        print(f"指定区間: {normalized_start} ～ {normalized_end}")
+        sections.append((normalize_time_format(start_time), normalize_time_format(end_time)))
         
+        # 同じ動画から続けて切り出す区間の入力
+        while True:
+            extra = input("追加の区間を入力してください（例: 02:00-02:30、カンマ区切りで複数可、空欄で終了）: ").strip()
+            if not extra:
+                break
+            parsed = parse_section_text(extra)
+            if all(validate_time_format(s) and validate_time_format(e) for s, e in parsed):
+                sections.extend((normalize_time_format(s), normalize_time_format(e)) for s, e in parsed)
+            else:
+                print("無効な区間です。開始-終了の形式（例: 02:00-02:30）で入力してください。")
+        
+        if any(time_to_seconds(s) >= time_to_seconds(e) for s, e in sections):
+            print("終了時間は開始時間より後にしてください。")
+            return
+        # 重なる・隣接する区間はまとめて1つのクリップにする
+        sections = merge_sections(sections)
+    
+    # 先読みした動画情報で、ダウンロードを始める前に動画の長さを超える終了時間を弾く
+    video_info = info_cache.wait(video_id)
+    if video_info and video_info["duration"] and any(time_to_seconds(e) > video_info["duration"] for s, e in sections):
+        print(f"終了時間が動画の長さ（{int(video_info['duration'])}秒）を超えています。")
+        return
+    
+    cut_mode = get_cut_mode()
+    if sections:
+        for normalized_start, normalized_end in sections:
+            print(f"指定区間: {normalized_start} ～ {normalized_end}")
+        print(f"切り出しモード: {cut_mode}")
     else:
         print("動画全体をダウンロードします")
     
-    cmd.extend([
-        "-f", "bv+ba",
-        "-o", "%(title)s_%(height)s_%(fps)s_%(vcodec.:4)s_(%(id)s).%(ext)s",
-        youtube_url
-    ])
+    # yt-dlpコマンドを構築
+    cmd = build_command(youtube_url, sections, cut_mode)
     
     print(f"\n実行するコマンド:")
     # 表示用にコマンドの引数を引用符で囲む
+    quoted_args = {FORMAT_SORT, "bv+ba", cmd[cmd.index("-o") + 1], youtube_url}
     cmd_display = []
     for arg in cmd:
-        if arg == "codec:avc:aac,res:1080,fps:60,hdr:sdr":
-            cmd_display.append(f'"{arg}"')
-        elif arg == "bv+ba":
-            cmd_display.append(f'"{arg}"')
-        elif arg == "%(title)s_%(height)s_%(fps)s_%(vcodec.:4)s_(%(id)s).%(ext)s":
-            cmd_display.append(f'"{arg}"')
-        elif start_time and end_time and arg == download_sections:
-            cmd_display.append(f'"{arg}"')
-        elif arg == youtube_url:
+        if arg in quoted_args or arg.startswith("*"):
             cmd_display.append(f'"{arg}"')
         else:
             cmd_display.append(arg)
@@ -147,58 +399,21 @@ def main():
     print("\nダウンロードを開始します...")
     
     try:
-        # 一意のファイル名生成のため、一時ディレクトリを使用
-        temp_dir = tempfile.mkdtemp()
-        temp_cmd = cmd.copy()
-        
-        # 一時ディレクトリに出力するように変更
-        for i, arg in enumerate(temp_cmd):
-            if arg == "-o":
-                temp_cmd[i+1] = os.path.join(temp_dir, temp_cmd[i+1])
-                break
-        
-        # yt-dlpコマンドを実行
-        result = subprocess.run(temp_cmd, check=True, capture_output=True, text=True)
-        print("ダウンロードが完了しました！")
-        if result.stdout:
-            print(f"出力: {result.stdout}")
-        
-        # 一時ディレクトリからダウンロードされたファイルを取得
-        temp_files = glob.glob(os.path.join(temp_dir, "*.mp4"))
+        def print_message(message):
+            # 進捗行を上書きしている途中なら改行してから表示
+            print(f"\r\033[K{message}")
         
-        if temp_files:
-            # 最新のファイルを取得
-            temp_file = temp_files[0]
-            original_name = os.path.basename(temp_file)
-            
-            # 現在のディレクトリで一意のファイル名を生成
-            final_path = get_unique_filename(original_name)
-            
-            # ファイルを現在のディレクトリにコピー
-            shutil.move(temp_file, final_path)
-            print(f"ファイルが保存されました: {final_path}")
-            
-            # 一時ディレクトリをクリーンアップ
-            shutil.rmtree(temp_dir, ignore_errors=True)
-        else:
-            # 一時ディレクトリをクリーンアップ
-            shutil.rmtree(temp_dir, ignore_errors=True)
-            print("ダウンロードに失敗しました。")
-            
+        download_clips(youtube_url, video_id, sections, cut_mode, video_info, print_progress, print_message)
     except subprocess.CalledProcessError as e:
-        print(f"エラーが発生しました: {e}")
+        print(f"\nエラーが発生しました: {e}")
         if e.stderr:
             print(f"エラー詳細: {e.stderr}")
-        # 一時ディレクトリをクリーンアップ
-        if 'temp_dir' in locals():
-            shutil.rmtree(temp_dir, ignore_errors=True)
         sys.exit(1)
     except FileNotFoundError:
-        print("yt-dlpが見つかりません。yt-dlpがインストールされているか確認してください。")
-        # 一時ディレクトリをクリーンアップ
-        if 'temp_dir' in locals():
-            shutil.rmtree(temp_dir, ignore_errors=True)
+        print("\nyt-dlpまたはffmpegが見つかりません。yt-dlpとffmpegがインストールされているか確認してください。")
         sys.exit(1)
+    except RuntimeError as e:
+        print(f"\n{e}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
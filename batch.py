@@ -0,0 +1,114 @@
+import os
+import csv
+import json
+import time
+import hashlib
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_PER_HOST = 2
+
+def load_manifest(path):
+    """CSV（url,start,end列）またはJSONL形式のマニフェストを読み込む"""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith((".jsonl", ".json")):
+            return [json.loads(line) for line in f if line.strip()]
+        return list(csv.DictReader(f))
+
+def row_key(row):
+    """行の内容から、再開時に完了済みかどうかを判定するキーを生成"""
+    if "sections" in row:
+        # 複数区間を持つ行（再生リストの各動画など）
+        key_source = json.dumps([row["url"], row["sections"]])
+    else:
+        key_source = json.dumps([row["url"], row["start"] or "", row["end"] or ""])
+    return hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+
+class Journal:
+    """完了した行を1行ずつ追記する進捗ジャーナル（中断後の再開に使う）"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def load_completed(self):
+        """完了済みの行のキーを返す（書き込み途中で中断された行は無視）"""
+        completed = set()
+        if not os.path.exists(self.path):
+            return completed
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("status") == "done":
+                    completed.add(record["key"])
+        return completed
+
+    def record(self, **record):
+        """結果を追記し、クラッシュしても失われないようディスクに書き出す"""
+        with self.lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+def run_manifest(rows, process_row, journal, max_workers=DEFAULT_MAX_WORKERS, per_host=DEFAULT_PER_HOST, on_result=None):
+    """全体とホストごとの同時実行数を制限して各行を処理し、集計結果を返す"""
+    completed = journal.load_completed()
+    pending = [row for row in rows if row_key(row) not in completed]
+    host_limits = {}
+    host_limits_lock = threading.Lock()
+    summary = {
+        "total": len(rows),
+        "skipped": len(rows) - len(pending),
+        "succeeded": 0,
+        "failed": 0,
+        "bytes": 0,
+    }
+
+    def host_limit(url):
+        host = urlparse(url).hostname or ""
+        with host_limits_lock:
+            return host_limits.setdefault(host, threading.BoundedSemaphore(per_host))
+
+    def run_row(row):
+        with host_limit(row["url"]):
+            started = time.time()
+            output_path = process_row(row)
+            return output_path, time.time() - started
+
+    started = time.time()
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {executor.submit(run_row, row): row for row in pending}
+        for future in as_completed(futures):
+            row = futures[future]
+            try:
+                output_path, seconds = future.result()
+            except Exception as e:
+                summary["failed"] += 1
+                journal.record(key=row_key(row), index=row["index"], status="error", error=str(e))
+                result = {"row": row, "error": e}
+            else:
+                # 複数区間の行は保存先のリストを返す
+                output_paths = output_path if isinstance(output_path, list) else [output_path]
+                size = sum(os.path.getsize(path) for path in output_paths if os.path.exists(path))
+                summary["succeeded"] += 1
+                summary["bytes"] += size
+                journal.record(key=row_key(row), index=row["index"], status="done", output=output_path, bytes=size, seconds=round(seconds, 3))
+                result = {"row": row, "output": output_path, "seconds": seconds}
+            if on_result is not None:
+                on_result(result)
+    finally:
+        # 中断された場合は未着手の行を取り消す（次回の実行で再開される）
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    elapsed = time.time() - started
+    summary["elapsed"] = elapsed
+    summary["clips_per_minute"] = summary["succeeded"] / elapsed * 60 if elapsed > 0 else 0.0
+    summary["bytes_per_second"] = summary["bytes"] / elapsed if elapsed > 0 else 0.0
+    return summary
@@ -0,0 +1,41 @@
+import time
+
+from harness import RssSampler, summarize, reset_singletons
+
+# yt-dlpの実行方式（YTDLP_BACKEND）ごとの、起動と1回あたりの実行時間を比べるシナリオ
+
+def backend_metadata(env, options, backend_name):
+    """動画情報の取得（--dump-single-json）を繰り返し、最初の1回（起動を含む）と以降の所要時間を計測"""
+    from ytdlp_backend import run_ytdlp_command
+
+    url = env.video()
+    env.apply(env.fresh_run_dir(), YTDLP_BACKEND=backend_name)
+    cmd = ["yt-dlp", "--dump-single-json", "--no-playlist", url]
+    latencies = []
+    total_bytes = 0
+    try:
+        with RssSampler() as sampler:
+            # subprocessは毎回Pythonとyt-dlpを読み込み、inprocessは最初の1回でワーカーを起動して読み込む
+            started = time.perf_counter()
+            run_ytdlp_command(cmd)
+            first_call = time.perf_counter() - started
+            for _ in range(options.calls):
+                started = time.perf_counter()
+                result = run_ytdlp_command(cmd)
+                latencies.append(time.perf_counter() - started)
+                total_bytes += len(result.stdout.encode("utf-8"))
+    finally:
+        # 常駐ワーカーを止める
+        reset_singletons()
+    return summarize(latencies, total_bytes, peak_rss_bytes=sampler.peak, backend=backend_name, first_call_seconds=round(first_call, 4))
+
+def ytdlp_subprocess_metadata(env, options):
+    return backend_metadata(env, options, "subprocess")
+
+def ytdlp_inprocess_metadata(env, options):
+    return backend_metadata(env, options, "inprocess")
+
+SCENARIOS = {
+    "ytdlp_subprocess_metadata": ytdlp_subprocess_metadata,
+    "ytdlp_inprocess_metadata": ytdlp_inprocess_metadata,
+}
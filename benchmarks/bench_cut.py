@@ -0,0 +1,93 @@
+import os
+import time
+
+import video_cut
+from fake_media import make_clip
+from harness import RssSampler, summarize, percentile
+
+# ローカルのファイルから区間を切り出す処理（video_cut.py）だけを計測するシナリオ
+
+# YouTubeの配信に近い29.97fps・2秒ごとのキーフレーム（キーフレーム時刻が小数第3位で割り切れない）
+CUT_FPS = "30000/1001"
+CUT_GOP = 60
+CUT_SIZE = "640x360"
+
+def cut_source(env, options):
+    """切り出し元の動画を生成（同じ長さ・ビットレートなら使い回す）"""
+    path = os.path.join(env.work_dir, f"cut-source-{options.seconds}-{options.bitrate}.mp4")
+    if not os.path.exists(path):
+        make_clip(path, options.seconds, options.bitrate, fps=CUT_FPS, gop=CUT_GOP, size=CUT_SIZE)
+    return path
+
+def cut_sections(options):
+    """キーフレームの途中から始まり途中で終わる、動画の1/3の長さの区間を回ごとにずらして選ぶ"""
+    length = options.seconds / 3
+    return [(round(1.1 + run * 7.3 % (options.seconds - length - 2), 3), length) for run in range(options.runs)]
+
+def timed_cut(src_path, dst_path, start_seconds, duration, cut_mode, expected_frames):
+    """区間を切り出して経過秒を返す（フレーム数が区間と一致しない場合は失敗）"""
+    started = time.perf_counter()
+    video_cut.cut_section(src_path, dst_path, start_seconds, duration, cut_mode)
+    elapsed = time.perf_counter() - started
+    frame_count = len(video_cut.probe_video_frames(dst_path))
+    if frame_count != expected_frames:
+        raise RuntimeError(f"{cut_mode}: {start_seconds}秒から{duration}秒のフレーム数が{frame_count}です（期待値{expected_frames}）")
+    return elapsed
+
+def cut_smart_vs_reencode(env, options):
+    """境界のGOPのみ再エンコードするsmartモードと、区間全体を再エンコードする場合の所要時間を比べる"""
+    src_path = cut_source(env, options)
+    frames = video_cut.probe_video_frames(src_path)
+    run_dir = env.fresh_run_dir()
+    smart_latencies = []
+    reencode_latencies = []
+    total_bytes = 0
+    with RssSampler() as sampler:
+        for index, (start_seconds, duration) in enumerate(cut_sections(options)):
+            first, last = video_cut.select_frames(frames, start_seconds, start_seconds + duration)
+            smart_path = os.path.join(run_dir, f"smart_{index}.mp4")
+            smart_latencies.append(timed_cut(src_path, smart_path, start_seconds, duration, "smart", last - first))
+            reencode_latencies.append(timed_cut(src_path, os.path.join(run_dir, f"reencode_{index}.mp4"), start_seconds, duration, "reencode", last - first))
+            total_bytes += os.path.getsize(smart_path)
+    return summarize(
+        smart_latencies, total_bytes, peak_rss_bytes=sampler.peak,
+        reencode_p50_seconds=round(percentile(reencode_latencies, 0.5), 4),
+        speedup=round(sum(reencode_latencies) / sum(smart_latencies), 2)
+    )
+
+def parallel_encode_scaling(env, options):
+    """区間全体の再エンコードを、ワーカー数を1から増やしながら計測し、1ワーカーに対する速度の比を求める"""
+    src_path = cut_source(env, options)
+    frames = video_cut.probe_video_frames(src_path)
+    # 各ワーカーに1チャンク以上を割り当てられるよう、動画のほぼ全体を切り出す
+    start_seconds, duration = 0.5, options.seconds - 1
+    first, last = video_cut.select_frames(frames, start_seconds, start_seconds + duration)
+    worker_counts = sorted({int(value) for value in options.workers.split(",")} | {1})
+    min_chunk_seconds = video_cut.MIN_CHUNK_SECONDS
+    video_cut.MIN_CHUNK_SECONDS = min(min_chunk_seconds, duration / max(worker_counts))
+    run_dir = env.fresh_run_dir()
+    latencies = {}
+    try:
+        with RssSampler() as sampler:
+            for workers in worker_counts:
+                os.environ["ENCODE_WORKERS"] = str(workers)
+                latencies[workers] = [
+                    timed_cut(src_path, os.path.join(run_dir, f"parallel_{workers}_{run}.mp4"), start_seconds, duration, "parallel", last - first)
+                    for run in range(options.runs)
+                ]
+    finally:
+        video_cut.MIN_CHUNK_SECONDS = min_chunk_seconds
+        os.environ.pop("ENCODE_WORKERS", None)
+
+    single_p50 = percentile(latencies[1], 0.5)
+    scaling = {
+        str(workers): {"p50_seconds": round(percentile(values, 0.5), 4), "speedup": round(single_p50 / percentile(values, 0.5), 2)}
+        for workers, values in latencies.items()
+    }
+    widest = latencies[worker_counts[-1]]
+    return summarize(widest, peak_rss_bytes=sampler.peak, workers=worker_counts[-1], cpu_count=os.cpu_count(), scaling=scaling)
+
+SCENARIOS = {
+    "cut_smart_vs_reencode": cut_smart_vs_reencode,
+    "parallel_encode_scaling": parallel_encode_scaling,
+}
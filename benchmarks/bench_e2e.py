@@ -0,0 +1,186 @@
+import os
+import time
+import functools
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from sections import seconds_to_time
+from harness import RssSampler, summarize, run_cli, directory_bytes
+
+# アプリ全体（app.py・streamlit_app.py）を、ローカルの抽出器とメディアサーバーに対して動かすシナリオ
+
+DELIVERY_CHUNK = 1024 * 1024
+
+def cli_download(env, options, sections, **overrides):
+    """app.pyの対話入力で1本ずつダウンロードし、毎回キャッシュのない状態から計測"""
+    url = env.video()
+    if sections:
+        stdin_text = f"{url}\n{sections[0]}\n{sections[1]}\n\n"
+    else:
+        stdin_text = f"{url}\n\n\n"
+
+    latencies = []
+    total_bytes = 0
+    with RssSampler() as sampler:
+        for _ in range(options.runs):
+            run_dir = env.fresh_run_dir()
+            elapsed, _ = run_cli(env.env(run_dir, **overrides), [], stdin_text, run_dir)
+            latencies.append(elapsed)
+            total_bytes += directory_bytes(os.path.join(run_dir, "outputs"))
+    return summarize(latencies, total_bytes, peak_rss_bytes=sampler.peak)
+
+def cli_whole(env, options):
+    return cli_download(env, options, None)
+
+def cli_section_smart(env, options):
+    return cli_download(env, options, ("00:10", "00:20"), CUT_MODE="smart")
+
+def cli_section_force_keyframes(env, options):
+    # reencodeモードではyt-dlpに--force-keyframes-at-cutsを渡し、区間全体をダウンロード時に再エンコードする
+    return cli_download(env, options, ("00:10", "00:20"), CUT_MODE="reencode")
+
+def spread_sections(options):
+    """動画全体に等間隔に並べた、重ならない5秒の区間"""
+    spacing = options.seconds // options.sections
+    return [(seconds_to_time(index * spacing), seconds_to_time(index * spacing + 5)) for index in range(options.sections)]
+
+def cli_sections(env, options, one_run):
+    """同じ動画のN個の区間を、1回の実行でまとめて（one_run）またはN回に分けて取得する時間を計測"""
+    url = env.video()
+    sections = spread_sections(options)
+    if one_run:
+        extra = ",".join(f"{start}-{end}" for start, end in sections[1:])
+        inputs = [f"{url}\n{sections[0][0]}\n{sections[0][1]}\n{extra}\n\n"]
+    else:
+        inputs = [f"{url}\n{start}\n{end}\n\n" for start, end in sections]
+
+    latencies = []
+    total_bytes = 0
+    with RssSampler() as sampler:
+        for _ in range(options.runs):
+            # 分けて取得する場合も、同じ作業ディレクトリ（動画情報のキャッシュ）を使い続ける
+            run_dir = env.fresh_run_dir()
+            started = time.perf_counter()
+            for stdin_text in inputs:
+                run_cli(env.env(run_dir), [], stdin_text, run_dir)
+            latencies.append(time.perf_counter() - started)
+            outputs = os.path.join(run_dir, "outputs")
+            if len([name for name in os.listdir(outputs) if name.endswith(".mp4")]) != len(sections):
+                raise RuntimeError(f"{len(sections)}個の区間のクリップが揃っていません: {os.listdir(outputs)}")
+            total_bytes += directory_bytes(outputs)
+    return summarize(latencies, total_bytes, items=options.runs * len(sections), elapsed=sum(latencies), peak_rss_bytes=sampler.peak, sections=len(sections))
+
+def cli_sections_one_run(env, options):
+    return cli_sections(env, options, one_run=True)
+
+def cli_sections_sequential(env, options):
+    return cli_sections(env, options, one_run=False)
+
+def streamlit_concurrent_users(env, options):
+    """Streamlitのページと同じ方法で、複数のセッションから同時にジョブを投入して完了までの時間を計測"""
+    import streamlit_app
+    from job_queue import get_scheduler
+
+    url = env.video()
+    video_id = url.rsplit("=", 1)[1]
+    latencies = []
+    total_bytes = 0
+    with RssSampler() as sampler:
+        started = time.perf_counter()
+        for _ in range(options.runs):
+            run_dir = env.fresh_run_dir()
+            env.apply(run_dir)
+            scheduler = get_scheduler()
+            job_ids = []
+            for user in range(options.users):
+                # ユーザーごとに異なる区間を要求し、ダウンロードの重複排除が効かない状態にする
+                start_seconds = user * 5 % max(5, env.seconds - 10)
+                section = (seconds_to_time(start_seconds), seconds_to_time(start_seconds + 5))
+                request = {"youtube_url": url, "video_id": video_id, "sections": [section], "cut_mode": "smart"}
+                job_ids.append(scheduler.submit(
+                    f"user-{user}",
+                    functools.partial(streamlit_app.download_clip, request=request),
+                    functools.partial(streamlit_app.encode_clip, request=request)
+                ))
+            for job_id in job_ids:
+                job = scheduler.get_job(job_id)
+                while not job.is_finished:
+                    time.sleep(0.05)
+                if job.status != "done":
+                    raise RuntimeError(f"ジョブが失敗しました: {job.error}")
+                latencies.append(job.finished - job.created)
+                total_bytes += sum(os.path.getsize(path) for path in job.result)
+        elapsed = time.perf_counter() - started
+    return summarize(latencies, total_bytes, elapsed=elapsed, peak_rss_bytes=sampler.peak, users=options.users)
+
+def deliver_large_file(env, options, base_url):
+    """大きなファイルを複数のクライアントが同時に取得し、転送速度とメモリ使用量を計測"""
+    import file_server
+
+    path = os.path.join(env.fresh_run_dir(), "large.mp4")
+    with open(path, "wb") as f:
+        # 疎なファイルにしてディスクを消費せずに大きなファイルを用意する
+        f.truncate(options.delivery_mib * 1024 * 1024)
+    token = file_server.register_file(path, "large.mp4")
+    url = f"{base_url}/files/{token}"
+
+    def fetch():
+        started = time.perf_counter()
+        received = 0
+        with urllib.request.urlopen(url) as response:
+            while True:
+                chunk = response.read(DELIVERY_CHUNK)
+                if not chunk:
+                    break
+                received += len(chunk)
+        return time.perf_counter() - started, received
+
+    latencies = []
+    total_bytes = 0
+    with RssSampler() as sampler:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options.clients) as executor:
+            for elapsed, received in executor.map(lambda _: fetch(), range(options.runs * options.clients)):
+                latencies.append(elapsed)
+                total_bytes += received
+        elapsed = time.perf_counter() - started
+    file_server.unregister_file(token)
+    return summarize(latencies, total_bytes, elapsed=elapsed, peak_rss_bytes=sampler.peak, clients=options.clients, file_bytes=os.path.getsize(path))
+
+def large_file_delivery(env, options):
+    """ローカル実行時の別ポートの配信サーバー（sendfile）"""
+    import file_server
+
+    env.apply(env.fresh_run_dir(), FILE_SERVER_HOST="127.0.0.1", FILE_SERVER_PORT=options.delivery_port)
+    server = file_server.start_server()
+    return deliver_large_file(env, options, f"http://127.0.0.1:{server.server_address[1]}")
+
+def large_file_delivery_streamlit(env, options):
+    """Streamlitのサーバー（Starlette・uvicorn）に追加したルート"""
+    import uvicorn
+    from starlette.applications import Starlette
+    import file_server
+
+    env.apply(env.fresh_run_dir())
+    server = uvicorn.Server(uvicorn.Config(Starlette(routes=file_server.file_routes()), host="127.0.0.1", port=0, log_level="error"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    try:
+        while not server.started:
+            time.sleep(0.05)
+        return deliver_large_file(env, options, f"http://127.0.0.1:{server.servers[0].sockets[0].getsockname()[1]}")
+    finally:
+        server.should_exit = True
+        thread.join()
+
+SCENARIOS = {
+    "cli_whole": cli_whole,
+    "cli_section_smart": cli_section_smart,
+    "cli_section_force_keyframes": cli_section_force_keyframes,
+    "cli_sections_one_run": cli_sections_one_run,
+    "cli_sections_sequential": cli_sections_sequential,
+    "streamlit_concurrent_users": streamlit_concurrent_users,
+    "large_file_delivery": large_file_delivery,
+    "large_file_delivery_streamlit": large_file_delivery_streamlit,
+}
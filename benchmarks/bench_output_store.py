@@ -0,0 +1,43 @@
+import os
+import time
+
+from harness import RssSampler, summarize, percentile
+
+# 出力先のファイル名の割り当て（output_store.py）を計測するシナリオ
+
+def output_store_collisions(env, options):
+    """同じ名前のファイルを繰り返し保存し、連番が増えても1件あたりの時間が伸びないことを確かめる"""
+    from output_store import OutputStore
+
+    run_dir = env.fresh_run_dir()
+    os.environ["OUTPUT_INDEX_DIR"] = os.path.join(run_dir, "output-index")
+    try:
+        store = OutputStore(os.path.join(run_dir, "outputs"))
+    finally:
+        os.environ.pop("OUTPUT_INDEX_DIR", None)
+    temp_dir = os.path.join(run_dir, "temp")
+    os.makedirs(temp_dir)
+
+    latencies = []
+    with RssSampler() as sampler:
+        for index in range(options.collisions):
+            temp_file = os.path.join(temp_dir, f"{index}.mp4")
+            with open(temp_file, "wb") as f:
+                f.write(b"clip")
+            started = time.perf_counter()
+            store.save(temp_file, "Test video_1080p_(bench000000).mp4")
+            latencies.append(time.perf_counter() - started)
+    store.db.close()
+
+    if len(os.listdir(store.root)) != options.collisions:
+        raise RuntimeError(f"保存したファイルの数が{len(os.listdir(store.root))}件です（期待値{options.collisions}件）")
+    window = max(1, min(1000, options.collisions // 10))
+    return summarize(
+        latencies, 4 * options.collisions, peak_rss_bytes=sampler.peak, collisions=options.collisions,
+        first_p50_seconds=round(percentile(latencies[:window], 0.5), 6),
+        last_p50_seconds=round(percentile(latencies[-window:], 0.5), 6)
+    )
+
+SCENARIOS = {
+    "output_store_collisions": output_store_collisions,
+}
@@ -0,0 +1,225 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import threading
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TESTS_DIR = os.path.join(REPO_DIR, "tests")
+for path in (REPO_DIR, TESTS_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from fake_media import MediaLibrary, MediaServer
+from app_env import app_environment, reset_singletons, read_invocations
+
+try:
+    import psutil
+except ImportError:
+    psutil = None  # 未インストールの場合はresourceの終了済みプロセスのピークのみ計測
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# 基準値からこの割合を超えて悪化した場合は回帰とみなす
+DEFAULT_TOLERANCE = 0.25
+RSS_SAMPLE_INTERVAL = 0.05
+
+def percentile(values, fraction):
+    """線形補間で百分位数を求める"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def summarize(latencies, total_bytes=0, items=None, elapsed=None, peak_rss_bytes=0, **extra):
+    """計測結果をレイテンシの百分位数・スループット・ピークメモリにまとめる"""
+    elapsed = elapsed if elapsed is not None else sum(latencies)
+    items = items if items is not None else len(latencies)
+    return {
+        "runs": len(latencies),
+        "latency_seconds": {
+            "p50": round(percentile(latencies, 0.5), 4),
+            "p95": round(percentile(latencies, 0.95), 4),
+            "p99": round(percentile(latencies, 0.99), 4),
+            "mean": round(sum(latencies) / len(latencies), 4) if latencies else 0.0,
+        },
+        "throughput": {
+            "items_per_second": round(items / elapsed, 4) if elapsed > 0 else 0.0,
+            "bytes_per_second": round(total_bytes / elapsed, 1) if elapsed > 0 else 0.0,
+        },
+        "peak_rss_bytes": peak_rss_bytes,
+        **extra,
+    }
+
+class RssSampler:
+    """自プロセスと子孫プロセスのRSS合計を一定間隔で調べ、ピークを記録する"""
+
+    def __init__(self, pid=None, interval=RSS_SAMPLE_INTERVAL):
+        self.pid = pid or os.getpid()
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def sample(self):
+        if psutil is None:
+            return 0
+        try:
+            root = psutil.Process(self.pid)
+            processes = [root, *root.children(recursive=True)]
+        except psutil.Error:
+            return 0
+        total = 0
+        for process in processes:
+            try:
+                total += process.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, self.sample())
+            self.stopped.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.sample()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.thread.join()
+        if psutil is None and resource is not None:
+            # 終了済みの子プロセスのうち最大のRSS（Linuxではキロバイト単位）
+            self.peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+class BenchEnvironment:
+    """生成した動画を配信するローカルサーバーと、アプリを閉じ込める作業ディレクトリ"""
+
+    def __init__(self, seconds=60, bitrate="2M", latency=0.0, bandwidth=0, kind="progressive", keep=False):
+        self.work_dir = tempfile.mkdtemp(prefix="clip-bench-")
+        self.keep = keep
+        self.library = MediaLibrary(os.path.join(self.work_dir, "media"))
+        self.seconds = seconds
+        self.bitrate = bitrate
+        self.kind = kind
+        self.server = MediaServer(self.library.root, latency=latency, bandwidth=bandwidth).start()
+        self.videos = {}
+        self.run_count = 0
+
+    def video(self, index=0, seconds=None, bitrate=None, kind=None, **options):
+        """index番目のテスト動画のURLを返す（未生成なら生成）"""
+        key = (index, seconds, bitrate, kind, tuple(sorted(options.items())))
+        if key not in self.videos:
+            video_id = f"bench{len(self.videos):06d}"
+            self.library.add_video(video_id, seconds or self.seconds, bitrate or self.bitrate, kind=kind or self.kind, **options)
+            self.videos[key] = video_id
+        return f"https://www.youtube.com/watch?v={self.videos[key]}"
+
+    def fresh_run_dir(self):
+        """キャッシュを共有しない、1回の実行ごとの作業ディレクトリ"""
+        self.run_count += 1
+        run_dir = os.path.join(self.work_dir, f"run-{self.run_count:04d}")
+        os.makedirs(run_dir)
+        return run_dir
+
+    def env(self, run_dir, **overrides):
+        """サブプロセスに渡す環境変数"""
+        env = dict(os.environ, **app_environment(run_dir, self.server.url, os.path.join(run_dir, "ytdlp.jsonl")))
+        env.pop("STORAGE_BACKEND", None)
+        env.update({name: str(value) for name, value in overrides.items()})
+        return env
+
+    def apply(self, run_dir, **overrides):
+        """同じプロセス内で動かすシナリオ用に環境変数を設定し、共有状態を作り直させる"""
+        os.environ.update(self.env(run_dir, **overrides))
+        for name in ("STORAGE_BACKEND",):
+            os.environ.pop(name, None)
+        reset_singletons()
+
+    def invocations(self, run_dir):
+        return read_invocations(os.path.join(run_dir, "ytdlp.jsonl"))
+
+    def close(self):
+        self.server.stop()
+        reset_singletons()
+        if not self.keep:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+def run_cli(env, args, stdin_text, cwd):
+    """app.pyをサブプロセスとして実行し、（経過秒, 完了したプロセス）を返す"""
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, os.path.join(REPO_DIR, "app.py"), *args],
+        input=stdin_text, env=env, cwd=cwd, capture_output=True, text=True
+    )
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f"app.pyが失敗しました（{result.returncode}）: {result.stdout[-2000:]}{result.stderr[-2000:]}")
+    return elapsed, result
+
+def directory_bytes(path):
+    total = 0
+    for dir_path, _, file_names in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(dir_path, name)) for name in file_names)
+    return total
+
+def machine_info():
+    """結果を比較する際に参考にする実行環境の情報"""
+    ffmpeg_version = ""
+    if shutil.which("ffmpeg"):
+        ffmpeg_version = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True).stdout.split("\n", 1)[0]
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "ffmpeg": ffmpeg_version,
+    }
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """基準値と比べて、レイテンシ（p50・p95）かスループットが許容範囲を超えて悪化したシナリオを返す"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        for percentile_name in ("p50", "p95"):
+            current, previous = result["latency_seconds"][percentile_name], base["latency_seconds"][percentile_name]
+            if previous > 0 and current > previous * (1 + tolerance):
+                regressions.append(f"{name}: レイテンシ{percentile_name} {previous:.3f}秒 → {current:.3f}秒")
+        current, previous = result["throughput"]["items_per_second"], base["throughput"]["items_per_second"]
+        if previous > 0 and current < previous * (1 - tolerance):
+            regressions.append(f"{name}: スループット {previous:.3f}件/秒 → {current:.3f}件/秒")
+    return regressions
+
+def format_report(results):
+    """結果を1シナリオ1行の表にする"""
+    lines = [f"{'シナリオ':<36}{'回数':>5}{'p50(秒)':>10}{'p95(秒)':>10}{'p99(秒)':>10}{'件/秒':>10}{'MiB/秒':>10}{'ピークRSS(MiB)':>16}"]
+    for name, result in results.items():
+        latency = result["latency_seconds"]
+        lines.append(
+            f"{name:<36}{result['runs']:>5}{latency['p50']:>10.3f}{latency['p95']:>10.3f}{latency['p99']:>10.3f}"
+            f"{result['throughput']['items_per_second']:>10.3f}{result['throughput']['bytes_per_second'] / 1024 / 1024:>10.2f}"
+            f"{result['peak_rss_bytes'] / 1024 / 1024:>16.1f}"
+        )
+    return "\n".join(lines)
+
+def load_json(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def write_json(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.write("\n")
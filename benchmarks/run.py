@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+import argparse
+
+from harness import BenchEnvironment, DEFAULT_TOLERANCE, compare, format_report, machine_info, load_json, write_json
+import bench_e2e
+import bench_cut
+import bench_backend
+import bench_output_store
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+
+# シナリオ名 → 実行する関数（各モジュールのSCENARIOSをまとめる）
+SCENARIO_MODULES = (bench_e2e, bench_cut, bench_backend, bench_output_store)
+
+def all_scenarios():
+    scenarios = {}
+    for module in SCENARIO_MODULES:
+        scenarios.update(module.SCENARIOS)
+    return scenarios
+
+def main():
+    scenarios = all_scenarios()
+    parser = argparse.ArgumentParser(description="ローカルの抽出器とメディアサーバーに対するベンチマーク")
+    parser.add_argument("scenarios", nargs="*", help=f"実行するシナリオ（既定: すべて）: {', '.join(scenarios)}")
+    parser.add_argument("--runs", type=int, default=3, help="シナリオごとの繰り返し回数")
+    parser.add_argument("--seconds", type=int, default=60, help="生成する動画の長さ（秒）")
+    parser.add_argument("--bitrate", default="2M", help="生成する動画の映像ビットレート")
+    parser.add_argument("--latency", type=float, default=0.0, help="メディアサーバーの1リクエストあたりの遅延（秒）")
+    parser.add_argument("--bandwidth", type=int, default=0, help="メディアサーバーの接続あたりの帯域（バイト/秒、0で無制限）")
+    parser.add_argument("--sections", type=int, default=4, help="同じ動画から取得する区間の数")
+    parser.add_argument("--users", type=int, default=4, help="同時に投入するユーザー数")
+    parser.add_argument("--workers", default="1,2,4", help="並列エンコードのスケーリングを計測するワーカー数（カンマ区切り）")
+    parser.add_argument("--calls", type=int, default=20, help="yt-dlpの実行方式の比較で、起動後に実行する回数")
+    parser.add_argument("--collisions", type=int, default=10000, help="出力先に同じ名前で保存するファイルの数")
+    parser.add_argument("--clients", type=int, default=4, help="大きなファイルを同時に取得するクライアント数")
+    parser.add_argument("--delivery-mib", type=int, default=1024, help="配信する大きなファイルのサイズ（MiB）")
+    parser.add_argument("--delivery-port", type=int, default=18502, help="配信サーバーのポート番号")
+    parser.add_argument("--output", help="結果を書き出すJSONのパス")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="比較する基準値のJSON")
+    parser.add_argument("--update-baseline", action="store_true", help="結果で基準値を置き換える")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="回帰とみなす悪化の割合")
+    parser.add_argument("--keep", action="store_true", help="作業ディレクトリを削除しない")
+    options = parser.parse_args()
+
+    selected = options.scenarios or list(scenarios)
+    unknown = [name for name in selected if name not in scenarios]
+    if unknown:
+        parser.error(f"不明なシナリオです: {', '.join(unknown)}")
+
+    env = BenchEnvironment(options.seconds, options.bitrate, options.latency, options.bandwidth, keep=options.keep)
+    results = {}
+    try:
+        for name in selected:
+            print(f"実行中: {name}", file=sys.stderr)
+            results[name] = scenarios[name](env, options)
+    finally:
+        env.close()
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": machine_info(),
+        "options": {name: value for name, value in vars(options).items() if name not in ("output", "baseline", "update_baseline", "keep")},
+        "scenarios": results,
+    }
+    print(format_report(results))
+    if options.output:
+        write_json(options.output, report)
+    if options.update_baseline:
+        write_json(options.baseline, report)
+        return
+
+    if os.path.exists(options.baseline):
+        regressions = compare(results, load_json(options.baseline), options.tolerance)
+        for regression in regressions:
+            print(f"[回帰] {regression}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
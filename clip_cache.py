@@ -0,0 +1,302 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+
+from video_cut import cut_section
+from storage import get_storage
+
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "video-section-cache")
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3  # 10GB
+DEFAULT_TTL = 7 * 24 * 60 * 60  # 7日
+# 他のプロセスが追加・削除したエントリを反映するため、容量の索引をディスクから作り直す間隔
+INDEX_RESCAN_INTERVAL = 10 * 60
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def make_cache_key(video_id, format_sort, start_time, end_time):
+    """動画ID・フォーマット指定・区間からキャッシュキーを生成（"1:30"・"01:30"・"00:01:30"は同じ区間として扱う）"""
+    start_seconds = time_to_seconds(start_time) if start_time else None
+    end_seconds = time_to_seconds(end_time) if end_time else None
+    key_source = json.dumps([video_id, format_sort, start_seconds, end_seconds])
+    return hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+
+def section_file_name(entry, start_time, end_time):
+    """キャッシュ済みのエントリのファイル名から、切り出す区間のファイル名（…_開始秒-終了秒.拡張子）を作る"""
+    name, ext = os.path.splitext(entry["file_name"])
+    # 切り出し元が区間のファイルなら、その区間の接尾辞を取り除く
+    if entry.get("start_seconds") is not None and entry.get("end_seconds") is not None:
+        suffix = f"_{entry['start_seconds']}-{entry['end_seconds']}"
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return f"{name}_{time_to_seconds(start_time)}-{time_to_seconds(end_time)}{ext}"
+
+def time_to_seconds(time_str):
+    """MM:SS・HH:MM:SS形式の時間を秒数に変換"""
+    seconds = 0
+    for part in time_str.split(":"):
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+def link_or_copy(src_path, dst_path):
+    """同じファイルシステム上ならハードリンク、そうでなければコピー"""
+    try:
+        os.link(src_path, dst_path)
+    except OSError:
+        shutil.copy2(src_path, dst_path)
+
+def write_json_atomic(path, data):
+    """JSONを一時ファイル経由で書き込み、途中状態が読まれないようにする"""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+class ClipCache:
+    """ダウンロード済みクリップのディスクキャッシュ（LRU・容量上限・TTL付き）"""
+
+    def __init__(self, root=None, max_bytes=None, ttl=None):
+        self.root = root or os.environ.get("CLIP_CACHE_DIR", DEFAULT_CACHE_DIR)
+        self.max_bytes = int(max_bytes if max_bytes is not None else os.environ.get("CLIP_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+        self.ttl = float(ttl if ttl is not None else os.environ.get("CLIP_CACHE_TTL", DEFAULT_TTL))
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "local_cuts": 0, "shared_hits": 0}
+        self.lock = threading.Lock()
+        # 削除のたびに全エントリのメタデータを読まないよう、（動画ID, キー）ごとのサイズ・時刻を保持する
+        self.index = {}
+        self.index_loaded = None
+        os.makedirs(self.root, exist_ok=True)
+
+    def entry_paths(self, video_id, key):
+        """エントリの動画ファイルとメタデータのパスを返す"""
+        video_dir = os.path.join(self.root, video_id)
+        return os.path.join(video_dir, f"{key}.mp4"), os.path.join(video_dir, f"{key}.json")
+
+    def read_entry(self, meta_path):
+        """メタデータを読み込む（壊れている場合はNone）"""
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_expired(self, entry, now):
+        return now - entry["created"] > self.ttl
+
+    def fetch_shared(self, video_id, key):
+        """他のレプリカが作成したクリップを共有ストレージから取得してローカルに置く（ない場合はNone）"""
+        storage = get_storage()
+        if storage is None:
+            return None
+        # メタデータはクリップのアップロード後に書かれるため、メタデータがあればクリップも揃っている
+        entry = storage.read_json(f"clips/{video_id}/{key}.json")
+        if entry is None or self.is_expired(entry, time.time()):
+            return None
+
+        clip_path, meta_path = self.entry_paths(video_id, key)
+        os.makedirs(os.path.dirname(clip_path), exist_ok=True)
+        temp_path = f"{clip_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if not storage.download(f"clips/{video_id}/{key}.mp4", temp_path):
+            return None
+        os.replace(temp_path, clip_path)
+        entry["last_access"] = time.time()
+        write_json_atomic(meta_path, entry)
+        self.index_entry(entry)
+        with self.lock:
+            self.stats["shared_hits"] += 1
+        self.evict()
+        return entry
+
+    def put_shared(self, video_id, key, clip_path, entry):
+        """クリップを共有ストレージに登録し、他のレプリカが再ダウンロードせずに使えるようにする"""
+        storage = get_storage()
+        if storage is None:
+            return
+        storage.upload(f"clips/{video_id}/{key}.mp4", clip_path)
+        storage.write_json(f"clips/{video_id}/{key}.json", entry)
+
+    def get(self, video_id, key):
+        """キャッシュを検索し、ヒットした場合はメタデータ（pathを含む）を返す"""
+        clip_path, meta_path = self.entry_paths(video_id, key)
+        entry = self.read_entry(meta_path)
+        now = time.time()
+
+        if entry is None or not os.path.exists(clip_path) or self.is_expired(entry, now):
+            if entry is not None:
+                self.remove_entry(video_id, key)
+            entry = self.fetch_shared(video_id, key)
+            if entry is None:
+                with self.lock:
+                    self.stats["misses"] += 1
+                return None
+
+        # LRUのために最終アクセス時刻を更新
+        entry["last_access"] = now
+        write_json_atomic(meta_path, entry)
+        self.index_entry(entry)
+        with self.lock:
+            self.stats["hits"] += 1
+        entry["path"] = clip_path
+        return entry
+
+    def put(self, video_id, key, src_path, file_name, format_sort, start_time, end_time):
+        """ダウンロード済みファイルをキャッシュに登録し、キャッシュ上のパスを返す"""
+        clip_path, meta_path = self.entry_paths(video_id, key)
+        os.makedirs(os.path.dirname(clip_path), exist_ok=True)
+
+        # 一時名でリンクしてから置き換え、書き込み途中のファイルを参照させない
+        temp_path = f"{clip_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        link_or_copy(src_path, temp_path)
+        os.replace(temp_path, clip_path)
+
+        now = time.time()
+        entry = {
+            "key": key,
+            "video_id": video_id,
+            "file_name": file_name,
+            "format_sort": format_sort,
+            "start_time": start_time,
+            "end_time": end_time,
+            "start_seconds": time_to_seconds(start_time) if start_time else None,
+            "end_seconds": time_to_seconds(end_time) if end_time else None,
+            "size": os.path.getsize(clip_path),
+            "created": now,
+            "last_access": now,
+        }
+        write_json_atomic(meta_path, entry)
+        self.index_entry(entry)
+        self.put_shared(video_id, key, clip_path, entry)
+
+        self.evict()
+        return clip_path
+
+    def find_covering(self, video_id, format_sort, start_time, end_time):
+        """指定区間を含むキャッシュ済みの動画（全体または、より広い区間）を探す"""
+        start_seconds = time_to_seconds(start_time)
+        end_seconds = time_to_seconds(end_time)
+        now = time.time()
+        candidates = []
+        for entry in self.list_entries(video_id):
+            if entry["format_sort"] != format_sort or self.is_expired(entry, now):
+                continue
+            if not os.path.exists(entry["path"]):
+                continue
+            if entry.get("start_seconds") is None:
+                # 動画全体
+                candidates.append(entry)
+            elif entry["start_seconds"] <= start_seconds and end_seconds <= entry["end_seconds"]:
+                candidates.append(entry)
+
+        if not candidates:
+            return None
+        # 切り出しにかかる時間が短くなるよう、最も小さいファイルを選ぶ
+        return min(candidates, key=lambda e: e["size"])
+
+    def cut_from_cache(self, video_id, key, format_sort, start_time, end_time, output_dir, cut_mode=None):
+        """キャッシュ済みの動画から区間をローカルで切り出し、キャッシュに登録したうえで出力先のパスを返す"""
+        covering_entry = self.find_covering(video_id, format_sort, start_time, end_time)
+        if covering_entry is None:
+            return None
+
+        # キャッシュ内のファイルは区間の開始位置が0秒になっているため、相対位置で切り出す
+        offset = time_to_seconds(start_time) - (covering_entry.get("start_seconds") or 0)
+        duration = time_to_seconds(end_time) - time_to_seconds(start_time)
+        file_name = section_file_name(covering_entry, start_time, end_time)
+        output_path = os.path.join(output_dir, file_name)
+        cut_section(covering_entry["path"], output_path, offset, duration, cut_mode)
+
+        # 切り出し元も利用されたものとしてLRUの順序を更新
+        covering_entry["last_access"] = time.time()
+        covering_path = covering_entry.pop("path")
+        write_json_atomic(os.path.splitext(covering_path)[0] + ".json", covering_entry)
+        self.index_entry(covering_entry)
+
+        with self.lock:
+            self.stats["local_cuts"] += 1
+        self.put(video_id, key, output_path, file_name, format_sort, start_time, end_time)
+        return output_path
+
+    def remove_entry(self, video_id, key):
+        for path in reversed(self.entry_paths(video_id, key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        with self.lock:
+            self.index.pop((video_id, key), None)
+
+    def list_entries(self, video_id=None):
+        """キャッシュ内のエントリを列挙（video_id指定時はその動画のみ）"""
+        video_ids = [video_id] if video_id else os.listdir(self.root)
+        entries = []
+        for vid in video_ids:
+            video_dir = os.path.join(self.root, vid)
+            if not os.path.isdir(video_dir):
+                continue
+            for name in os.listdir(video_dir):
+                if not name.endswith(".json"):
+                    continue
+                entry = self.read_entry(os.path.join(video_dir, name))
+                if entry is not None:
+                    entry["path"] = os.path.join(video_dir, f"{entry['key']}.mp4")
+                    entries.append(entry)
+        return entries
+
+    def index_entry(self, entry):
+        """エントリのサイズ・作成時刻・最終アクセス時刻を索引に反映"""
+        with self.lock:
+            self.index[(entry["video_id"], entry["key"])] = {
+                "size": entry["size"], "created": entry["created"], "last_access": entry["last_access"]
+            }
+
+    def load_index(self, now):
+        """ディスク上のエントリから索引を作り直す（ファイルがないエントリはここで削除）"""
+        index = {}
+        for entry in self.list_entries():
+            if os.path.exists(entry["path"]):
+                index[(entry["video_id"], entry["key"])] = {
+                    "size": entry["size"], "created": entry["created"], "last_access": entry["last_access"]
+                }
+            else:
+                self.remove_entry(entry["video_id"], entry["key"])
+        with self.lock:
+            self.index = index
+            self.index_loaded = now
+
+    def evict(self):
+        """TTL切れのエントリと、容量上限を超えた分を古いアクセス順に削除（索引だけを見て決める）"""
+        now = time.time()
+        if self.index_loaded is None or now - self.index_loaded > INDEX_RESCAN_INTERVAL:
+            self.load_index(now)
+
+        with self.lock:
+            victims = [item for item, entry in self.index.items() if self.is_expired(entry, now)]
+            remaining = [(entry["last_access"], entry["size"], item) for item, entry in self.index.items() if not self.is_expired(entry, now)]
+        total_bytes = sum(size for _, size, _ in remaining)
+        if total_bytes > self.max_bytes:
+            for _, size, item in sorted(remaining):
+                if total_bytes <= self.max_bytes:
+                    break
+                victims.append(item)
+                total_bytes -= size
+
+        for video_id, key in victims:
+            self.remove_entry(video_id, key)
+            with self.lock:
+                self.stats["evictions"] += 1
+
+    def get_stats(self):
+        """ヒット・ミス・削除・ローカル切り出しの回数を返す"""
+        with self.lock:
+            return dict(self.stats)
+
+def get_default_cache():
+    """プロセス全体で共有するキャッシュを取得"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ClipCache()
+        return _default_cache
@@ -0,0 +1,22 @@
+import os
+
+def is_cloud_environment():
+    """クラウド環境（Streamlit Cloud、Railway等）で動いているかを判定"""
+    try:
+        home = os.environ.get("HOME", "").lower()
+        return (
+            "STREAMLIT_SHARING" in os.environ or
+            "streamlit" in home or
+            "appuser" in home or
+            os.path.exists("/home/appuser") or
+            "RAILWAY_ENVIRONMENT" in os.environ or
+            "PORT" in os.environ
+        )
+    except Exception:
+        return False
+
+def get_cookie_options():
+    """ローカル環境でのみブラウザのクッキーを使うyt-dlpオプションを返す（CLI・Streamlit・APIサーバーで共通）"""
+    if is_cloud_environment():
+        return []
+    return ["--cookies-from-browser", "chrome"]
@@ -0,0 +1,211 @@
+import os
+import json
+import time
+import tempfile
+import threading
+from statistics import median
+from urllib.parse import urlparse
+
+from clip_cache import write_json_atomic
+from ytdlp_backend import run_ytdlp_command
+
+DEFAULT_TUNING_FILE = os.path.join(tempfile.gettempdir(), "download-tuning.json")
+DEFAULT_SETTINGS = {"concurrent_fragments": 1, "chunk_size": 10 * 1024 * 1024}
+DEFAULT_MAX_FRAGMENTS = 16
+MIN_CHUNK_SIZE = 1024 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+# 回線状況の変化に追従できるよう、古い計測結果は捨てて探索し直す
+DEFAULT_TUNING_TTL = 24 * 60 * 60
+# 直近の計測をどの程度重視するか（指数移動平均の係数）
+SMOOTHING = 0.5
+# これより小さいダウンロードは接続の立ち上がりに左右されるため計測に使わない
+MIN_SAMPLE_BYTES = 4 * 1024 * 1024
+
+_tuner = None
+_tuner_lock = threading.Lock()
+
+def host_key(url):
+    """設定を共有する単位としてURLのホスト名を返す（www.は区別しない）"""
+    host = (urlparse(url).hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host
+
+def settings_key(settings):
+    return f"{settings['concurrent_fragments']}:{settings['chunk_size']}"
+
+def tuning_options(settings):
+    """設定をyt-dlpのオプションに変換"""
+    return [
+        "--concurrent-fragments", str(settings["concurrent_fragments"]),
+        "--http-chunk-size", str(settings["chunk_size"]),
+    ]
+
+class ThroughputMeter:
+    """進捗の通知から、ダウンロード全体と断片ごとのスループットを計測"""
+
+    def __init__(self):
+        self.started = None
+        self.finished_bytes = 0  # 完了したファイル（映像・音声・各区間）の合計
+        self.current_bytes = 0
+        self.fragment_index = None
+        self.fragment_started = None
+        self.fragment_bytes = 0
+        self.fragment_rates = []
+
+    def update(self, progress):
+        now = time.monotonic()
+        downloaded = progress.get("downloaded_bytes")
+        if downloaded is None:
+            return
+        if self.started is None:
+            # 情報抽出の時間は設定で変わらないため、最初の進捗から計測する
+            self.started = now
+        if downloaded < self.current_bytes:
+            # 次のファイルのダウンロードに移った
+            self.finished_bytes += self.current_bytes
+            self.fragment_index = None
+        self.current_bytes = downloaded
+
+        fragment_index = progress.get("fragment_index")
+        if fragment_index is not None and fragment_index != self.fragment_index:
+            if self.fragment_index is not None and now > self.fragment_started:
+                self.fragment_rates.append((downloaded - self.fragment_bytes) / (now - self.fragment_started))
+            self.fragment_index = fragment_index
+            self.fragment_started = now
+            self.fragment_bytes = downloaded
+
+    @property
+    def total_bytes(self):
+        return self.finished_bytes + self.current_bytes
+
+    def throughput(self):
+        """開始からの平均スループット（バイト/秒）"""
+        if self.started is None:
+            return None
+        elapsed = time.monotonic() - self.started
+        return self.total_bytes / elapsed if elapsed > 0 else None
+
+    def fragment_throughput(self):
+        """断片ごとのスループットの中央値（断片形式でなければNone）"""
+        return median(self.fragment_rates) if self.fragment_rates else None
+
+class DownloadTuner:
+    """ホストごとに断片の同時取得数とチャンクサイズを計測結果から探索し、最良の設定を記憶する"""
+
+    def __init__(self, path=None, max_fragments=None, ttl=None):
+        self.path = path or os.environ.get("DOWNLOAD_TUNING_FILE", DEFAULT_TUNING_FILE)
+        self.max_fragments = int(max_fragments or os.environ.get("DOWNLOAD_TUNING_MAX_FRAGMENTS", DEFAULT_MAX_FRAGMENTS))
+        self.ttl = float(ttl if ttl is not None else os.environ.get("DOWNLOAD_TUNING_TTL", DEFAULT_TUNING_TTL))
+        self.lock = threading.Lock()
+        self.hosts = self.load()
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def fresh_samples(self, host):
+        now = time.time()
+        samples = self.hosts.get(host, {}).get("samples", {})
+        return {key: sample for key, sample in samples.items() if now - sample["updated"] <= self.ttl}
+
+    def best_settings(self, host):
+        """計測済みの中で最もスループットの高い設定を返す（未計測なら既定値）"""
+        with self.lock:
+            samples = self.fresh_samples(host)
+        if not samples:
+            return dict(DEFAULT_SETTINGS)
+        best = max(samples.values(), key=lambda sample: sample["throughput"])
+        return {"concurrent_fragments": best["concurrent_fragments"], "chunk_size": best["chunk_size"]}
+
+    def neighbors(self, settings):
+        """探索候補（増やす方向を先に試す）"""
+        fragments = settings["concurrent_fragments"]
+        chunk_size = settings["chunk_size"]
+        candidates = [
+            {"concurrent_fragments": min(fragments * 2, self.max_fragments), "chunk_size": chunk_size},
+            {"concurrent_fragments": fragments, "chunk_size": min(chunk_size * 2, MAX_CHUNK_SIZE)},
+            {"concurrent_fragments": max(fragments // 2, 1), "chunk_size": chunk_size},
+            {"concurrent_fragments": fragments, "chunk_size": max(chunk_size // 2, MIN_CHUNK_SIZE)},
+        ]
+        return [candidate for candidate in candidates if candidate != settings]
+
+    def next_settings(self, host):
+        """次のダウンロードで使う設定を返す（最良の設定の隣に未計測のものがあればそれを試す）"""
+        best = self.best_settings(host)
+        with self.lock:
+            samples = self.fresh_samples(host)
+        for candidate in self.neighbors(best):
+            if settings_key(candidate) not in samples:
+                return candidate
+        return best
+
+    def record(self, host, settings, meter):
+        """計測結果を反映して保存（小さすぎるダウンロードは無視）"""
+        throughput = meter.throughput()
+        if throughput is None or meter.total_bytes < MIN_SAMPLE_BYTES:
+            return
+        with self.lock:
+            samples = self.hosts.setdefault(host, {}).setdefault("samples", {})
+            sample = samples.get(settings_key(settings))
+            if sample is not None and time.time() - sample["updated"] <= self.ttl:
+                # 同じ設定の過去の計測と平均し、一時的な揺らぎで最良の設定が入れ替わらないようにする
+                throughput = SMOOTHING * throughput + (1 - SMOOTHING) * sample["throughput"]
+                count = sample["count"] + 1
+            else:
+                count = 1
+            samples[settings_key(settings)] = dict(
+                settings,
+                throughput=throughput,
+                fragment_throughput=meter.fragment_throughput(),
+                count=count,
+                updated=time.time(),
+            )
+            hosts = json.loads(json.dumps(self.hosts))
+        try:
+            write_json_atomic(self.path, hosts)
+        except OSError:
+            pass  # 保存できなくてもダウンロード自体は成功しているため無視
+
+    def get_stats(self):
+        """ホストごとの最良の設定とスループットを返す"""
+        stats = {}
+        with self.lock:
+            for host in self.hosts:
+                samples = self.fresh_samples(host)
+                if samples:
+                    stats[host] = max(samples.values(), key=lambda sample: sample["throughput"])
+        return stats
+
+def is_tuning_enabled():
+    """環境変数DOWNLOAD_TUNINGが0の場合は自動調整を行わない"""
+    return os.environ.get("DOWNLOAD_TUNING", "1") != "0"
+
+def run_tuned_command(cmd, url, on_progress=None):
+    """ホストごとに調整した同時取得数・チャンクサイズでyt-dlpを実行し、計測結果を次回の設定に反映"""
+    if not is_tuning_enabled():
+        return run_ytdlp_command(cmd, on_progress=on_progress)
+
+    tuner = get_tuner()
+    host = host_key(url)
+    settings = tuner.next_settings(host)
+    meter = ThroughputMeter()
+
+    def handle_progress(progress):
+        meter.update(progress)
+        if on_progress is not None:
+            on_progress(progress)
+
+    # 実行中のyt-dlpの設定は変えられないため、調整は次のダウンロードから反映される
+    result = run_ytdlp_command(cmd[:1] + tuning_options(settings) + cmd[1:], on_progress=handle_progress)
+    tuner.record(host, settings, meter)
+    return result
+
+def get_tuner():
+    """プロセス全体で共有するダウンロード設定の調整器を取得"""
+    global _tuner
+    with _tuner_lock:
+        if _tuner is None:
+            _tuner = DownloadTuner()
+        return _tuner
@@ -0,0 +1,148 @@
+import os
+import re
+import glob
+import shutil
+import tempfile
+
+from clip_cache import get_default_cache, make_cache_key, time_to_seconds
+from video_cut import trim_in_place
+from metrics import span
+from cookies import get_cookie_options
+from download_tuning import run_tuned_command
+from sections import section_output_template, section_map_options, read_section_map
+
+# CLI・Streamlit・APIサーバーで共通のyt-dlpコマンドの組み立てと、区間のダウンロード・切り出し
+
+FORMAT_SORT = "codec:avc:aac,res:1080,fps:60,hdr:sdr"
+OUTPUT_TEMPLATE = "%(title)s_%(height)s_%(fps)s_%(vcodec.:4)s_(%(id)s).%(ext)s"
+
+def validate_time_format(time_str):
+    """時間フォーマットを検証（00:00, 00:12, 01:22:33, 0000, 000010形式）"""
+    # MM:SS または HH:MM:SS 形式
+    colon_pattern = r'^\d{1,2}:\d{2}(:\d{2})?$'
+    # MMSS または HHMMSS 形式（4桁または6桁）
+    digit_pattern = r'^\d{4}$|^\d{6}$'
+
+    return re.match(colon_pattern, time_str) is not None or re.match(digit_pattern, time_str) is not None
+
+def normalize_time_format(time_str):
+    """時間フォーマットを正規化（4桁・6桁をMM:SS・HH:MM:SS形式に変換）"""
+    if re.match(r'^\d{4}$', time_str):
+        # 4桁の場合：MMSS -> MM:SS
+        return f"{time_str[:2]}:{time_str[2:]}"
+    elif re.match(r'^\d{6}$', time_str):
+        # 6桁の場合：HHMMSS -> HH:MM:SS
+        return f"{time_str[:2]}:{time_str[2:4]}:{time_str[4:]}"
+    else:
+        # すでに正しい形式の場合はそのまま返す
+        return time_str
+
+def validate_youtube_url(url):
+    """YouTubeのURLを検証"""
+    youtube_patterns = [
+        r'https?://(?:www\.)?youtube\.com/watch\?v=[\w-]+',
+        r'https?://youtu\.be/[\w-]+',
+        r'https?://(?:www\.)?youtube\.com/embed/[\w-]+',
+        r'https?://(?:www\.)?youtube\.com/shorts/[\w-]+'
+    ]
+    return any(re.match(pattern, url) for pattern in youtube_patterns)
+
+def extract_video_id(url):
+    """YouTubeのURLから動画IDを抽出"""
+    id_patterns = [
+        r'https?://(?:www\.)?youtube\.com/watch\?v=([\w-]+)',
+        r'https?://youtu\.be/([\w-]+)',
+        r'https?://(?:www\.)?youtube\.com/embed/([\w-]+)',
+        r'https?://(?:www\.)?youtube\.com/shorts/([\w-]+)'
+    ]
+    for pattern in id_patterns:
+        match = re.match(pattern, url)
+        if match:
+            return match.group(1)
+    return None
+
+def build_command(youtube_url, sections, cut_mode):
+    """yt-dlpコマンドを構築（sectionsは（開始, 終了）のリスト、空なら動画全体）"""
+    cmd = [
+        "yt-dlp",
+        "-S", FORMAT_SORT
+    ]
+
+    # ローカル環境でのみクッキーオプションを追加
+    cmd.extend(get_cookie_options())
+
+    # 時間指定がある場合のみセクションダウンロードを追加（複数区間は1回の実行でまとめて取得）
+    for normalized_start, normalized_end in sections:
+        cmd.extend(["--download-sections", f"*{normalized_start}-{normalized_end}"])
+    # スマートカット・並列エンコードではダウンロード後にローカルで切り出すため、yt-dlpでのキーフレーム挿入は行わない
+    if sections and cut_mode == "reencode":
+        cmd.append("--force-keyframes-at-cuts")
+
+    # 複数区間の場合は区間ごとに別のファイル名で保存
+    output_template = section_output_template(OUTPUT_TEMPLATE) if len(sections) > 1 else OUTPUT_TEMPLATE
+    cmd.extend([
+        "-f", "bv+ba",
+        "-o", output_template,
+        youtube_url
+    ])
+    return cmd
+
+def run_ytdlp(cmd, sections, youtube_url, video_id=None, on_progress=None):
+    """yt-dlpを実行し、一時ディレクトリに区間ごとにダウンロードしたファイルの情報を返す（一時ディレクトリの削除は呼び出し側で行う）"""
+    temp_dir = tempfile.mkdtemp()
+    try:
+        temp_cmd = cmd.copy()
+
+        # 一時ディレクトリに出力するように変更
+        for i, arg in enumerate(temp_cmd):
+            if arg == "-o":
+                temp_cmd[i+1] = os.path.join(temp_dir, temp_cmd[i+1])
+                break
+
+        # 複数区間の場合は、どのファイルがどの区間かをyt-dlpに書き出させる
+        map_path = os.path.join(temp_dir, "sections.tsv")
+        if len(sections) > 1:
+            temp_cmd[1:1] = section_map_options(map_path)
+
+        with span("download", video_id=video_id, sections=len(sections)) as download_span:
+            # yt-dlpコマンドを実行（YTDLP_BACKENDに応じてサブプロセスまたは常駐ワーカーで実行し、断片の同時取得数はホストごとに自動調整）
+            result = run_tuned_command(temp_cmd, youtube_url, on_progress=on_progress)
+
+            # 一時ディレクトリからダウンロードされたファイルを取得
+            if len(sections) > 1:
+                temp_files = read_section_map(map_path, sections) if os.path.exists(map_path) else {}
+            else:
+                temp_files = {sections[0]: path for path in glob.glob(os.path.join(temp_dir, "*.mp4"))[:1]}
+            download_span.add_bytes(sum(os.path.getsize(path) for path in temp_files.values() if os.path.exists(path)))
+        if any(not os.path.exists(temp_files.get(section, "")) for section in sections):
+            raise RuntimeError("ダウンロードに失敗しました。")
+    except Exception:
+        # 一時ディレクトリをクリーンアップ
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+    return {"temp_dir": temp_dir, "temp_files": temp_files, "output": result.stdout}
+
+def cut_from_cache(video_id, section, output_dir, cut_mode):
+    """全体動画やより広い区間のキャッシュから区間を切り出す（キャッシュにない場合はNone）"""
+    normalized_start, normalized_end = section
+    with span("cut", video_id=video_id, cut_mode=cut_mode, source="cache") as cut_span:
+        temp_file = get_default_cache().cut_from_cache(
+            video_id, make_cache_key(video_id, FORMAT_SORT, normalized_start, normalized_end), FORMAT_SORT,
+            normalized_start, normalized_end, output_dir, cut_mode
+        )
+        cut_span.add_bytes(os.path.getsize(temp_file) if temp_file else 0)
+    return temp_file
+
+def trim_download(temp_file, video_id, section, cut_mode):
+    """キーフレームを揃えずにダウンロードした区間を、ローカルで正確な長さに切り出す"""
+    normalized_start, normalized_end = section
+    with span("cut", video_id=video_id, cut_mode=cut_mode) as cut_span:
+        trim_in_place(temp_file, time_to_seconds(normalized_end) - time_to_seconds(normalized_start), cut_mode)
+        cut_span.add_bytes(os.path.getsize(temp_file))
+
+def cache_clip(video_id, section, temp_file):
+    """次回以降の同じリクエストのために、区間のクリップをキャッシュへ登録"""
+    get_default_cache().put(
+        video_id, make_cache_key(video_id, FORMAT_SORT, *section), temp_file, os.path.basename(temp_file),
+        FORMAT_SORT, *section
+    )
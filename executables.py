@@ -0,0 +1,52 @@
+import os
+import shlex
+import threading
+import subprocess
+
+from metrics import wait_child
+
+# コマンド名ごとに、実行ファイルを差し替えるための環境変数
+EXECUTABLE_ENV = {
+    "yt-dlp": "YTDLP_BIN",
+    "ffmpeg": "FFMPEG_BIN",
+    "ffprobe": "FFPROBE_BIN",
+}
+
+def get_executable(name):
+    """環境変数で指定された実行ファイル（引数付きも可）を返す（未指定ならコマンド名のみ）"""
+    env_value = os.environ.get(EXECUTABLE_ENV.get(name, ""), "").strip()
+    return shlex.split(env_value) if env_value else [name]
+
+def ytdlp_ffmpeg_options():
+    """ffmpegが差し替えられている場合に、yt-dlpが内部で使うffmpegも揃えるオプションを返す"""
+    if os.environ.get("FFMPEG_BIN"):
+        return ["--ffmpeg-location", get_executable("ffmpeg")[0]]
+    return []
+
+def resolve_command(cmd):
+    """表示用のコマンドを、実際に実行する実行ファイルに置き換えたコマンドに変換"""
+    options = ytdlp_ffmpeg_options() if cmd[0] == "yt-dlp" else []
+    return get_executable(cmd[0]) + options + list(cmd[1:])
+
+def run_executable(cmd):
+    """subprocess.run(check=True, capture_output=True, text=True)と同じくコマンドを実行し、子プロセスの使用量を計測区間に加える"""
+    cmd = resolve_command(cmd)
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    try:
+        # 両方のパイプを同時に読み、どちらかが詰まって子プロセスが止まらないようにする
+        stderr = []
+        stderr_thread = threading.Thread(target=lambda: stderr.append(process.stderr.read()), daemon=True)
+        stderr_thread.start()
+        stdout = process.stdout.read()
+        stderr_thread.join()
+    except BaseException:
+        process.kill()
+        wait_child(process)
+        raise
+    finally:
+        process.stdout.close()
+        process.stderr.close()
+    returncode = wait_child(process)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd, stdout, stderr[0])
+    return subprocess.CompletedProcess(cmd, returncode, stdout, stderr[0])
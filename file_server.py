@@ -0,0 +1,223 @@
+import os
+import re
+import secrets
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import quote
+
+from metrics import span, render_prometheus
+from clip_cache import get_default_cache
+from storage import get_storage
+
+try:
+    from starlette.concurrency import run_in_threadpool
+    from starlette.responses import Response, StreamingResponse
+    from starlette.routing import Route
+except ImportError:
+    Route = None  # Streamlitのサーバーに相乗りしない場合は不要
+
+DEFAULT_HOST = "0.0.0.0"
+DEFAULT_PORT = 8502
+# Streamlitのサーバーから送信する際に1回で読み込む量
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+_files = {}
+_files_lock = threading.Lock()
+_server = None
+_server_lock = threading.Lock()
+# Streamlitのサーバーにルートを追加済みの場合はTrue（別ポートのサーバーを起動しない）
+_mounted = False
+
+def register_file(path, file_name, clip=None):
+    """配信するファイルを登録し、推測されにくいトークンを返す（clipを渡すと、他のレプリカでも共有キャッシュから配信できる）"""
+    token = secrets.token_urlsafe(16)
+    with _files_lock:
+        _files[token] = (os.path.abspath(path), file_name)
+    storage = get_storage()
+    if clip is not None and storage is not None:
+        storage.write_json(f"files/{token}.json", {"file_name": file_name, **clip})
+    return token
+
+def unregister_file(token):
+    """配信対象からファイルを外す"""
+    with _files_lock:
+        _files.pop(token, None)
+    storage = get_storage()
+    if storage is not None:
+        storage.delete(f"files/{token}.json")
+
+def lookup_file(token):
+    """トークンに対応する（パス, ファイル名）を返す"""
+    with _files_lock:
+        entry = _files.get(token)
+    if entry is not None:
+        return entry
+    # 別のレプリカで登録されたファイルは、共有ストレージ経由でキャッシュに取得して配信する
+    storage = get_storage()
+    shared_file = storage.read_json(f"files/{token}.json") if storage is not None else None
+    if shared_file is None:
+        return None
+    cached_entry = get_default_cache().get(shared_file["video_id"], shared_file["key"])
+    if cached_entry is None:
+        return None
+    return cached_entry["path"], shared_file["file_name"]
+
+def get_server_port():
+    """配信サーバーのポート番号を取得"""
+    return int(os.environ.get("FILE_SERVER_PORT", DEFAULT_PORT))
+
+def file_url(token):
+    """ブラウザからアクセスするダウンロードURLを生成（Streamlitのサーバーから配信する場合はページと同じオリジンの相対URL）"""
+    default_url = "" if _mounted else f"http://localhost:{get_server_port()}"
+    base_url = os.environ.get("FILE_SERVER_PUBLIC_URL", default_url)
+    return f"{base_url.rstrip('/')}/files/{token}"
+
+def parse_range_header(range_header, file_size):
+    """Rangeヘッダーを解析して（開始, 終了）を返す（不正な場合はNone）"""
+    match = re.match(r'^bytes=(\d*)-(\d*)$', range_header.strip())
+    if not match or (not match.group(1) and not match.group(2)):
+        return None
+
+    if not match.group(1):
+        # bytes=-N の場合：末尾からNバイト
+        suffix_length = int(match.group(2))
+        if suffix_length == 0:
+            return None
+        return max(0, file_size - suffix_length), file_size - 1
+
+    start = int(match.group(1))
+    end = int(match.group(2)) if match.group(2) else file_size - 1
+    if start >= file_size or end < start:
+        return None
+    return start, min(end, file_size - 1)
+
+def prepare_file_response(file_size, file_name, range_header):
+    """Rangeヘッダーに応じた（ステータス, ヘッダー, 開始位置, 長さ）を返す（範囲が不正な場合は416）"""
+    start, end = 0, file_size - 1
+    status = 200
+    if range_header:
+        byte_range = parse_range_header(range_header, file_size)
+        if byte_range is None:
+            return 416, {"Content-Range": f"bytes */{file_size}", "Content-Length": "0"}, 0, 0
+        start, end = byte_range
+        status = 206
+
+    length = max(0, end - start + 1)
+    headers = {
+        "Content-Type": "video/mp4",
+        "Content-Length": str(length),
+        "Accept-Ranges": "bytes",
+        # 日本語のタイトルもそのまま保存できるようにRFC 5987形式で指定
+        "Content-Disposition": f"attachment; filename*=UTF-8''{quote(file_name)}",
+    }
+    if status == 206:
+        headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+    return status, headers, start, length
+
+class FileRequestHandler(BaseHTTPRequestHandler):
+    """登録済みファイルをディスクから少しずつ送信するハンドラー"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self.send_file(send_body=False)
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] == "/metrics":
+            self.send_metrics()
+            return
+        self.send_file(send_body=True)
+
+    def send_metrics(self):
+        """Prometheus形式で計測結果を返す"""
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_file(self, send_body):
+        match = re.match(r'^/files/([\w-]+)$', self.path.split("?", 1)[0])
+        entry = lookup_file(match.group(1)) if match else None
+        if entry is None or not os.path.exists(entry[0]):
+            self.send_error(404)
+            return
+
+        path, file_name = entry
+        with open(path, "rb") as f:
+            status, headers, start, length = prepare_file_response(os.fstat(f.fileno()).st_size, file_name, self.headers.get("Range"))
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+
+            if status == 416 or not send_body or length == 0:
+                return
+
+            try:
+                with span("delivery", file_name=file_name, status_code=status) as delivery_span:
+                    self.wfile.flush()
+                    # 可能な場合はsendfileでカーネルから直接送信し、ユーザー空間にデータを持たない
+                    delivery_span.add_bytes(self.connection.sendfile(f, offset=start, count=length))
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # クライアントの切断は無視
+
+    def log_message(self, format, *args):
+        pass  # アクセスログは出力しない
+
+def start_server():
+    """配信サーバーをバックグラウンドスレッドで起動（起動済み、またはStreamlitのサーバーから配信する場合は何もしない）"""
+    global _server
+    with _server_lock:
+        if _server is not None or _mounted:
+            return _server
+
+        host = os.environ.get("FILE_SERVER_HOST", DEFAULT_HOST)
+        _server = ThreadingHTTPServer((host, get_server_port()), FileRequestHandler)
+        _server.daemon_threads = True
+        thread = threading.Thread(target=_server.serve_forever, daemon=True)
+        thread.start()
+        return _server
+
+async def serve_file(request):
+    """Streamlitのサーバー上で登録済みファイルを配信するルート（ディスクから少しずつ読み込んで送信）"""
+    entry = lookup_file(request.path_params["token"])
+    if entry is None or not os.path.exists(entry[0]):
+        return Response(status_code=404)
+
+    path, file_name = entry
+    status, headers, start, length = prepare_file_response(os.path.getsize(path), file_name, request.headers.get("range"))
+    if request.method == "HEAD" or status == 416 or length == 0:
+        return Response(status_code=status, headers=headers)
+
+    async def read_chunks():
+        with span("delivery", file_name=file_name, status_code=status) as delivery_span:
+            with open(path, "rb") as f:
+                f.seek(start)
+                remaining = length
+                while remaining > 0:
+                    # 送信し終えるまで次を読まないため、ファイルの大きさに関わらずメモリ使用量は一定
+                    chunk = await run_in_threadpool(f.read, min(STREAM_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    delivery_span.add_bytes(len(chunk))
+                    yield chunk
+
+    return StreamingResponse(read_chunks(), status_code=status, headers=headers)
+
+async def serve_metrics(request):
+    """Prometheus形式で計測結果を返すルート"""
+    return Response(render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def file_routes():
+    """Streamlitのサーバー（st.App）に追加するルートを返し、以降のダウンロードURLを同じポートに向ける"""
+    global _mounted
+    if Route is None:
+        raise RuntimeError("Streamlitのサーバーから配信するにはstarletteが必要です。")
+    _mounted = True
+    return [
+        Route("/files/{token}", serve_file, methods=["GET", "HEAD"]),
+        Route("/metrics", serve_metrics, methods=["GET"]),
+    ]
@@ -0,0 +1,289 @@
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict, deque
+
+from metrics import register_gauge
+from storage import get_storage
+
+DEFAULT_DOWNLOAD_CONCURRENCY = 2
+DEFAULT_ENCODE_CONCURRENCY = 1
+JOB_RETENTION_SECONDS = 60 * 60  # 完了したジョブの情報を保持する時間
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+_single_flight = None
+
+class Job:
+    """スケジューラーに投入されたダウンロードジョブ"""
+
+    def __init__(self, session_id, download_fn, encode_fn=None):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.download_fn = download_fn
+        self.encode_fn = encode_fn
+        self.status = "queued"  # queued → downloading → (waiting_encode → encoding) → done / error
+        self.result = None
+        self.error = None
+        self.message = None
+        self.output = None
+        self.progress = None
+        self.download_state = None
+        self.clips = None  # 他のレプリカが結果を取得するためのクリップ（動画ID・キャッシュキー）
+        self.created = time.time()
+        self.finished = None
+
+    @property
+    def is_finished(self):
+        return self.status in ("done", "error")
+
+class SkipEncode:
+    """ダウンロード段階で結果が確定し、切り出し段階が不要なことを示す"""
+
+    def __init__(self, result):
+        self.result = result
+
+class FairQueue:
+    """セッションごとのFIFOを順番に取り出すキュー（1人が大量に投入しても他の人を待たせない）"""
+
+    def __init__(self):
+        self.queues = OrderedDict()
+        self.condition = threading.Condition()
+
+    def put(self, session_id, item):
+        with self.condition:
+            self.queues.setdefault(session_id, deque()).append(item)
+            self.condition.notify()
+
+    def get(self):
+        with self.condition:
+            while not self.queues:
+                self.condition.wait()
+            # 先頭のセッションから1件取り出し、そのセッションを末尾に回す
+            session_id, queue = next(iter(self.queues.items()))
+            item = queue.popleft()
+            del self.queues[session_id]
+            if queue:
+                self.queues[session_id] = queue
+            return item
+
+    def position(self, item):
+        """取り出されるまでに先に処理されるジョブの数を返す（キューにない場合はNone）"""
+        with self.condition:
+            queues = [list(queue) for queue in self.queues.values()]
+        # ラウンドロビンの順に並べ替えて位置を数える
+        order = []
+        while any(queues):
+            for queue in queues:
+                if queue:
+                    order.append(queue.pop(0))
+        return order.index(item) if item in order else None
+
+    def __len__(self):
+        with self.condition:
+            return sum(len(queue) for queue in self.queues.values())
+
+class JobScheduler:
+    """ダウンロードと切り出し（エンコード）の同時実行数をそれぞれ制限するジョブスケジューラー"""
+
+    def __init__(self, download_concurrency=None, encode_concurrency=None):
+        self.download_concurrency = int(download_concurrency or os.environ.get("DOWNLOAD_CONCURRENCY", DEFAULT_DOWNLOAD_CONCURRENCY))
+        self.encode_concurrency = int(encode_concurrency or os.environ.get("ENCODE_CONCURRENCY", DEFAULT_ENCODE_CONCURRENCY))
+        self.download_queue = FairQueue()
+        self.encode_queue = FairQueue()
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+        for _ in range(self.download_concurrency):
+            threading.Thread(target=self.download_worker, daemon=True).start()
+        for _ in range(self.encode_concurrency):
+            threading.Thread(target=self.encode_worker, daemon=True).start()
+
+    def submit(self, session_id, download_fn, encode_fn=None):
+        """ジョブを投入してジョブIDを返す"""
+        job = Job(session_id, download_fn, encode_fn)
+        with self.lock:
+            self.prune_jobs()
+            self.jobs[job.id] = job
+        self.publish(job)
+        self.download_queue.put(session_id, job)
+        return job.id
+
+    def get_job(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def publish(self, job):
+        """ジョブの状態を共有ストレージに書き出し、他のレプリカからも参照できるようにする"""
+        storage = get_storage()
+        if storage is None:
+            return
+        try:
+            storage.write_json(f"jobs/{job.id}.json", {
+                "id": job.id,
+                "status": job.status,
+                "message": job.message,
+                "error": str(job.error) if job.error is not None else None,
+                "clips": job.clips,
+                "finished": job.finished,
+            })
+        except Exception:
+            pass  # 共有できなくてもジョブ自体は続ける
+
+    def get_shared_job(self, job_id):
+        """他のレプリカで実行されたジョブの状態を共有ストレージから取得（ない場合はNone）"""
+        storage = get_storage()
+        if storage is None:
+            return None
+        return storage.read_json(f"jobs/{job_id}.json")
+
+    def queue_position(self, job):
+        """ジョブより先に処理されるジョブの数を返す"""
+        if job.status == "queued":
+            return self.download_queue.position(job)
+        if job.status == "waiting_encode":
+            return self.encode_queue.position(job)
+        return None
+
+    def prune_jobs(self):
+        """保持期間を過ぎた完了済みジョブを削除"""
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job.is_finished and now - job.finished > JOB_RETENTION_SECONDS:
+                del self.jobs[job_id]
+
+    def finish(self, job, result=None, error=None):
+        job.result = result
+        job.error = error
+        job.status = "error" if error is not None else "done"
+        job.finished = time.time()
+        self.publish(job)
+
+    def download_worker(self):
+        while True:
+            job = self.download_queue.get()
+            job.status = "downloading"
+            self.publish(job)
+            try:
+                state = job.download_fn(job)
+            except Exception as e:
+                self.finish(job, error=e)
+                continue
+
+            if job.encode_fn is None:
+                self.finish(job, result=state)
+            elif isinstance(state, SkipEncode):
+                self.finish(job, result=state.result)
+            else:
+                # 切り出しは別の上限で実行するため、エンコード用のキューに回す
+                job.download_state = state
+                job.status = "waiting_encode"
+                self.encode_queue.put(job.session_id, job)
+
+    def encode_worker(self):
+        while True:
+            job = self.encode_queue.get()
+            job.status = "encoding"
+            self.publish(job)
+            try:
+                result = job.encode_fn(job, job.download_state)
+            except Exception as e:
+                self.finish(job, error=e)
+            else:
+                self.finish(job, result=result)
+
+    def get_stats(self):
+        """キューの長さと実行中のジョブ数を返す"""
+        with self.lock:
+            statuses = [job.status for job in self.jobs.values()]
+        return {
+            "queued_downloads": len(self.download_queue),
+            "queued_encodes": len(self.encode_queue),
+            "active_downloads": statuses.count("downloading"),
+            "active_encodes": statuses.count("encoding"),
+        }
+
+class InFlightCall:
+    """実行中の処理と、その結果を待っている参加者の情報"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.participants = 1
+
+class SingleFlight:
+    """同じキーの処理が実行中なら新たに実行せず、その結果を全員で共有する"""
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.stats = {"executions": 0, "coalesced": 0}
+
+    def do(self, key, fn, consume, cleanup=None):
+        """fnを1度だけ実行し、参加者ごとにconsume(結果)を呼ぶ（全員の処理後にcleanup(結果)を呼ぶ）"""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = InFlightCall()
+                self.calls[key] = call
+                self.stats["executions"] += 1
+            else:
+                call.participants += 1
+                self.stats["coalesced"] += 1
+
+        if leader:
+            try:
+                call.result = fn()
+            except Exception as e:
+                call.error = e
+            finally:
+                # 完了後に届いたリクエストは新たに実行する
+                with self.lock:
+                    del self.calls[key]
+                call.event.set()
+        else:
+            call.event.wait()
+
+        try:
+            if call.error is not None:
+                raise call.error
+            return consume(call.result)
+        finally:
+            with self.lock:
+                call.participants -= 1
+                last = call.participants == 0
+            if last and cleanup is not None and call.error is None:
+                cleanup(call.result)
+
+    def get_stats(self):
+        """実行回数と、実行中の処理に合流した回数を返す"""
+        with self.lock:
+            return dict(self.stats)
+
+def get_single_flight():
+    """プロセス全体で共有する重複実行防止の仕組みを取得"""
+    global _single_flight
+    with _scheduler_lock:
+        if _single_flight is None:
+            _single_flight = SingleFlight()
+        return _single_flight
+
+def get_scheduler():
+    """プロセス全体で共有するスケジューラーを取得"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = JobScheduler()
+            # /metricsでキューの長さと実行中のジョブ数を出力
+            register_gauge("clip_queue_depth", "Jobs waiting for each stage.", lambda: {
+                "download": _scheduler.get_stats()["queued_downloads"],
+                "encode": _scheduler.get_stats()["queued_encodes"],
+            }, label="stage")
+            register_gauge("clip_inflight_jobs", "Jobs currently running in each stage.", lambda: {
+                "download": _scheduler.get_stats()["active_downloads"],
+                "encode": _scheduler.get_stats()["active_encodes"],
+            }, label="stage")
+        return _scheduler
@@ -0,0 +1,251 @@
+import os
+import sys
+import json
+import time
+import threading
+import contextvars
+
+try:
+    import psutil
+except ImportError:
+    psutil = None  # 未インストールの場合は、回収を待てない子プロセス（APIサーバー・常駐ワーカー）の使用量を計測しない
+
+# 処理時間のヒストグラムの区切り（秒）
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+_phases = {}
+_gauges = []
+_metrics_lock = threading.Lock()
+_log_lock = threading.Lock()
+# 実行中の計測区間（入れ子の場合は外側から順に）。スレッド・asyncioのタスクごとに別々に持つ
+_active_spans = contextvars.ContextVar("active_spans", default=())
+PROCESS_SAMPLE_INTERVAL = 0.1
+
+class Span:
+    """1つの処理段階（メタデータ取得・ダウンロード・切り出し・移動・配信）の計測区間"""
+
+    def __init__(self, phase, **fields):
+        self.phase = phase
+        self.fields = fields
+        self.bytes = 0
+        self.child_cpu_seconds = 0.0
+        self.peak_rss_bytes = 0
+        self.lock = threading.Lock()
+
+    def add_bytes(self, num_bytes):
+        self.bytes += num_bytes
+
+    def add_child_usage(self, cpu_seconds, peak_rss_bytes):
+        # 並列エンコードでは複数のスレッドから加えられる
+        with self.lock:
+            self.child_cpu_seconds += cpu_seconds
+            self.peak_rss_bytes = max(self.peak_rss_bytes, peak_rss_bytes)
+
+    def __enter__(self):
+        self.started = time.time()
+        self.perf_started = time.perf_counter()
+        self.token = _active_spans.set(_active_spans.get() + (self,))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _active_spans.reset(self.token)
+        # 子プロセスの使用量は、この区間の中で実行した子プロセスの分だけ（並行する他の区間の分は含まない）
+        record = {
+            "phase": self.phase,
+            "started": self.started,
+            "wall_seconds": time.perf_counter() - self.perf_started,
+            "child_cpu_seconds": self.child_cpu_seconds,
+            "peak_rss_bytes": self.peak_rss_bytes,
+            "bytes": self.bytes,
+            "status": "ok" if exc_type is None else "error",
+            **self.fields,
+        }
+        if exc_type is not None:
+            record["error"] = str(exc_value)
+        observe(record)
+        return False
+
+def span(phase, **fields):
+    """with文で処理段階を計測する（fieldsはJSONログにそのまま出力）"""
+    return Span(phase, **fields)
+
+def record_child_usage(cpu_seconds, peak_rss_bytes):
+    """子プロセスのCPU時間とピークRSSを、実行中の計測区間（入れ子の場合はすべて）に加える"""
+    for active_span in _active_spans.get():
+        active_span.add_child_usage(cpu_seconds, peak_rss_bytes)
+
+def wait_child(process):
+    """subprocess.Popenの子プロセスをos.wait4で回収し、その子プロセス（と子孫）の使用量を計測区間に加えて終了コードを返す"""
+    if not hasattr(os, "wait4"):
+        return process.wait()  # Windowsでは子プロセスの使用量を計測しない
+    try:
+        _, status, usage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        return process.wait()  # 既に回収済み
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrssはLinuxではキロバイト、macOSではバイト単位
+    record_child_usage(usage.ru_utime + usage.ru_stime, usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024)
+    return process.returncode
+
+class ProcessSampler:
+    """自分で回収できないプロセス（asyncioの子プロセス・常駐ワーカー自身）とその子孫のCPU時間・RSSを一定間隔で調べる"""
+
+    def __init__(self, pids, interval=PROCESS_SAMPLE_INTERVAL, started_now=False):
+        self.pids = list(pids)
+        self.interval = interval
+        # 開始時点で動いていたプロセスは、それ以降に使った分だけを数える（started_nowなら起動からすべて数える）
+        self.started_now = started_now
+        self.cpu_started = {}
+        self.cpu_seen = {}
+        self.cpu_seconds = 0.0
+        self.peak_rss_bytes = 0
+        self.stopped = threading.Event()
+
+    def processes(self):
+        processes = []
+        for pid in self.pids:
+            try:
+                root = psutil.Process(pid)
+                processes.extend([root, *root.children(recursive=True)])
+            except psutil.Error:
+                pass
+        return processes
+
+    def sample(self, initial=False):
+        rss = 0
+        for process in self.processes():
+            try:
+                with process.oneshot():
+                    times = process.cpu_times()
+                    rss += process.memory_info().rss
+                    key = (process.pid, process.create_time())
+            except psutil.Error:
+                continue
+            self.cpu_started.setdefault(key, times.user + times.system if initial else 0.0)
+            self.cpu_seen[key] = times.user + times.system
+        self.peak_rss_bytes = max(self.peak_rss_bytes, rss)
+        # 間隔の間に終了したプロセスの最後の分は数えられない
+        self.cpu_seconds = sum(max(0.0, self.cpu_seen[key] - self.cpu_started[key]) for key in self.cpu_seen)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        if psutil is not None:
+            self.sample(initial=not self.started_now)
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if psutil is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.sample()
+        return False
+
+def observe(record):
+    """計測結果を集計に加え、設定されていればJSONログに出力"""
+    with _metrics_lock:
+        phase = _phases.setdefault(record["phase"], {
+            "count": 0,
+            "errors": 0,
+            "wall_seconds": 0.0,
+            "child_cpu_seconds": 0.0,
+            "bytes": 0,
+            "peak_rss_bytes": 0,
+            "buckets": [0] * len(DURATION_BUCKETS),
+        })
+        phase["count"] += 1
+        phase["errors"] += record["status"] == "error"
+        phase["wall_seconds"] += record["wall_seconds"]
+        phase["child_cpu_seconds"] += max(0.0, record["child_cpu_seconds"])
+        phase["bytes"] += record["bytes"]
+        phase["peak_rss_bytes"] = max(phase["peak_rss_bytes"], record["peak_rss_bytes"])
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if record["wall_seconds"] <= bound:
+                phase["buckets"][i] += 1
+    write_log(record)
+
+def write_log(record):
+    """環境変数METRICS_LOGで指定されたファイル（-の場合は標準エラー出力）にJSONで1行ずつ出力"""
+    log_path = os.environ.get("METRICS_LOG")
+    if not log_path:
+        return
+    line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+    with _log_lock:
+        if log_path == "-":
+            sys.stderr.write(line)
+            sys.stderr.flush()
+        else:
+            with open(log_path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+def register_gauge(name, help_text, collect, label=None):
+    """/metricsの出力時に値を取得するゲージを登録（collectは数値、またはlabelの値ごとの辞書を返す）"""
+    with _metrics_lock:
+        _gauges.append((name, help_text, collect, label))
+
+def format_labels(labels):
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+def render_prometheus():
+    """集計結果をPrometheusのテキスト形式で返す"""
+    with _metrics_lock:
+        phases = {name: dict(phase, buckets=list(phase["buckets"])) for name, phase in _phases.items()}
+        gauges = list(_gauges)
+
+    lines = [
+        "# HELP clip_phase_seconds Wall time of each pipeline phase.",
+        "# TYPE clip_phase_seconds histogram",
+    ]
+    for name, phase in sorted(phases.items()):
+        for bound, count in zip(DURATION_BUCKETS, phase["buckets"]):
+            lines.append(f"clip_phase_seconds_bucket{format_labels({'phase': name, 'le': bound})} {count}")
+        lines.append(f"clip_phase_seconds_bucket{format_labels({'phase': name, 'le': '+Inf'})} {phase['count']}")
+        lines.append(f"clip_phase_seconds_sum{format_labels({'phase': name})} {phase['wall_seconds']}")
+        lines.append(f"clip_phase_seconds_count{format_labels({'phase': name})} {phase['count']}")
+
+    counters = (
+        ("clip_phase_errors_total", "Failed runs of each pipeline phase.", "errors"),
+        ("clip_phase_child_cpu_seconds_total", "CPU time of the child processes run by each phase.", "child_cpu_seconds"),
+        ("clip_phase_bytes_total", "Bytes produced or transferred by each phase.", "bytes"),
+    )
+    for metric, help_text, key in counters:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} counter")
+        for name, phase in sorted(phases.items()):
+            lines.append(f"{metric}{format_labels({'phase': name})} {phase[key]}")
+
+    lines.append("# HELP clip_phase_peak_rss_bytes Largest peak RSS of the child processes run by one run of each phase.")
+    lines.append("# TYPE clip_phase_peak_rss_bytes gauge")
+    for name, phase in sorted(phases.items()):
+        lines.append(f"clip_phase_peak_rss_bytes{format_labels({'phase': name})} {phase['peak_rss_bytes']}")
+
+    for metric, help_text, collect, label in gauges:
+        try:
+            value = collect()
+        except Exception:
+            continue  # 取得に失敗したゲージは出力しない
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} gauge")
+        if isinstance(value, dict):
+            for label_value, item in sorted(value.items()):
+                lines.append(f"{metric}{format_labels({label: label_value})} {item}")
+        else:
+            lines.append(f"{metric} {value}")
+    return "\n".join(lines) + "\n"
+
+def get_stats():
+    """処理段階ごとの集計（回数・平均時間・転送量）を返す"""
+    with _metrics_lock:
+        return {
+            name: {
+                "count": phase["count"],
+                "errors": phase["errors"],
+                "average_seconds": phase["wall_seconds"] / phase["count"] if phase["count"] else 0.0,
+                "bytes": phase["bytes"],
+            }
+            for name, phase in _phases.items()
+        }
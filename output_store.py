@@ -0,0 +1,183 @@
+import os
+import time
+import hashlib
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+from clip_cache import link_or_copy
+from metrics import span
+
+# 一時ディレクトリと同じファイルシステムに置き、保存時の移動をリネームだけで済ませる
+DEFAULT_SERVER_OUTPUT_DIR = os.path.join(tempfile.gettempdir(), "clip-outputs")
+DEFAULT_SERVER_TTL = 24 * 60 * 60  # 1日
+DEFAULT_SERVER_MAX_BYTES = 20 * 1024 ** 3  # 20GB
+DEFAULT_JANITOR_INTERVAL = 10 * 60
+# 保存のたびに全件を調べないよう、保存時の掃除はこの間隔に1回に抑える
+CLEANUP_THROTTLE = 60
+# 名前を予約したままファイルが置かれなかった場合（保存中の異常終了等）に、空きとみなすまでの時間
+RESERVATION_TIMEOUT = 60 * 60
+
+_output_store = None
+_output_store_lock = threading.Lock()
+
+def index_path(root):
+    """出力先ごとの索引のパス（出力先には利用者のファイルだけを置くよう、隠しの状態ディレクトリに置く）"""
+    index_dir = os.environ.get("OUTPUT_INDEX_DIR") or os.path.join(
+        os.environ.get("XDG_STATE_HOME") or os.path.join(os.path.expanduser("~"), ".local", "state"), "clip-outputs"
+    )
+    try:
+        os.makedirs(index_dir, exist_ok=True)
+    except OSError:
+        # ホームディレクトリに書き込めない環境では一時ディレクトリに置く
+        index_dir = os.path.join(tempfile.gettempdir(), "clip-outputs-index")
+        os.makedirs(index_dir, exist_ok=True)
+    return os.path.join(index_dir, f"{hashlib.sha256(root.encode('utf-8')).hexdigest()[:16]}.sqlite3")
+
+class OutputStore:
+    """保存先のファイル名をSQLiteの索引で割り当て、容量上限とTTLで古いファイルを削除する出力ディレクトリ"""
+
+    def __init__(self, root, max_bytes=0, ttl=0):
+        self.root = os.path.abspath(root)
+        self.max_bytes = int(max_bytes)  # 0の場合は容量上限なし
+        self.ttl = float(ttl)  # 0の場合は期限なし
+        self.lock = threading.Lock()
+        self.last_cleanup = 0.0
+        os.makedirs(self.root, exist_ok=True)
+        self.db = sqlite3.connect(index_path(self.root), timeout=30, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS names (base TEXT PRIMARY KEY, next_counter INTEGER NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, size INTEGER NOT NULL, created REAL NOT NULL)")
+
+    def is_taken(self, name):
+        # 索引を使う前から置かれていたファイルとも重複しないようにする
+        if os.path.exists(os.path.join(self.root, name)):
+            return True
+        row = self.db.execute("SELECT size, created FROM files WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return False
+        size, created = row
+        if size == 0 and time.time() - created < RESERVATION_TIMEOUT:
+            # 予約済みで、ファイルの移動がまだ終わっていない
+            return True
+        # 利用者が削除したファイルの行は捨て、その名前を再び使う
+        self.db.execute("DELETE FROM files WHERE name = ?", (name,))
+        return False
+
+    def allocate(self, file_name):
+        """重複しないファイル名を予約して保存先のパスを返す（名前ごとの連番を索引に持つため、既存の候補を順に調べない）"""
+        name, ext = os.path.splitext(os.path.basename(file_name))
+        with self.lock:
+            # 複数のプロセスが同時に同じ名前を予約しないよう、書き込みロックを取ってから調べる
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                allocated = f"{name}{ext}"
+                if self.is_taken(allocated):
+                    row = self.db.execute("SELECT next_counter FROM names WHERE base = ?", (allocated,)).fetchone()
+                    counter = row[0] if row else 2
+                    while self.is_taken(f"{name}_V{counter}{ext}"):
+                        counter += 1
+                    self.db.execute(
+                        "INSERT INTO names (base, next_counter) VALUES (?, ?) ON CONFLICT(base) DO UPDATE SET next_counter = excluded.next_counter",
+                        (f"{name}{ext}", counter + 1)
+                    )
+                    allocated = f"{name}_V{counter}{ext}"
+                self.db.execute("INSERT INTO files (name, size, created) VALUES (?, 0, ?)", (allocated, time.time()))
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+        return os.path.join(self.root, allocated)
+
+    def record_size(self, path):
+        with self.lock:
+            self.db.execute("UPDATE files SET size = ? WHERE name = ?", (os.path.getsize(path), os.path.basename(path)))
+
+    def save(self, temp_file, file_name=None):
+        """一時ファイルを一意のファイル名で移動し、保存先のパスを返す"""
+        final_path = self.allocate(file_name or os.path.basename(temp_file))
+        try:
+            with span("move", file_name=os.path.basename(final_path)) as move_span:
+                # 同じファイルシステムならリネームのみ、異なる場合はコピーになる
+                shutil.move(temp_file, final_path)
+                move_span.add_bytes(os.path.getsize(final_path))
+        except Exception:
+            self.forget(final_path)
+            raise
+        self.record_size(final_path)
+        self.cleanup_if_due()
+        return final_path
+
+    def link(self, src_path, file_name):
+        """キャッシュ済みのファイルを一意のファイル名でリンク（またはコピー）し、保存先のパスを返す"""
+        final_path = self.allocate(file_name)
+        try:
+            with span("move", file_name=os.path.basename(final_path), source="cache") as move_span:
+                link_or_copy(src_path, final_path)
+                move_span.add_bytes(os.path.getsize(final_path))
+        except Exception:
+            self.forget(final_path)
+            raise
+        self.record_size(final_path)
+        self.cleanup_if_due()
+        return final_path
+
+    def forget(self, path):
+        with self.lock:
+            self.db.execute("DELETE FROM files WHERE name = ?", (os.path.basename(path),))
+
+    def remove(self, path):
+        """保存したファイルを削除し、索引からも外す"""
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        self.forget(path)
+
+    def cleanup_if_due(self):
+        if time.time() - self.last_cleanup >= CLEANUP_THROTTLE:
+            self.cleanup()
+
+    def cleanup(self):
+        """期限切れのファイルを削除し、容量上限を超えていれば古い順に削除"""
+        if not self.ttl and not self.max_bytes:
+            return
+        now = time.time()
+        self.last_cleanup = now
+        with self.lock:
+            rows = self.db.execute("SELECT name, size, created FROM files WHERE size > 0 ORDER BY created").fetchall()
+        total_bytes = sum(size for _, size, _ in rows)
+        for name, size, created in rows:
+            expired = self.ttl and now - created > self.ttl
+            over_quota = self.max_bytes and total_bytes > self.max_bytes
+            if not expired and not over_quota:
+                break
+            self.remove(os.path.join(self.root, name))
+            total_bytes -= size
+
+    def run_janitor(self, interval):
+        """一定間隔で古いファイルを削除し続ける（ダウンロードされずに残ったファイルも片付ける）"""
+        while True:
+            time.sleep(interval)
+            try:
+                self.cleanup()
+            except Exception:
+                pass  # 次の間隔で再試行
+
+def get_output_store(default_root=".", default_ttl=0, default_max_bytes=0):
+    """プロセス全体で共有する出力先を取得（OUTPUT_DIR・OUTPUT_TTL・OUTPUT_MAX_BYTESで変更可能）"""
+    global _output_store
+    with _output_store_lock:
+        if _output_store is None:
+            _output_store = OutputStore(
+                os.environ.get("OUTPUT_DIR", default_root),
+                max_bytes=os.environ.get("OUTPUT_MAX_BYTES", default_max_bytes),
+                ttl=os.environ.get("OUTPUT_TTL", default_ttl)
+            )
+            # 期限か容量上限が設定されている場合のみ、バックグラウンドで定期的に掃除する
+            if _output_store.ttl or _output_store.max_bytes:
+                interval = float(os.environ.get("OUTPUT_JANITOR_INTERVAL", DEFAULT_JANITOR_INTERVAL))
+                thread = threading.Thread(target=_output_store.run_janitor, args=(interval,), daemon=True)
+                thread.start()
+        return _output_store
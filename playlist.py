@@ -0,0 +1,95 @@
+import re
+import json
+import time
+import random
+import subprocess
+import threading
+
+from ytdlp_backend import run_ytdlp_command
+from sections import parse_section_text
+
+DEFAULT_RETRY_ATTEMPTS = 3
+DEFAULT_RETRY_DELAY = 2.0
+MAX_RETRY_DELAY = 60.0
+# ダウンロード中に、この件数先までの動画情報を抽出しておく
+DEFAULT_LOOKAHEAD = 2
+# 一覧の取得結果を再利用する時間（Streamlitの再実行のたびに抽出し直さない）
+ENTRIES_TTL = 10 * 60
+
+_entries_cache = {}
+_entries_cache_lock = threading.Lock()
+
+def validate_playlist_url(url):
+    """YouTubeの再生リスト・チャンネルのURLを検証"""
+    playlist_patterns = [
+        r'https?://(?:www\.|m\.)?youtube\.com/playlist\?(?:.*&)?list=[\w-]+',
+        r'https?://(?:www\.|m\.)?youtube\.com/@[\w.-]+(?:/(?:videos|shorts|streams))?/?$',
+        r'https?://(?:www\.|m\.)?youtube\.com/(?:channel|c|user)/[\w-]+(?:/(?:videos|shorts|streams))?/?$',
+    ]
+    return any(re.match(pattern, url) for pattern in playlist_patterns)
+
+def entry_url(entry):
+    """一覧の項目から動画のURLを返す"""
+    return f"https://www.youtube.com/watch?v={entry['id']}"
+
+def retry_with_backoff(fn, attempts=DEFAULT_RETRY_ATTEMPTS, base_delay=DEFAULT_RETRY_DELAY, on_retry=None):
+    """yt-dlpの失敗（ネットワークエラー等）は待ち時間を倍にしながら再試行する"""
+    for attempt in range(1, attempts + 1):
+        try:
+            return fn()
+        except subprocess.CalledProcessError as e:
+            if attempt == attempts:
+                raise
+            # 同時に失敗したワーカーが一斉に再試行しないよう、待ち時間をばらつかせる
+            delay = min(MAX_RETRY_DELAY, base_delay * 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+            if on_retry is not None:
+                on_retry(attempt, e, delay)
+            time.sleep(delay)
+
+def fetch_entries(url, options=()):
+    """再生リスト・チャンネルの動画一覧を、各動画を開かない軽量な抽出で取得"""
+    cached = None
+    with _entries_cache_lock:
+        cached = _entries_cache.get(url)
+    if cached and time.time() - cached[0] <= ENTRIES_TTL:
+        return cached[1]
+
+    cmd = ["yt-dlp", "--flat-playlist", "--dump-single-json", *options, url]
+    result = retry_with_backoff(lambda: run_ytdlp_command(cmd))
+    try:
+        info = json.loads(result.stdout)
+    except ValueError as e:
+        raise RuntimeError("動画一覧を解析できませんでした。") from e
+
+    entries = []
+    for entry in info.get("entries") or []:
+        # 非公開・削除済みの動画や、入れ子の再生リストは除く
+        if not entry or not entry.get("id") or entry.get("_type") == "playlist":
+            continue
+        entries.append({
+            "id": entry["id"],
+            "title": entry.get("title"),
+            "duration": entry.get("duration"),
+        })
+    playlist = {"title": info.get("title"), "entries": entries}
+
+    with _entries_cache_lock:
+        _entries_cache[url] = (time.time(), playlist)
+    return playlist
+
+def parse_entry_ranges(text):
+    """「動画IDまたは番号: 開始-終了, 開始-終了」の行を、キーごとの（開始, 終了）のリストに変換（不正な行はValueError）"""
+    entry_ranges = {}
+    for line_number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        match = re.match(r'^([\w-]+)\s*[:：]?\s+(.+)$', line)
+        if not match:
+            raise ValueError(f"{line_number}行目: 「動画IDまたは番号: 開始-終了」の形式で入力してください: {line}")
+        entry_ranges.setdefault(match.group(1), []).extend(parse_section_text(match.group(2)))
+    return entry_ranges
+
+def entry_sections(entry, index, entry_ranges, default_sections):
+    """項目ごとの区間（動画IDまたは番号で指定）があればそれを、なければ共通の区間を返す"""
+    return entry_ranges.get(entry["id"]) or entry_ranges.get(str(index)) or default_sections
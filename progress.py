@@ -0,0 +1,78 @@
+from collections import deque
+
+PROGRESS_PREFIX = "[progress]"
+PROGRESS_FIELDS = (
+    "downloaded_bytes",
+    "total_bytes",
+    "total_bytes_estimate",
+    "speed",
+    "eta",
+    "fragment_index",
+    "fragment_count",
+)
+# 1行に1回分の進捗を「|」区切りで出力させるテンプレート
+PROGRESS_TEMPLATE = "download:" + PROGRESS_PREFIX + " " + "|".join(f"%(progress.{field})s" for field in PROGRESS_FIELDS)
+PROGRESS_OPTIONS = ["--newline", "--progress-template", PROGRESS_TEMPLATE]
+
+# 保持するログの最大行数（長時間のダウンロードでもメモリ使用量が増え続けないようにする）
+DEFAULT_LOG_LINES = 200
+
+class LogBuffer:
+    """直近の行だけを保持するリングバッファ"""
+
+    def __init__(self, max_lines=DEFAULT_LOG_LINES):
+        self.lines = deque(maxlen=max_lines)
+
+    def append(self, line):
+        self.lines.append(line)
+
+    def text(self):
+        return "\n".join(self.lines)
+
+def parse_progress_line(line):
+    """進捗テンプレートの行を辞書に変換（進捗行でなければNone）"""
+    if not line.startswith(PROGRESS_PREFIX):
+        return None
+
+    values = line[len(PROGRESS_PREFIX):].strip().split("|")
+    if len(values) != len(PROGRESS_FIELDS):
+        return None
+
+    progress = {}
+    for field, value in zip(PROGRESS_FIELDS, values):
+        try:
+            progress[field] = float(value)
+        except ValueError:
+            progress[field] = None  # yt-dlpは不明な値を"NA"として出力する
+    return progress
+
+def progress_fraction(progress):
+    """進捗を0〜1の割合で返す（合計が不明な場合はNone）"""
+    total = progress.get("total_bytes") or progress.get("total_bytes_estimate")
+    if total and progress.get("downloaded_bytes") is not None:
+        return min(1.0, progress["downloaded_bytes"] / total)
+    if progress.get("fragment_count") and progress.get("fragment_index") is not None:
+        return min(1.0, progress["fragment_index"] / progress["fragment_count"])
+    return None
+
+def format_bytes(num_bytes):
+    """バイト数を読みやすい単位に変換"""
+    if num_bytes is None:
+        return "?"
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if num_bytes < 1024 or unit == "GiB":
+            return f"{num_bytes:.1f}{unit}"
+        num_bytes /= 1024
+
+def format_progress(progress):
+    """進捗を1行のテキストにまとめる"""
+    total = progress.get("total_bytes") or progress.get("total_bytes_estimate")
+    parts = [f"{format_bytes(progress.get('downloaded_bytes'))} / {format_bytes(total)}"]
+    if progress.get("speed") is not None:
+        parts.append(f"{format_bytes(progress['speed'])}/s")
+    if progress.get("eta") is not None:
+        minutes, seconds = divmod(int(progress["eta"]), 60)
+        parts.append(f"残り {minutes:02d}:{seconds:02d}")
+    if progress.get("fragment_count"):
+        parts.append(f"断片 {int(progress.get('fragment_index') or 0)}/{int(progress['fragment_count'])}")
+    return "  ".join(parts)
@@ -0,0 +1,63 @@
+import re
+
+from clip_cache import time_to_seconds
+
+# 複数区間をダウンロードする場合に、区間ごとのファイル名を分けるための接尾辞
+SECTION_SUFFIX = "_%(section_start)d-%(section_end)d"
+# ダウンロード後に区間の開始位置と保存先を書き出させるテンプレート
+SECTION_MAP_TEMPLATE = "after_move:%(section_start)s\t%(filepath)s"
+
+def seconds_to_time(seconds):
+    """秒数をMM:SS形式（1時間以上はHH:MM:SS形式）に変換"""
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours:02d}:{minutes:02d}:{secs:02d}"
+    return f"{minutes:02d}:{secs:02d}"
+
+def parse_section_text(text):
+    """「開始-終了」を1行に1つ（またはカンマ区切り）で書いたテキストを（開始, 終了）のリストに変換"""
+    sections = []
+    for part in re.split(r'[\n,、]', text):
+        part = part.strip()
+        if not part:
+            continue
+        start_time, separator, end_time = part.partition("-")
+        if not separator:
+            start_time, separator, end_time = part.partition("～")
+        sections.append((start_time.strip(), end_time.strip()))
+    return sections
+
+def merge_sections(sections):
+    """重なる・隣接する区間をまとめ、開始位置順に並べる（区間は正規化済みの時間文字列）"""
+    merged = []
+    for start_seconds, end_seconds in sorted((time_to_seconds(s), time_to_seconds(e)) for s, e in sections):
+        if merged and start_seconds <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end_seconds)
+        else:
+            merged.append([start_seconds, end_seconds])
+    return [(seconds_to_time(start), seconds_to_time(end)) for start, end in merged]
+
+def section_output_template(output_template):
+    """出力テンプレートの拡張子の前に区間の接尾辞を追加"""
+    name, ext_separator, ext = output_template.rpartition(".")
+    return f"{name}{SECTION_SUFFIX}.{ext}"
+
+def section_map_options(map_path):
+    """区間ごとの保存先をファイルに書き出させるyt-dlpオプションを返す"""
+    return ["--print-to-file", SECTION_MAP_TEMPLATE, map_path]
+
+def read_section_map(map_path, sections):
+    """yt-dlpが書き出した保存先を読み込み、区間ごとのファイルパスを返す"""
+    outputs = {}
+    with open(map_path, encoding="utf-8") as f:
+        for line in f:
+            section_start, _, file_path = line.rstrip("\n").partition("\t")
+            try:
+                start_seconds = float(section_start)
+            except ValueError:
+                continue
+            for section in sections:
+                if abs(time_to_seconds(section[0]) - start_seconds) < 0.5:
+                    outputs[section] = file_path
+    return outputs
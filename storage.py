@@ -0,0 +1,244 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import socket
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windowsではプロセス間のロックを取らない（単一プロセスでの利用のみ）
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None  # S3互換ストレージを使う場合のみ必要
+
+# ロックの期限（保持中は期限の1/3ごとに延長し、プロセスが落ちた場合はこの時間で解放される）
+DEFAULT_LOCK_LEASE = 60
+# 他のレプリカが作成中のクリップを待つ上限（ダウンロードの枠を使ったまま待ち続けないようにする）
+DEFAULT_LOCK_TIMEOUT = 300
+LOCK_POLL_INTERVAL = 1.0
+# 条件付きの書き込み・削除で、条件が満たされなかった場合のエラーコード
+CONDITION_FAILED_CODES = ("PreconditionFailed", "ConditionalRequestConflict", "412", "409")
+
+_storage = None
+_storage_lock = threading.Lock()
+
+class LocalStorage:
+    """複数のレプリカからマウントした共有ディレクトリを使うストレージ"""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def download(self, key, dest_path):
+        """オブジェクトをdest_pathに取得（存在しない場合はFalse）"""
+        try:
+            shutil.copyfile(self.path(key), dest_path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def upload(self, key, src_path):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 一時名でコピーしてから置き換え、書き込み途中のファイルを他のレプリカに読ませない
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.copyfile(src_path, temp_path)
+            os.replace(temp_path, path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+    def read_json(self, key):
+        """JSONを読み込む（存在しない・壊れている場合はNone）"""
+        try:
+            with open(self.path(key), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write_json(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def guard(self):
+        """ロックファイルの読み書きをプロセス間で排他するためのファイルを開く（読み書きは短時間のため全ロックで共有）"""
+        guard_file = open(os.path.join(self.root, ".lock-guard"), "a")
+        if fcntl is not None:
+            fcntl.flock(guard_file, fcntl.LOCK_EX)
+        return guard_file
+
+    def try_lock(self, key, owner, lease):
+        """ロックが空いているか期限切れ、または自分のものなら期限を延長して取得（取れない場合はFalse）"""
+        with self.guard():
+            current = self.read_json(key)
+            if current and current["owner"] != owner and current["expires"] > time.time():
+                return False
+            self.write_json(key, {"owner": owner, "expires": time.time() + lease})
+            return True
+
+    def release_lock(self, key, owner):
+        with self.guard():
+            current = self.read_json(key)
+            if current and current["owner"] == owner:
+                self.delete(key)
+
+class S3Storage:
+    """S3互換のオブジェクトストレージ（MinIO等も可）を使うストレージ"""
+
+    def __init__(self, bucket, prefix="", endpoint_url=None):
+        if boto3 is None:
+            raise RuntimeError("S3互換ストレージを使うにはboto3をインストールしてください。")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = boto3.client("s3", endpoint_url=endpoint_url or None)
+
+    def object_key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def download(self, key, dest_path):
+        """オブジェクトをdest_pathに取得（存在しない場合はFalse）"""
+        try:
+            self.client.download_file(self.bucket, self.object_key(key), dest_path)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return False
+            raise
+        return True
+
+    def upload(self, key, src_path):
+        # 大きなファイルはマルチパートで送信され、完了するまで他のレプリカからは見えない
+        self.client.upload_file(src_path, self.bucket, self.object_key(key))
+
+    def read_json(self, key):
+        """JSONを読み込む（存在しない・壊れている場合はNone）"""
+        data, _ = self.read_json_with_etag(key)
+        return data
+
+    def read_json_with_etag(self, key):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.object_key(key))
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return None, None
+            raise
+        try:
+            return json.loads(response["Body"].read()), response["ETag"]
+        except ValueError:
+            return None, response["ETag"]
+
+    def write_json(self, key, data, **conditions):
+        self.client.put_object(
+            Bucket=self.bucket, Key=self.object_key(key),
+            Body=json.dumps(data, ensure_ascii=False).encode("utf-8"), ContentType="application/json",
+            **conditions
+        )
+
+    def delete(self, key, **conditions):
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key), **conditions)
+
+    def try_lock(self, key, owner, lease):
+        """条件付き書き込みでロックを取得（空いていれば新規作成、期限切れ・自分のものならETagを指定して上書き）"""
+        record = {"owner": owner, "expires": time.time() + lease}
+        try:
+            self.write_json(key, record, IfNoneMatch="*")
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in CONDITION_FAILED_CODES:
+                raise
+
+        current, etag = self.read_json_with_etag(key)
+        if etag is None:
+            return False  # 直前に解放された場合は次の試行で取得する
+        if current and current["owner"] != owner and current["expires"] > time.time():
+            return False
+        try:
+            # 読んだ後に他のレプリカが書き換えていれば失敗し、同時に2つが取得することはない
+            self.write_json(key, record, IfMatch=etag)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in CONDITION_FAILED_CODES:
+                return False
+            raise
+        return True
+
+    def release_lock(self, key, owner):
+        """自分のロックであれば、読んだときのETagを指定して削除（読んだ後に他のレプリカが取得していれば削除しない）"""
+        current, etag = self.read_json_with_etag(key)
+        if not current or current["owner"] != owner:
+            return
+        try:
+            self.delete(key, IfMatch=etag)
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in CONDITION_FAILED_CODES + ("404", "NoSuchKey"):
+                raise
+
+class DistributedLock:
+    """共有ストレージ上の期限付きロック（保持中は期限を延長し続け、プロセスが落ちた場合は期限切れで解放される）"""
+
+    def __init__(self, storage, name, lease=None):
+        self.storage = storage
+        self.key = f"locks/{name}"
+        self.lease = float(lease or os.environ.get("CLIP_LOCK_LEASE", DEFAULT_LOCK_LEASE))
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        self.stopped = threading.Event()
+
+    def acquire(self, timeout=None):
+        """ロックを取得するまで待つ（timeout秒以内に取得できなければFalse）"""
+        deadline = None if timeout is None else time.time() + timeout
+        while not self.storage.try_lock(self.key, self.owner, self.lease):
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(LOCK_POLL_INTERVAL if deadline is None else max(0, min(LOCK_POLL_INTERVAL, deadline - time.time())))
+        threading.Thread(target=self.renew, daemon=True).start()
+        return True
+
+    def renew(self):
+        while not self.stopped.wait(self.lease / 3):
+            try:
+                self.storage.try_lock(self.key, self.owner, self.lease)
+            except Exception:
+                pass  # 次の間隔で再試行（期限内に延長できなければ他のレプリカに引き継がれる）
+
+    def release(self):
+        self.stopped.set()
+        try:
+            self.storage.release_lock(self.key, self.owner)
+        except Exception:
+            pass  # 解放できなくても期限切れで解放される
+
+def get_storage():
+    """レプリカ間で共有するストレージを取得（STORAGE_BACKENDが未設定の場合はNoneで、共有しない）"""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            backend = os.environ.get("STORAGE_BACKEND", "").lower()
+            if backend == "local":
+                _storage = LocalStorage(os.environ["STORAGE_DIR"])
+            elif backend == "s3":
+                _storage = S3Storage(
+                    os.environ["S3_BUCKET"],
+                    os.environ.get("S3_PREFIX", ""),
+                    os.environ.get("S3_ENDPOINT_URL")
+                )
+        return _storage
@@ -1,69 +1,64 @@
 import streamlit as st
 import subprocess
-import re
 import sys
 import os
-import glob
 import tempfile
 import shutil
 import platform
+import functools
+import time
+import uuid
 
-def validate_time_format(time_str):
-    """時間フォーマットを検証（00:00, 00:12, 01:22:33, 0000, 000010形式）"""
-    # MM:SS または HH:MM:SS 形式
-    colon_pattern = r'^\d{1,2}:\d{2}(:\d{2})?$'
-    # MMSS または HHMMSS 形式（4桁または6桁）
-    digit_pattern = r'^\d{4}$|^\d{6}$'
-    
-    return re.match(colon_pattern, time_str) is not None or re.match(digit_pattern, time_str) is not None
+import file_server
+import output_store
+from clip_cache import get_default_cache, make_cache_key, link_or_copy, time_to_seconds
+from video_cut import CUT_MODES, get_cut_mode
+from job_queue import get_scheduler, get_single_flight, SkipEncode
+from video_info import get_info_cache, with_info_json
+from progress import format_bytes, format_progress, progress_fraction
+from metrics import get_stats as get_phase_stats
+from download_tuning import get_tuner
+from sections import merge_sections, parse_section_text
+from storage import get_storage, DistributedLock, DEFAULT_LOCK_TIMEOUT
+from cookies import get_cookie_options
+from playlist import (
+    DEFAULT_LOOKAHEAD, validate_playlist_url, fetch_entries, entry_url, entry_sections,
+    parse_entry_ranges, retry_with_backoff
+)
+from downloader import (
+    FORMAT_SORT, build_command, extract_video_id, normalize_time_format, validate_time_format, validate_youtube_url,
+    run_ytdlp, cut_from_cache, trim_download, cache_clip
+)
 
-def normalize_time_format(time_str):
-    """時間フォーマットを正規化（4桁・6桁をMM:SS・HH:MM:SS形式に変換）"""
-    if re.match(r'^\d{4}$', time_str):
-        # 4桁の場合：MMSS -> MM:SS
-        return f"{time_str[:2]}:{time_str[2:]}"
-    elif re.match(r'^\d{6}$', time_str):
-        # 6桁の場合：HHMMSS -> HH:MM:SS
-        return f"{time_str[:2]}:{time_str[2:4]}:{time_str[4:]}"
-    else:
-        # すでに正しい形式の場合はそのまま返す
-        return time_str
-
-def validate_youtube_url(url):
-    """YouTubeのURLを検証"""
-    youtube_patterns = [
-        r'https?://(?:www\.)?youtube\.com/watch\?v=[\w-]+',
-        r'https?://youtu\.be/[\w-]+',
-        r'https?://(?:www\.)?youtube\.com/embed/[\w-]+',
-        r'https?://(?:www\.)?youtube\.com/shorts/[\w-]+'
-    ]
-    return any(re.match(pattern, url) for pattern in youtube_patterns)
+def get_output_store():
+    """サーバーの出力先を取得（ダウンロードされずに残ったファイルは期限と容量上限で自動的に削除）"""
+    return output_store.get_output_store(
+        output_store.DEFAULT_SERVER_OUTPUT_DIR,
+        output_store.DEFAULT_SERVER_TTL,
+        output_store.DEFAULT_SERVER_MAX_BYTES
+    )
 
-def get_unique_filename(base_path):
-    """既存ファイルと重複しない一意のファイル名を生成"""
-    if not os.path.exists(base_path):
-        return base_path
-    
-    # ファイル名と拡張子を分離
-    name, ext = os.path.splitext(base_path)
-    counter = 2
-    
-    while os.path.exists(f"{name}_V{counter}{ext}"):
-        counter += 1
-    
-    return f"{name}_V{counter}{ext}"
+def format_duration(seconds):
+    """秒数をHH:MM:SS形式（1時間未満はMM:SS形式）に変換"""
+    if seconds is None:
+        return "不明"
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours:02d}:{minutes:02d}:{secs:02d}"
+    return f"{minutes:02d}:{secs:02d}"
 
-def format_command_display(cmd, download_sections, youtube_url):
+def format_command_display(cmd, youtube_url):
     """表示用にコマンドの引数を引用符で囲む"""
     cmd_display = []
     for arg in cmd:
-        if arg == "codec:avc:aac,res:1080,fps:60,hdr:sdr":
+        if arg == FORMAT_SORT:
             cmd_display.append(f'"{arg}"')
         elif arg == "bv+ba":
             cmd_display.append(f'"{arg}"')
         elif "%(title)s_%(height)s_%(fps)s_%(vcodec.:4)s_(%(id)s)" in arg:
             cmd_display.append(f'"{arg}"')
-        elif arg == download_sections:
+        elif arg.startswith("*"):
             cmd_display.append(f'"{arg}"')
         elif arg == youtube_url:
             cmd_display.append(f'"{arg}"')
@@ -75,15 +70,21 @@ def main():
     st.title("YouTube動画ダウンローダー")
     st.markdown("---")
     
+    # ファイル配信サーバーを起動（プロセス内で1度だけ）
+    file_server.start_server()
+    
     # セッション状態の初期化
-    if 'downloaded_file_path' not in st.session_state:
-        st.session_state.downloaded_file_path = None
-    if 'downloaded_file_data' not in st.session_state:
-        st.session_state.downloaded_file_data = None
-    if 'downloaded_file_name' not in st.session_state:
-        st.session_state.downloaded_file_name = None
+    if 'downloaded_files' not in st.session_state:
+        st.session_state.downloaded_files = []
     if 'download_clicked' not in st.session_state:
         st.session_state.download_clicked = False
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    if 'job_id' not in st.session_state:
+        # 共有ストレージを使う場合、別のレプリカに接続し直してもURLのジョブIDから結果を取得できる
+        st.session_state.job_id = st.query_params.get("job") if get_storage() is not None else None
+    if 'playlist_job_ids' not in st.session_state:
+        st.session_state.playlist_job_ids = []
     
     # YouTubeのURL入力
     st.subheader("YouTubeのURL")
@@ -91,12 +92,41 @@ def main():
     
     # URL検証
     url_valid = True
+    playlist = None
     if youtube_url:
-        if not validate_youtube_url(youtube_url):
+        if validate_playlist_url(youtube_url):
+            # 再生リスト・チャンネルは、各動画を開かない軽量な抽出で動画一覧だけを取得
+            try:
+                with st.spinner("動画一覧を取得しています..."):
+                    playlist = fetch_entries(youtube_url, get_cookie_options())
+            except subprocess.CalledProcessError as e:
+                st.error(f"動画一覧の取得に失敗しました: {e}")
+                if e.stderr:
+                    st.text_area("エラー詳細:", e.stderr, height=200)
+                url_valid = False
+            except FileNotFoundError:
+                st.error("yt-dlpが見つかりません。yt-dlpがインストールされているか確認してください。")
+                url_valid = False
+            except RuntimeError as e:
+                st.error(f"動画一覧の取得に失敗しました: {e}")
+                url_valid = False
+            if playlist is not None:
+                if not playlist["entries"]:
+                    st.error("ダウンロードできる動画がありません。")
+                    url_valid = False
+                else:
+                    st.success(f"有効な再生リストです。{playlist['title'] or ''}（{len(playlist['entries'])}本の動画）")
+        elif not validate_youtube_url(youtube_url):
             st.error("無効なYouTubeのURLです。正しいURLを入力してください。")
             url_valid = False
         else:
             st.success("有効なYouTubeのURLです。")
+            # 時間を入力している間に、動画情報の抽出をバックグラウンドで始めておく
+            video_info = get_info_cache().get(extract_video_id(youtube_url))
+            if video_info is None:
+                get_info_cache().prefetch(extract_video_id(youtube_url), youtube_url, get_cookie_options())
+            else:
+                st.caption(f"🎬 {video_info['title']}（{format_duration(video_info['duration'])}）")
     
     # 時間入力
     st.subheader("ダウンロード区間")
@@ -122,171 +152,519 @@ def main():
                 end_time_valid = False
             else:
                 normalized_end = normalize_time_format(end_time)
-                st.success(f"有効な時間フォーマットです。({normalized_end})")
+                video_info = get_info_cache().get(extract_video_id(youtube_url)) if youtube_url and url_valid and playlist is None else None
+                if video_info and video_info["duration"] and time_to_seconds(normalized_end) > video_info["duration"]:
+                    # ダウンロードを始める前に、動画の長さを超える終了時間を弾く
+                    st.error(f"終了時間が動画の長さ（{format_duration(video_info['duration'])}）を超えています。")
+                    end_time_valid = False
+                else:
+                    st.success(f"有効な時間フォーマットです。({normalized_end})")
+    
+    # 同じ動画から続けて切り出す区間
+    extra_sections_text = st.text_area(
+        "追加の区間（任意）",
+        placeholder="例: 02:00-02:30（1行に1区間。重なる・隣接する区間は1つのクリップにまとめます）",
+        height=80
+    )
+    extra_sections = parse_section_text(extra_sections_text)
+    extra_sections_valid = True
+    if extra_sections:
+        if not (start_time.strip() and end_time.strip()):
+            st.error("追加の区間を指定する場合は、開始時間と終了時間も入力してください。")
+            extra_sections_valid = False
+        elif not all(validate_time_format(s) and validate_time_format(e) for s, e in extra_sections):
+            st.error("無効な区間です。開始-終了の形式（例: 02:00-02:30）で入力してください。")
+            extra_sections_valid = False
+    
+    # 再生リストの場合は、動画IDまたは番号ごとに区間を指定できる（指定のない動画には上の区間を使う）
+    entry_ranges = {}
+    entry_ranges_valid = True
+    if playlist:
+        entry_ranges_text = st.text_area(
+            "動画ごとの区間（任意）",
+            placeholder="例: dQw4w9WgXcQ: 01:00-01:30, 02:00-02:10\n3: 00:30-00:45（動画IDまたは番号ごとに1行）",
+            height=80
+        )
+        try:
+            entry_ranges = parse_entry_ranges(entry_ranges_text)
+        except ValueError as e:
+            st.error(str(e))
+            entry_ranges_valid = False
+        for key, ranges in entry_ranges.items():
+            if not all(validate_time_format(s) and validate_time_format(e) for s, e in ranges):
+                st.error(f"{key}: 無効な区間です。開始-終了の形式（例: 02:00-02:30）で入力してください。")
+                entry_ranges_valid = False
+                break
+            entry_ranges[key] = [(normalize_time_format(s), normalize_time_format(e)) for s, e in ranges]
+            if any(time_to_seconds(s) >= time_to_seconds(e) for s, e in entry_ranges[key]):
+                st.error(f"{key}: 終了時間は開始時間より後にしてください。")
+                entry_ranges_valid = False
+                break
+    
+    # 入力された区間を正規化し、重なる・隣接する区間をまとめる
+    sections = []
+    if start_time.strip() and end_time.strip() and start_time_valid and end_time_valid and extra_sections_valid:
+        sections = [(normalize_time_format(start_time), normalize_time_format(end_time))]
+        sections.extend((normalize_time_format(s), normalize_time_format(e)) for s, e in extra_sections)
+        video_info = get_info_cache().get(extract_video_id(youtube_url)) if youtube_url and url_valid and playlist is None else None
+        if any(time_to_seconds(s) >= time_to_seconds(e) for s, e in sections):
+            st.error("終了時間は開始時間より後にしてください。")
+            extra_sections_valid = False
+        elif video_info and video_info["duration"] and any(time_to_seconds(e) > video_info["duration"] for s, e in sections):
+            st.error(f"区間が動画の長さ（{format_duration(video_info['duration'])}）を超えています。")
+            extra_sections_valid = False
+        else:
+            sections = merge_sections(sections)
     
     # 時間指定の状態を表示
     if not start_time.strip() and not end_time.strip():
         st.info("💡 時間指定なし：動画全体をダウンロードします")
     elif start_time.strip() and end_time.strip():
-        if start_time_valid and end_time_valid:
-            st.info(f"💡 指定区間：{normalize_time_format(start_time) if start_time else ''} ～ {normalize_time_format(end_time) if end_time else ''}")
+        if start_time_valid and end_time_valid and extra_sections_valid:
+            st.info("💡 指定区間：" + "、".join(f"{s} ～ {e}" for s, e in sections))
     else:
         if start_time.strip() or end_time.strip():
             st.warning("⚠️ 開始時間と終了時間の両方を入力するか、両方とも空欄にしてください")
     
+    # 切り出しモードの選択
+    cut_mode_labels = {
+        "smart": "スマートカット（境界のGOPのみ再エンコード）",
+        "parallel": "並列再エンコード（マルチコア）",
+        "reencode": "全体を再エンコード"
+    }
+    cut_mode = st.radio(
+        "切り出しモード",
+        CUT_MODES,
+        index=CUT_MODES.index(get_cut_mode()),
+        format_func=lambda mode: cut_mode_labels[mode],
+        horizontal=True
+    )
+    
     # すべての入力が有効かチェック
     time_input_valid = True
     if (start_time.strip() and not end_time.strip()) or (not start_time.strip() and end_time.strip()):
         time_input_valid = False
     
-    all_valid = url_valid and start_time_valid and end_time_valid and time_input_valid and youtube_url
+    all_valid = url_valid and start_time_valid and end_time_valid and extra_sections_valid and entry_ranges_valid and time_input_valid and youtube_url
+    jobs_running = st.session_state.job_id is not None or bool(st.session_state.playlist_job_ids)
     
-    if all_valid:
-        # yt-dlpコマンドを構築
-        cmd = [
-            "yt-dlp",
-            "-S", "codec:avc:aac,res:1080,fps:60,hdr:sdr"
-        ]
+    if all_valid and playlist:
+        st.subheader("ダウンロードする動画")
+        playlist_requests = build_playlist_requests(playlist, entry_ranges, sections, cut_mode)
+        st.caption("　".join(
+            f"{index}. {entry['title'] or entry['id']}（" + ("、".join(f"{s} ～ {e}" for s, e in request["sections"]) if request["sections"][0][0] else "全体") + "）"
+            for index, (entry, request) in enumerate(zip(playlist["entries"], playlist_requests), 1)
+        ))
         
-        # クラウド環境（Streamlit Cloud、Railway等）の検出
-        is_cloud_environment = False
-        try:
-            is_cloud_environment = (
-                "STREAMLIT_SHARING" in os.environ or 
-                "streamlit" in os.environ.get("HOME", "").lower() or
-                "appuser" in os.environ.get("HOME", "").lower() or
-                os.path.exists("/home/appuser") or
-                "RAILWAY_ENVIRONMENT" in os.environ or
-                "PORT" in os.environ
-            )
-        except Exception:
-            pass
-        
-        # ローカル環境でのみクッキーオプションを追加
-        if not is_cloud_environment:
-            try:
-                cmd.extend(["--cookies-from-browser", "chrome"])
-            except Exception:
-                pass
-        
-        # 時間指定がある場合のみセクションダウンロードを追加
-        if start_time.strip() and end_time.strip():
-            # 時間を正規化してからダウンロードセクションの文字列を作成
-            normalized_start = normalize_time_format(start_time)
-            normalized_end = normalize_time_format(end_time)
-            download_sections = f"*{normalized_start}-{normalized_end}"
-            cmd.extend([
-                "--download-sections", download_sections,
-                "--force-keyframes-at-cuts"
-            ])
-            
-        
-        cmd.extend([
-            "-f", "bv+ba",
-            "-o", "%(title)s_%(height)s_%(fps)s_%(vcodec.:4)s_(%(id)s).%(ext)s",
-            youtube_url
-        ])
+        if st.button("すべてダウンロード開始", type="primary", disabled=jobs_running):
+            st.session_state.playlist_job_ids = submit_playlist_jobs(playlist_requests)
+    elif all_valid:
+        # yt-dlpコマンドを構築（ジョブでは切り出し段階で再エンコードするため、キーフレームの挿入は指定しない）
+        cmd = build_command(youtube_url, sections, None)
         
         # コマンド表示
         st.subheader("実行するコマンド")
-        download_sections_for_display = ""
-        if start_time.strip() and end_time.strip():
-            normalized_start = normalize_time_format(start_time)
-            normalized_end = normalize_time_format(end_time)
-            download_sections_for_display = f"*{normalized_start}-{normalized_end}"
-        formatted_cmd = format_command_display(cmd, download_sections_for_display, youtube_url)
+        formatted_cmd = format_command_display(cmd, youtube_url)
         st.code(formatted_cmd, language="bash")
         
         # ダウンロードボタン
-        if st.button("ダウンロード開始", type="primary"):
-            with st.spinner("ダウンロード中..."):
-                try:
-                    # 一意のファイル名生成のため、yt-dlpコマンドを調整
-                    temp_dir = tempfile.mkdtemp()
-                    temp_cmd = cmd.copy()
-                    
-                    # 一時ディレクトリに出力するように変更
-                    for i, arg in enumerate(temp_cmd):
-                        if arg == "-o":
-                            temp_cmd[i+1] = os.path.join(temp_dir, temp_cmd[i+1])
-                            break
-                    
-                    # yt-dlpコマンドを実行
-                    result = subprocess.run(temp_cmd, check=True, capture_output=True, text=True)
-                    st.success("ダウンロードが完了しました！")
-                    if result.stdout:
-                        st.text_area("出力:", result.stdout, height=200)
-                    
-                    # 一時ディレクトリからダウンロードされたファイルを取得
-                    temp_files = glob.glob(os.path.join(temp_dir, "*.mp4"))
-                    
-                    if temp_files:
-                        # 最新のファイルを取得
-                        temp_file = temp_files[0]
-                        original_name = os.path.basename(temp_file)
-                        
-                        # 現在のディレクトリで一意のファイル名を生成
-                        final_path = get_unique_filename(original_name)
-                        
-                        # ファイルを現在のディレクトリにコピー
-                        shutil.move(temp_file, final_path)
-                        
-                        # ファイルをバイナリで読み込み
-                        with open(final_path, "rb") as f:
-                            file_data = f.read()
-                        
-                        # セッション状態に保存
-                        st.session_state.downloaded_file_path = final_path
-                        st.session_state.downloaded_file_data = file_data
-                        st.session_state.downloaded_file_name = os.path.basename(final_path)
-                        
-                        # 一時ディレクトリをクリーンアップ
-                        shutil.rmtree(temp_dir, ignore_errors=True)
-                    else:
-                        # 一時ディレクトリをクリーンアップ
-                        shutil.rmtree(temp_dir, ignore_errors=True)
-                        st.error("ダウンロードに失敗しました。")
-                        
-                except subprocess.CalledProcessError as e:
-                    st.error(f"エラーが発生しました: {e}")
-                    if e.stderr:
-                        st.text_area("エラー詳細:", e.stderr, height=200)
-                    # 一時ディレクトリをクリーンアップ
-                    if 'temp_dir' in locals():
-                        shutil.rmtree(temp_dir, ignore_errors=True)
-                except FileNotFoundError:
-                    st.error("yt-dlpが見つかりません。yt-dlpがインストールされているか確認してください。")
-                    # 一時ディレクトリをクリーンアップ
-                    if 'temp_dir' in locals():
-                        shutil.rmtree(temp_dir, ignore_errors=True)
+        if st.button("ダウンロード開始", type="primary", disabled=jobs_running):
+            request = {
+                "youtube_url": youtube_url,
+                "video_id": extract_video_id(youtube_url),
+                "sections": sections or [(None, None)],
+                "cut_mode": cut_mode,
+            }
+            
+            # スクリプトのスレッドを塞がないよう、プロセス共通のスケジューラーにジョブとして投入
+            st.session_state.job_id = get_scheduler().submit(
+                st.session_state.session_id,
+                functools.partial(download_clip, request=request),
+                functools.partial(encode_clip, request=request)
+            )
+            if get_storage() is not None:
+                st.query_params["job"] = st.session_state.job_id
+    
+    # 投入済みジョブの状態を表示（再実行後もセッション状態のジョブIDから参照）
+    job_running = False
+    if st.session_state.job_id is not None:
+        job_running = show_job_status()
+    if st.session_state.playlist_job_ids:
+        # 単体のジョブと再生リストのジョブが同時に実行中の場合も、どちらかが終わるまで再実行を続ける
+        job_running = show_playlist_status() or job_running
     
     # ダウンロードファイルがある場合、ダウンロードボタンを表示
-    if st.session_state.downloaded_file_data is not None:
+    if st.session_state.downloaded_files:
         st.markdown("---")
         st.subheader("📥 ファイルダウンロード")
         
-        # ダウンロードボタン（クリック時に自動削除）
-        download_button = st.download_button(
-            label="💾 ファイルをダウンロード",
-            data=st.session_state.downloaded_file_data,
-            file_name=st.session_state.downloaded_file_name,
-            mime="video/mp4",
-            type="primary",
-            on_click=lambda: cleanup_server_file()
+        # 区間ごとのダウンロードリンク（ディスクから分割して配信されるため、ファイルサイズに関わらずメモリを消費しない）
+        for downloaded_file in st.session_state.downloaded_files:
+            st.link_button(
+                f"💾 {downloaded_file['name']}" if len(st.session_state.downloaded_files) > 1 else "💾 ファイルをダウンロード",
+                file_server.file_url(downloaded_file["token"]),
+                type="primary"
+            )
+        
+        # ダウンロード後にサーバー上のファイルを削除
+        st.button("🗑️ サーバーからファイルを削除", on_click=lambda: cleanup_server_file())
+    
+    # キャッシュの利用状況を表示
+    cache_stats = get_default_cache().get_stats()
+    st.sidebar.subheader("キャッシュ")
+    st.sidebar.caption(
+        f"ヒット: {cache_stats['hits']}（共有ストレージから: {cache_stats['shared_hits']}） / ミス: {cache_stats['misses']} / "
+        f"削除: {cache_stats['evictions']} / ローカル切り出し: {cache_stats['local_cuts']}"
+    )
+    
+    # ジョブキューの状況を表示
+    queue_stats = get_scheduler().get_stats()
+    st.sidebar.subheader("ジョブキュー")
+    st.sidebar.caption(
+        f"ダウンロード: 実行中 {queue_stats['active_downloads']} / 待機 {queue_stats['queued_downloads']}　"
+        f"切り出し: 実行中 {queue_stats['active_encodes']} / 待機 {queue_stats['queued_encodes']}"
+    )
+    flight_stats = get_single_flight().get_stats()
+    st.sidebar.caption(f"yt-dlp実行: {flight_stats['executions']} / 実行中のダウンロードに合流: {flight_stats['coalesced']}")
+    
+    # 処理段階ごとの平均時間を表示（詳細は配信サーバーの/metricsで取得）
+    phase_stats = get_phase_stats()
+    if phase_stats:
+        phase_labels = {"metadata": "情報取得", "download": "ダウンロード", "cut": "切り出し", "move": "保存", "delivery": "配信"}
+        st.sidebar.subheader("処理時間")
+        st.sidebar.caption("　".join(
+            f"{phase_labels.get(phase, phase)}: 平均{stats['average_seconds']:.1f}秒（{stats['count']}回）"
+            for phase, stats in phase_stats.items()
+        ))
+    
+    # ホストごとに自動調整したダウンロード設定を表示
+    tuning_stats = get_tuner().get_stats()
+    if tuning_stats:
+        st.sidebar.subheader("ダウンロード設定")
+    for host, best in tuning_stats.items():
+        st.sidebar.caption(
+            f"{host}: 同時取得 {best['concurrent_fragments']} / チャンク {format_bytes(best['chunk_size'])} / "
+            f"{format_bytes(best['throughput'])}/s"
         )
+    
+    # ジョブが完了するまで定期的に再実行して状態を更新
+    if job_running:
+        time.sleep(1)
+        st.rerun()
 
-def cleanup_server_file():
-    """サーバー上のファイルとセッション状態をクリーンアップ"""
-    if st.session_state.downloaded_file_path and os.path.exists(st.session_state.downloaded_file_path):
+def download_clip(job, request):
+    """ジョブのダウンロード段階：区間ごとにキャッシュを確認し、残りの区間だけを1回のyt-dlp実行でまとめて取得"""
+    clip_cache = get_default_cache()
+    video_id = request["video_id"]
+    
+    # 他のレプリカでも結果を取得できるよう、完成するクリップのキャッシュキーを公開しておく
+    job.clips = [
+        {"video_id": video_id, "key": make_cache_key(video_id, FORMAT_SORT, *section)}
+        for section in request["sections"]
+    ]
+    
+    # 一意のファイル名生成のため、一時ディレクトリを使用
+    temp_dir = tempfile.mkdtemp()
+    state = {"temp_dir": temp_dir, "temp_files": {}, "final_paths": {}, "locks": {}}
+    
+    def use_cache(section):
+        """キャッシュで賄える区間ならダウンロードせずに使う（賄えない場合はFalse）"""
+        normalized_start, normalized_end = section
+        cache_key = make_cache_key(video_id, FORMAT_SORT, normalized_start, normalized_end)
+        
+        # 同じ動画・フォーマット・区間のクリップがキャッシュ（または共有ストレージ）にあればダウンロードせずに使用
+        cached_entry = clip_cache.get(video_id, cache_key)
+        if cached_entry:
+            final_path = get_output_store().link(cached_entry["path"], cached_entry["file_name"])
+            state["final_paths"][section] = final_path
+            job.message = "キャッシュから取得しました！"
+            return True
+        # 全体動画やより広い区間がキャッシュにあれば、ネットワークを使わず切り出し段階でローカルに切り出す
+        if normalized_start and normalized_end and clip_cache.find_covering(video_id, FORMAT_SORT, normalized_start, normalized_end):
+            state["temp_files"][section] = None
+            return True
+        return False
+    
+    pending = [section for section in request["sections"] if not use_cache(tuple(section))]
+    
+    if pending and get_storage() is not None:
+        # 同じクリップを複数のレプリカで作らないよう、クリップごとに共有ストレージのロックを取った1台だけが作成する
+        job.message = "他のサーバーで作成中でないか確認しています..."
         try:
-            os.remove(st.session_state.downloaded_file_path)
+            acquire_clip_locks(state, video_id, pending)
+            # 待っている間に他のレプリカが作成し終えていれば、共有ストレージから取得する
+            pending = [section for section in pending if not use_cache(section)]
         except Exception:
-            pass  # エラーは無視
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            release_clip_lock(state)
+            raise
+        # 作成しない区間のロックは、待っている他のレプリカのためにすぐ解放する
+        for section in set(state["locks"]) - {tuple(section) for section in pending}:
+            state["locks"].pop(section).release()
+    
+    if pending:
+        # キャッシュになかった区間だけを、動画情報の抽出1回でまとめてダウンロード
+        # 再エンコードもENCODE_CONCURRENCYの枠で行うため、yt-dlpではキーフレームを挿入せずに取得して切り出し段階で切り出す
+        cmd = build_command(request["youtube_url"], [section for section in pending if section[0]], None)
+        
+        # 先読みした動画情報があれば、URLからの抽出をやり直さずにinfo JSONを使う
+        download_cmd = cmd
+        video_info = get_info_cache().wait(video_id)
+        if video_info:
+            download_cmd = with_info_json(cmd, video_info["path"])
+        
+        try:
+            # 同じコマンドのダウンロードが他のセッションで実行中なら、新たに実行せずその結果を共有
+            temp_files, job.output = get_single_flight().do(
+                normalize_command(cmd, video_id),
+                functools.partial(run_ytdlp, download_cmd, pending, request["youtube_url"], video_id=video_id, on_progress=functools.partial(setattr, job, "progress")),
+                functools.partial(claim_download, temp_dir=temp_dir),
+                cleanup=lambda download: shutil.rmtree(download["temp_dir"], ignore_errors=True)
+            )
+        except Exception:
+            # 一時ディレクトリをクリーンアップ
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            release_clip_lock(state)
+            raise
+        state["temp_files"].update(temp_files)
+        job.message = "ダウンロードが完了しました！"
+    
+    # ローカルでの切り出しが不要な場合は、エンコードの枠を使わずにここで保存
+    needs_cut = any(temp_file is None or section[0] for section, temp_file in state["temp_files"].items())
+    if not needs_cut:
+        return SkipEncode(save_clips(state, request))
+    return state
+
+def build_playlist_requests(playlist, entry_ranges, default_sections, cut_mode):
+    """再生リストの各動画について、ジョブに渡すリクエストを作成"""
+    requests = []
+    for index, entry in enumerate(playlist["entries"], 1):
+        sections = entry_sections(entry, index, entry_ranges, default_sections)
+        requests.append({
+            "youtube_url": entry_url(entry),
+            "video_id": entry["id"],
+            "sections": merge_sections(sections) if sections else [(None, None)],
+            "cut_mode": cut_mode,
+        })
+    return requests
+
+def submit_playlist_jobs(requests):
+    """再生リストの動画ごとにジョブを投入し、ジョブIDのリストを返す"""
+    info_cache = get_info_cache()
+    # 同時にダウンロードする件数より少し先の動画まで、情報の抽出を並行して進めておく
+    lookahead = get_scheduler().download_concurrency + DEFAULT_LOOKAHEAD
+    for request in requests[:lookahead]:
+        info_cache.prefetch(request["video_id"], request["youtube_url"], get_cookie_options())
+    
+    job_ids = []
+    for position, request in enumerate(requests):
+        job_ids.append(get_scheduler().submit(
+            st.session_state.session_id,
+            functools.partial(download_playlist_clip, request=request, prefetch_request=(requests[position + lookahead] if position + lookahead < len(requests) else None)),
+            functools.partial(encode_clip, request=request)
+        ))
+    return job_ids
+
+def download_playlist_clip(job, request, prefetch_request=None):
+    """再生リストの1本分のダウンロード段階：先の動画の情報抽出を始めてから、失敗時は待ち時間を空けて再試行"""
+    if prefetch_request is not None:
+        get_info_cache().prefetch(prefetch_request["video_id"], prefetch_request["youtube_url"], get_cookie_options())
+    
+    def show_retry(attempt, error, delay):
+        job.message = f"{delay:.0f}秒後に再試行します（{attempt}回目の失敗）"
+    
+    return retry_with_backoff(lambda: download_clip(job, request), on_retry=show_retry)
+
+def acquire_clip_locks(state, video_id, sections):
+    """区間ごとのクリップ作成のロックを取得（待つ時間の上限を過ぎた区間は、ロックなしで自分でも作成する）"""
+    timeout = float(os.environ.get("CLIP_LOCK_TIMEOUT", DEFAULT_LOCK_TIMEOUT))
+    deadline = time.time() + timeout
+    # 複数の区間を待つレプリカ同士が互いのロックを待ち合わないよう、キーの順に取得する
+    keyed_sections = sorted(((make_cache_key(video_id, FORMAT_SORT, *section), tuple(section)) for section in sections), key=lambda item: item[0])
+    for cache_key, section in keyed_sections:
+        lock = DistributedLock(get_storage(), f"clip-{cache_key}")
+        if lock.acquire(timeout=max(0, deadline - time.time())):
+            state["locks"][section] = lock
+
+def release_clip_lock(state):
+    """クリップ作成のロックを保持していれば、すべて解放"""
+    locks = state.pop("locks", {})
+    for lock in locks.values():
+        lock.release()
+
+def normalize_command(cmd, video_id):
+    """URLの表記揺れ（youtu.be、shorts等）を吸収したコマンドを重複判定のキーとして返す"""
+    return tuple(cmd[:-1]) + (f"https://www.youtube.com/watch?v={video_id}",)
+
+def claim_download(download, temp_dir):
+    """共有されたダウンロード結果を、ジョブごとの一時ディレクトリにリンクまたはコピー"""
+    temp_files = {}
+    for section, shared_file in download["temp_files"].items():
+        temp_file = os.path.join(temp_dir, os.path.basename(shared_file))
+        link_or_copy(shared_file, temp_file)
+        temp_files[section] = temp_file
+    return temp_files, download["output"]
+
+def encode_clip(job, state, request):
+    """ジョブの切り出し段階：キャッシュ済み動画やダウンロードした区間をローカルで切り出す"""
+    cached_sections = []
+    try:
+        for index, (section, temp_file) in enumerate(list(state["temp_files"].items())):
+            normalized_start, normalized_end = section
+            if temp_file is None:
+                # 全体動画やより広い区間のキャッシュから、区間ごとのディレクトリに切り出す
+                section_dir = os.path.join(state["temp_dir"], f"section_{index}")
+                os.makedirs(section_dir)
+                state["temp_files"][section] = cut_from_cache(request["video_id"], section, section_dir, request["cut_mode"])
+                if state["temp_files"][section] is None:
+                    raise RuntimeError("キャッシュ済みの動画が見つかりませんでした。もう一度お試しください。")
+                cached_sections.append(section)
+                job.message = "キャッシュ済みの動画から切り出しました！"
+            elif normalized_start and normalized_end:
+                # ダウンロードした区間を、選んだ切り出し方法でローカルで正確に切り出す
+                trim_download(temp_file, request["video_id"], section, request["cut_mode"])
+    except Exception:
+        # 一時ディレクトリをクリーンアップ
+        shutil.rmtree(state["temp_dir"], ignore_errors=True)
+        release_clip_lock(state)
+        raise
+    
+    # キャッシュから切り出したクリップは切り出し時に登録済み
+    return save_clips(state, request, cached_sections)
+
+def save_clips(state, request, cached_sections=()):
+    """一時ディレクトリのクリップをキャッシュに登録して出力先に保存し、区間の順に保存先のパスを返す"""
+    final_paths = dict(state["final_paths"])
+    try:
+        for section, temp_file in state["temp_files"].items():
+            # 次回以降の同じリクエストのためにキャッシュへ登録
+            if section not in cached_sections:
+                cache_clip(request["video_id"], section, temp_file)
+            
+            # 出力先に一意のファイル名で移動（一時ディレクトリと同じファイルシステムならリネームのみ）
+            final_paths[section] = get_output_store().save(temp_file)
+    finally:
+        # 一時ディレクトリをクリーンアップし、共有ストレージへの登録が済んだらロックを解放
+        shutil.rmtree(state["temp_dir"], ignore_errors=True)
+        release_clip_lock(state)
+    return [final_paths[tuple(section)] for section in request["sections"]]
+
+def show_job_status():
+    """ジョブの進行状況を表示し、完了したらダウンロードできるようにする（実行中の場合はTrueを返す）"""
+    scheduler = get_scheduler()
+    job = scheduler.get_job(st.session_state.job_id)
+    if job is None:
+        # 別のレプリカで投入されたジョブは、共有ストレージに書き出された状態から表示する
+        return show_shared_job_status()
+    
+    if not job.is_finished:
+        status_labels = {
+            "queued": "⏳ ダウンロード待ち",
+            "downloading": "⬇️ ダウンロード中...",
+            "waiting_encode": "⏳ 切り出し待ち",
+            "encoding": "✂️ 切り出し中...",
+        }
+        position = scheduler.queue_position(job)
+        st.info(status_labels[job.status] + (f"（前に{position}件）" if position else ""))
+        if job.status == "downloading" and job.progress:
+            # yt-dlpの出力から読み取った進捗をリアルタイムに表示
+            st.progress(progress_fraction(job.progress) or 0.0, text=format_progress(job.progress))
+        return True
+    
+    st.session_state.job_id = None
+    if job.status == "done":
+        st.success(job.message or "ダウンロードが完了しました！")
+        if job.output:
+            st.text_area("出力:", job.output, height=200)
+        set_downloaded_files(job.result, job.clips)
+    elif isinstance(job.error, subprocess.CalledProcessError):
+        st.error(f"エラーが発生しました: {job.error}")
+        if job.error.stderr:
+            st.text_area("エラー詳細:", job.error.stderr, height=200)
+    elif isinstance(job.error, FileNotFoundError):
+        st.error("yt-dlpまたはffmpegが見つかりません。yt-dlpとffmpegがインストールされているか確認してください。")
+    else:
+        st.error(str(job.error))
+    return False
+
+def show_shared_job_status():
+    """別のレプリカで実行されたジョブの状態を表示し、完了していれば共有ストレージのクリップを取得する（実行中の場合はTrueを返す）"""
+    shared_job = get_scheduler().get_shared_job(st.session_state.job_id)
+    if shared_job is None:
+        st.session_state.job_id = None
+        return False
+    
+    if shared_job["status"] not in ("done", "error"):
+        st.info("⏳ 別のサーバーで処理中です...")
+        return True
+    
+    st.session_state.job_id = None
+    if shared_job["status"] == "error":
+        st.error(shared_job["error"] or "エラーが発生しました。")
+        return False
+    
+    final_paths = []
+    for clip in shared_job["clips"] or []:
+        cached_entry = get_default_cache().get(clip["video_id"], clip["key"])
+        if cached_entry is None:
+            st.error("作成済みのクリップが見つかりませんでした。もう一度お試しください。")
+            return False
+        final_paths.append(get_output_store().link(cached_entry["path"], cached_entry["file_name"]))
+    st.success(shared_job["message"] or "ダウンロードが完了しました！")
+    set_downloaded_files(final_paths, shared_job["clips"])
+    return False
+
+def show_playlist_status():
+    """再生リストのジョブ全体の進行状況を表示し、すべて終わったら成功分をダウンロードできるようにする（実行中の場合はTrueを返す）"""
+    scheduler = get_scheduler()
+    jobs = [job for job in (scheduler.get_job(job_id) for job_id in st.session_state.playlist_job_ids) if job is not None]
+    finished = [job for job in jobs if job.is_finished]
+    failed = [job for job in finished if job.status != "done"]
+    if not jobs:
+        st.session_state.playlist_job_ids = []
+        return False
+    
+    if len(finished) < len(jobs):
+        st.progress(len(finished) / len(jobs), text=f"{len(finished)} / {len(jobs)}本 完了（失敗 {len(failed)}本）")
+        active = next((job for job in jobs if job.status == "downloading" and job.progress), None)
+        if active is not None:
+            st.caption(format_progress(active.progress))
+        return True
+    
+    st.session_state.playlist_job_ids = []
+    if failed:
+        st.warning(f"{len(jobs) - len(failed)}本が完了し、{len(failed)}本が失敗しました。")
+        for job in failed:
+            st.caption(f"❌ {job.error}")
+    else:
+        st.success(f"{len(jobs)}本すべてのダウンロードが完了しました！")
+    done = [job for job in finished if job.status == "done"]
+    set_downloaded_files([path for job in done for path in job.result], [clip for job in done for clip in job.clips])
+    return False
+
+def set_downloaded_files(final_paths, clips=None):
+    """ダウンロード済みファイルをセッション状態に設定（clipsを渡すと、他のレプリカの配信サーバーからも取得できる）"""
+    # ファイル全体をメモリに読み込まず、配信サーバーに登録してパスとトークンのみ保存
+    st.session_state.downloaded_files = [
+        {
+            "path": final_path,
+            "token": file_server.register_file(final_path, os.path.basename(final_path), clip),
+            "name": os.path.basename(final_path),
+        }
+        for final_path, clip in zip(final_paths, clips or [None] * len(final_paths))
+    ]
+
+def cleanup_server_file():
+    """サーバー上のファイルとセッション状態をクリーンアップ"""
+    for downloaded_file in st.session_state.downloaded_files:
+        get_output_store().remove(downloaded_file["path"])
+        
+        # 配信サーバーから登録を解除
+        file_server.unregister_file(downloaded_file["token"])
     
     # セッション状態をクリア
-    st.session_state.downloaded_file_path = None
-    st.session_state.downloaded_file_data = None
-    st.session_state.downloaded_file_name = None
+    st.session_state.downloaded_files = []
+    st.query_params.pop("job", None)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,6 @@
+import streamlit as st
+
+import file_server
+
+# ダウンロードリンクとメトリクスを、Streamlitと同じポートから配信する（Railway等では$PORTしか公開されないため）
+app = st.App("streamlit_app.py", routes=file_server.file_routes())
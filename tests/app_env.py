@@ -0,0 +1,59 @@
+import os
+import sys
+import json
+import shlex
+
+import clip_cache
+import video_info
+import output_store
+import ytdlp_backend
+import download_tuning
+import storage
+import job_queue
+import playlist
+
+FAKE_YTDLP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_ytdlp.py")
+
+def fake_ytdlp_command():
+    """YTDLP_BINに指定する、ローカルの抽出器で動くyt-dlpの起動コマンド"""
+    return f"{shlex.quote(sys.executable)} {shlex.quote(FAKE_YTDLP)}"
+
+def app_environment(work_dir, media_url, log_path=None):
+    """アプリのキャッシュ・出力先を作業ディレクトリに閉じ込め、yt-dlpをローカルの抽出器に向ける環境変数を返す"""
+    env = {
+        "FAKE_MEDIA_URL": media_url,
+        "YTDLP_BIN": fake_ytdlp_command(),
+        "CLIP_CACHE_DIR": os.path.join(work_dir, "clip-cache"),
+        "INFO_CACHE_DIR": os.path.join(work_dir, "info-cache"),
+        "OUTPUT_DIR": os.path.join(work_dir, "outputs"),
+        "OUTPUT_INDEX_DIR": os.path.join(work_dir, "output-index"),
+        "DOWNLOAD_TUNING_FILE": os.path.join(work_dir, "download-tuning.json"),
+        # ブラウザのクッキーを読まないようクラウド環境として扱う
+        "STREAMLIT_SHARING": "1",
+    }
+    if log_path:
+        env["FAKE_YTDLP_LOG"] = log_path
+    return env
+
+def reset_singletons():
+    """プロセス全体で共有しているキャッシュ・スケジューラー等を破棄し、次の呼び出しで環境変数から作り直させる"""
+    if ytdlp_backend._backend is not None:
+        ytdlp_backend._backend.shutdown()
+    ytdlp_backend._backend = None
+    ytdlp_backend._rate_limiter = None
+    clip_cache._default_cache = None
+    video_info._info_cache = None
+    output_store._output_store = None
+    download_tuning._tuner = None
+    storage._storage = None
+    job_queue._scheduler = None
+    job_queue._single_flight = None
+    with playlist._entries_cache_lock:
+        playlist._entries_cache.clear()
+
+def read_invocations(log_path):
+    """偽のyt-dlpが記録した起動ごとの引数のリストを返す"""
+    if not os.path.exists(log_path):
+        return []
+    with open(log_path, encoding="utf-8") as f:
+        return [json.loads(line)["args"] for line in f if line.strip()]
@@ -0,0 +1,67 @@
+import socket
+import importlib.util
+
+import pytest
+
+from fake_media import MediaLibrary, MediaServer, has_ffmpeg
+from app_env import app_environment, reset_singletons, read_invocations
+
+requires_ffmpeg = pytest.mark.skipif(not has_ffmpeg(), reason="ffmpeg・ffprobeが必要です")
+requires_ytdlp = pytest.mark.skipif(importlib.util.find_spec("yt_dlp") is None, reason="yt-dlpが必要です")
+
+# テスト全体で使う動画（IDはYouTubeと同じ11文字）
+CLIP_ID = "clip0000001"
+PLAYLIST_ID = "PLlocal"
+PLAYLIST_VIDEO_IDS = ("list0000001", "list0000002", "list0000003")
+
+def free_port():
+    """ローカルで空いているTCPポートを返す"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+@pytest.fixture(scope="session")
+def media_library(tmp_path_factory):
+    if not has_ffmpeg():
+        pytest.skip("ffmpeg・ffprobeが必要です")
+    library = MediaLibrary(tmp_path_factory.mktemp("media"))
+    library.add_video(CLIP_ID, 30, gop=60)
+    for video_id in PLAYLIST_VIDEO_IDS:
+        library.add_video(video_id, 8, bitrate="300k")
+    library.add_playlist(PLAYLIST_ID, PLAYLIST_VIDEO_IDS)
+    return library
+
+@pytest.fixture(scope="session")
+def media_server(media_library):
+    server = MediaServer(media_library.root).start()
+    yield server
+    server.stop()
+
+class FakeYtdlp:
+    """偽のyt-dlpの起動回数を数え、遅延・失敗を注入する"""
+
+    def __init__(self, log_path, monkeypatch):
+        self.log_path = log_path
+        self.monkeypatch = monkeypatch
+
+    def invocations(self):
+        return read_invocations(self.log_path)
+
+    def set_delay(self, seconds):
+        self.monkeypatch.setenv("FAKE_YTDLP_DELAY", str(seconds))
+
+    def set_failure(self, message):
+        self.monkeypatch.setenv("FAKE_YTDLP_FAIL", message)
+
+@pytest.fixture
+def fake_ytdlp(tmp_path, monkeypatch, media_server):
+    """アプリのキャッシュ等をテストごとの一時ディレクトリに向け、yt-dlpを偽の実行ファイルに差し替える"""
+    log_path = str(tmp_path / "ytdlp-invocations.jsonl")
+    for name, value in app_environment(str(tmp_path), media_server.url, log_path).items():
+        monkeypatch.setenv(name, value)
+    for name in ("STORAGE_BACKEND", "YTDLP_BACKEND", "CUT_MODE", "FAKE_YTDLP_DELAY", "FAKE_YTDLP_FAIL", "PORT", "RAILWAY_ENVIRONMENT"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.chdir(tmp_path)
+    reset_singletons()
+    yield FakeYtdlp(log_path, monkeypatch)
+    reset_singletons()
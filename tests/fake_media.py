@@ -0,0 +1,251 @@
+import os
+import json
+import math
+import time
+import shutil
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import unquote
+
+from file_server import parse_range_header
+
+# 帯域制限時に1回で送信する量
+THROTTLE_CHUNK = 16 * 1024
+
+def has_ffmpeg():
+    return shutil.which("ffmpeg") is not None and shutil.which("ffprobe") is not None
+
+def run_ffmpeg(args):
+    subprocess.run(["ffmpeg", "-y", "-v", "error", *args], check=True, capture_output=True, text=True)
+
+def make_video(path, seconds, bitrate="1M", fps="30", gop=None, size="320x240", profile="high"):
+    """テストパターンの映像のみのH.264ファイルを生成（gopを指定するとキーフレームの間隔を固定）"""
+    args = [
+        "-f", "lavfi", "-i", f"testsrc2=size={size}:rate={fps}:duration={seconds}",
+        "-c:v", "libx264", "-preset", "veryfast", "-profile:v", profile, "-pix_fmt", "yuv420p",
+        "-b:v", bitrate, "-maxrate", bitrate, "-bufsize", bitrate,
+    ]
+    if gop:
+        args.extend(["-g", str(gop), "-keyint_min", str(gop), "-sc_threshold", "0"])
+    run_ffmpeg([*args, "-movflags", "+faststart", path])
+    return path
+
+def make_audio(path, seconds, bitrate="64k"):
+    """正弦波の音声のみのAACファイルを生成"""
+    run_ffmpeg([
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={seconds}",
+        "-c:a", "aac", "-b:a", bitrate, "-movflags", "+faststart", path
+    ])
+    return path
+
+def make_clip(path, seconds, bitrate="1M", fps="30", gop=None, size="320x240", profile="high"):
+    """映像と音声を含むH.264/AACのファイルを生成"""
+    args = [
+        "-f", "lavfi", "-i", f"testsrc2=size={size}:rate={fps}:duration={seconds}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={seconds}",
+        "-c:v", "libx264", "-preset", "veryfast", "-profile:v", profile, "-pix_fmt", "yuv420p",
+        "-b:v", bitrate, "-maxrate", bitrate, "-bufsize", bitrate,
+    ]
+    if gop:
+        args.extend(["-g", str(gop), "-keyint_min", str(gop), "-sc_threshold", "0"])
+    run_ffmpeg([*args, "-c:a", "aac", "-b:a", "64k", "-movflags", "+faststart", path])
+    return path
+
+def segment_hls(src_path, out_dir, name, segment_seconds=2):
+    """ファイルを再エンコードせずにHLSのメディアプレイリストと断片に分割"""
+    os.makedirs(out_dir, exist_ok=True)
+    run_ffmpeg([
+        "-i", src_path, "-c", "copy",
+        "-f", "hls", "-hls_time", str(segment_seconds), "-hls_playlist_type", "vod",
+        "-hls_segment_filename", os.path.join(out_dir, f"{name}_%04d.ts"),
+        os.path.join(out_dir, f"{name}.m3u8")
+    ])
+    return f"{name}.m3u8"
+
+def segment_dash(video_path, audio_path, out_dir, segment_seconds=2):
+    """映像と音声を別々のAdaptationSetに持つDASHのマニフェストと断片を生成"""
+    os.makedirs(out_dir, exist_ok=True)
+    run_ffmpeg([
+        "-i", video_path, "-i", audio_path,
+        "-map", "0:v:0", "-map", "1:a:0", "-c", "copy",
+        "-f", "dash", "-seg_duration", str(segment_seconds), "-use_template", "1", "-use_timeline", "1",
+        "-adaptation_sets", "id=0,streams=v id=1,streams=a",
+        os.path.join(out_dir, "manifest.mpd")
+    ])
+    return "manifest.mpd"
+
+class MediaLibrary:
+    """ローカルの抽出器が参照する、生成した動画と再生リストの目録"""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(os.path.join(self.root, "catalog"), exist_ok=True)
+        os.makedirs(os.path.join(self.root, "playlists"), exist_ok=True)
+
+    def write_catalog(self, video_id, entry):
+        with open(os.path.join(self.root, "catalog", f"{video_id}.json"), "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+
+    def add_video(self, video_id, seconds, bitrate="1M", fps="30", gop=None, size="320x240", kind="progressive", title=None, profile="high"):
+        """映像のみ・音声のみの形式を持つ動画を生成して登録（kind: progressive・hls・dash）"""
+        video_dir = os.path.join(self.root, video_id)
+        os.makedirs(video_dir, exist_ok=True)
+        if kind != "progressive" and gop is None:
+            # 断片の境界がキーフレームに揃うよう、2秒ごとにキーフレームを置く
+            gop = round(eval_rate(fps) * 2)
+        video_path = make_video(os.path.join(video_dir, "video.mp4"), seconds, bitrate, fps, gop, size, profile)
+        audio_path = make_audio(os.path.join(video_dir, "audio.m4a"), seconds)
+        width, height = (int(value) for value in size.split("x"))
+        video_format = {"format_id": "video", "ext": "mp4", "vcodec": "avc1.64001e", "acodec": "none", "width": width, "height": height, "fps": round(eval_rate(fps))}
+        audio_format = {"format_id": "audio", "ext": "m4a", "vcodec": "none", "acodec": "mp4a.40.2"}
+
+        entry = {"title": title or f"Test video {video_id}", "duration": seconds}
+        if kind == "progressive":
+            entry["formats"] = [
+                dict(video_format, path=f"{video_id}/video.mp4", protocol="https"),
+                dict(audio_format, path=f"{video_id}/audio.m4a", protocol="https"),
+            ]
+        elif kind == "hls":
+            hls_dir = os.path.join(video_dir, "hls")
+            entry["formats"] = [
+                dict(video_format, path=f"{video_id}/hls/{segment_hls(video_path, hls_dir, 'video')}", protocol="m3u8_native"),
+                dict(audio_format, ext="mp4", path=f"{video_id}/hls/{segment_hls(audio_path, hls_dir, 'audio')}", protocol="m3u8_native"),
+            ]
+        elif kind == "dash":
+            entry["mpd"] = f"{video_id}/dash/{segment_dash(video_path, audio_path, os.path.join(video_dir, 'dash'))}"
+        else:
+            raise ValueError(kind)
+        self.write_catalog(video_id, entry)
+        return entry
+
+    def add_playlist(self, playlist_id, video_ids, title=None):
+        with open(os.path.join(self.root, "playlists", f"{playlist_id}.json"), "w", encoding="utf-8") as f:
+            json.dump({"title": title or f"Test playlist {playlist_id}", "entries": list(video_ids)}, f)
+
+def eval_rate(fps):
+    """「30000/1001」形式のフレームレートを数値に変換"""
+    numerator, _, denominator = str(fps).partition("/")
+    return float(numerator) / float(denominator or 1)
+
+class MediaRequestHandler(BaseHTTPRequestHandler):
+    """Rangeに対応し、遅延と帯域を制限してファイルを返すハンドラー"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self.send_media(send_body=False)
+
+    def do_GET(self):
+        self.send_media(send_body=True)
+
+    def send_media(self, send_body):
+        server = self.server
+        with server.stats_lock:
+            server.stats["requests"] += 1
+        if server.latency:
+            time.sleep(server.latency)
+
+        path = os.path.normpath(os.path.join(server.root, unquote(self.path.split("?", 1)[0]).lstrip("/")))
+        if not path.startswith(server.root) or not os.path.isfile(path):
+            self.send_error(404)
+            return
+
+        file_size = os.path.getsize(path)
+        start, end, status = 0, file_size - 1, 200
+        if self.headers.get("Range"):
+            byte_range = parse_range_header(self.headers["Range"], file_size)
+            if byte_range is None:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{file_size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            (start, end), status = byte_range, 206
+
+        length = max(0, end - start + 1)
+        self.send_response(status)
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{file_size}")
+        self.end_headers()
+        if not send_body:
+            return
+
+        try:
+            with open(path, "rb") as f:
+                f.seek(start)
+                remaining = length
+                while remaining > 0:
+                    chunk = f.read(min(THROTTLE_CHUNK, remaining))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+                    with server.stats_lock:
+                        server.stats["bytes"] += len(chunk)
+                    if server.bandwidth:
+                        # 接続ごとに帯域を制限する
+                        time.sleep(len(chunk) / server.bandwidth)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+class MediaServer:
+    """生成した動画を配信するローカルのHTTPサーバー（latencyは1リクエストあたりの遅延秒、bandwidthは接続あたりのバイト/秒）"""
+
+    def __init__(self, root, latency=0.0, bandwidth=0):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), MediaRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.root = os.path.abspath(root)
+        self.httpd.latency = latency
+        self.httpd.bandwidth = bandwidth
+        self.httpd.stats = {"requests": 0, "bytes": 0}
+        self.httpd.stats_lock = threading.Lock()
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    @property
+    def stats(self):
+        with self.httpd.stats_lock:
+            return dict(self.httpd.stats)
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+# フレーム番号を輝度に埋め込む周期（再エンコード後も番号を読み取れるよう、輝度16〜215を使う）
+FRAME_NUMBER_PERIOD = 200
+
+def make_numbered_clip(path, seconds, fps="30000/1001", gop=60, profile="high"):
+    """各フレームの輝度がフレーム番号（を周期で割った余り）になる映像と音声のファイルを生成"""
+    run_ffmpeg([
+        "-f", "lavfi", "-i", f"nullsrc=size=64x64:rate={fps}:duration={seconds},geq=lum='16+mod(N,{FRAME_NUMBER_PERIOD})':cb=128:cr=128",
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={seconds}",
+        "-c:v", "libx264", "-preset", "veryfast", "-profile:v", profile, "-qp", "10",
+        "-pix_fmt", "yuv420p", "-g", str(gop), "-keyint_min", str(gop), "-sc_threshold", "0",
+        "-c:a", "aac", "-b:a", "64k", "-movflags", "+faststart", path
+    ])
+    return path
+
+def read_frame_numbers(path):
+    """make_numbered_clipで生成した映像から切り出したファイルの、各フレームの番号（周期で割った余り）を返す"""
+    result = subprocess.run([
+        "ffprobe", "-v", "error", "-f", "lavfi", "-i", f"movie={path},signalstats",
+        "-show_entries", "frame_tags=lavfi.signalstats.YAVG", "-of", "csv=p=0"
+    ], check=True, capture_output=True, text=True)
+    return [round(float(line.strip(","))) - 16 for line in result.stdout.split() if line.strip(",")]
+
+def expected_frame_numbers(start_seconds, end_seconds, seconds, fps="30000/1001", tolerance=0.01):
+    """長さseconds秒の映像のうち、表示時刻が区間[開始, 終了)に入るフレームの番号（周期で割った余り）"""
+    rate = eval_rate(fps)
+    frame_count = math.ceil(seconds * rate - 1e-9)
+    first = math.ceil((start_seconds - tolerance) * rate)
+    last = min(frame_count, math.ceil((end_seconds - tolerance) * rate))
+    return [number % FRAME_NUMBER_PERIOD for number in range(first, last)]
@@ -0,0 +1,29 @@
+import os
+import sys
+import json
+import time
+
+# yt-dlpの代わりに起動される実行ファイル（YTDLP_BIN="python tests/fake_ytdlp.py"で指定）
+# 起動ごとに引数をFAKE_YTDLP_LOGに記録し、ローカルの抽出器を読み込んだ実際のyt-dlpを実行する
+PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def record_invocation(log_path):
+    # 追記モードの短い書き込みは並行して起動されても行が混ざらない
+    with open(log_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"pid": os.getpid(), "time": time.time(), "args": sys.argv[1:]}) + "\n")
+
+def main():
+    if os.environ.get("FAKE_YTDLP_LOG"):
+        record_invocation(os.environ["FAKE_YTDLP_LOG"])
+    # 抽出が遅い・失敗する場合を再現する
+    time.sleep(float(os.environ.get("FAKE_YTDLP_DELAY", 0)))
+    if os.environ.get("FAKE_YTDLP_FAIL"):
+        sys.stderr.write(f"ERROR: {os.environ['FAKE_YTDLP_FAIL']}\n")
+        sys.exit(1)
+
+    sys.path.insert(0, PLUGIN_DIR)
+    import yt_dlp
+    yt_dlp.main(sys.argv[1:])
+
+if __name__ == "__main__":
+    main()
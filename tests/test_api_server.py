@@ -0,0 +1,167 @@
+import json
+import time
+import socket
+import asyncio
+import threading
+import http.client
+import urllib.parse
+
+import pytest
+
+from api_server import ClipStreamServer
+from conftest import CLIP_ID, requires_ytdlp, free_port
+from video_cut import probe_video_stream
+
+psutil = pytest.importorskip("psutil")
+
+pytestmark = requires_ytdlp
+
+CLIP_URL = f"https://www.youtube.com/watch?v={CLIP_ID}"
+# テスト用の動画は30秒
+CLIP_SECONDS = 30
+
+class RunningServer:
+    """APIサーバーを別スレッドのイベントループで動かす"""
+
+    def __init__(self, max_streams):
+        self.server = ClipStreamServer(max_streams=max_streams)
+        self.port = free_port()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        self.task = asyncio.run_coroutine_threadsafe(self.create_task(), self.loop).result()
+        deadline = time.time() + 10
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=1).close()
+                return self
+            except OSError:
+                assert time.time() < deadline, "APIサーバーが起動しませんでした"
+                time.sleep(0.05)
+
+    async def create_task(self):
+        return asyncio.ensure_future(self.server.serve("127.0.0.1", self.port))
+
+    async def cancel_task(self):
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.cancel_task(), self.loop).result(10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(10)
+        self.loop.close()
+
+    def request(self, path):
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+        connection.request("GET", path)
+        return connection.getresponse()
+
+    def open_clip(self, start=None, end=None, receive_buffer=None):
+        """/clipへのリクエストを送り、応答を読まずにソケットを返す"""
+        sock = socket.socket()
+        if receive_buffer:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+        sock.connect(("127.0.0.1", self.port))
+        sock.sendall(f"GET {clip_path(start, end)} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode("ascii"))
+        return sock
+
+def clip_path(start=None, end=None):
+    params = {"url": CLIP_URL}
+    if start:
+        params.update(start=start, end=end)
+    return "/clip?" + urllib.parse.urlencode(params)
+
+@pytest.fixture
+def api_server(fake_ytdlp):
+    servers = []
+    def start(max_streams=4):
+        servers.append(RunningServer(max_streams).start())
+        return servers[-1]
+    yield start
+    for server in servers:
+        server.stop()
+
+def child_processes():
+    return psutil.Process().children(recursive=True)
+
+def wait_for_children(predicate, timeout=10):
+    """子プロセスの一覧がpredicateを満たすまで待つ"""
+    deadline = time.time() + timeout
+    while not predicate(child_processes()):
+        assert time.time() < deadline, [child.cmdline() for child in child_processes()]
+        time.sleep(0.05)
+
+def stream_to_file(server, path, start=None, end=None):
+    response = server.request(clip_path(start, end))
+    assert response.status == 200, response.read()
+    assert response.getheader("Content-Type") == "video/mp4"
+    # 終端チャンクまで受け取れなければIncompleteReadになる
+    path.write_bytes(response.read())
+    return probe_video_stream(str(path))
+
+def test_full_video_stream(api_server, tmp_path):
+    server = api_server()
+    info = stream_to_file(server, tmp_path / "full.mp4")
+    assert info["duration"] == pytest.approx(CLIP_SECONDS, abs=0.5)
+
+def test_section_stream(api_server, tmp_path):
+    server = api_server()
+    info = stream_to_file(server, tmp_path / "section.mp4", "00:02", "00:05")
+    assert info["duration"] == pytest.approx(3, abs=0.2)
+
+def test_invalid_section_is_rejected(api_server):
+    response = api_server().request(clip_path("00:05", "00:02"))
+    assert response.status == 400
+    assert "終了時間" in json.loads(response.read())["error"]
+
+def test_disconnect_kills_child_processes(api_server, fake_ytdlp):
+    """生成中にクライアントが切断すると、yt-dlpとffmpegを両方とも終了する"""
+    # yt-dlpが出力を始める前に切断する
+    fake_ytdlp.set_delay(30)
+    server = api_server()
+    sock = server.open_clip()
+    wait_for_children(lambda children: len(children) >= 2)
+
+    sock.close()
+    wait_for_children(lambda children: not children)
+
+def test_concurrency_limit(api_server, fake_ytdlp):
+    """同時に生成するストリーム数を超えたリクエストは、待たせずに503で断る"""
+    fake_ytdlp.set_delay(30)
+    server = api_server(max_streams=1)
+    sock = server.open_clip()
+    wait_for_children(lambda children: len(children) >= 2)
+
+    response = server.request(clip_path())
+    assert response.status == 503
+    assert response.getheader("Retry-After") == "5"
+    assert json.loads(server.request("/health").read())["active_streams"] == 1
+
+    sock.close()
+    wait_for_children(lambda children: not children)
+    assert json.loads(server.request("/health").read())["active_streams"] == 0
+
+def test_slow_client_pauses_generation(api_server, tmp_path):
+    """クライアントが受信しない間は読み出しを止め、ffmpegを待たせる（全体をメモリに溜め込まない）"""
+    server = api_server()
+    started = time.perf_counter()
+    stream_to_file(server, tmp_path / "fast.mp4")
+    fast_seconds = time.perf_counter() - started
+
+    sock = server.open_clip(receive_buffer=4096)
+    wait_for_children(lambda children: any("ffmpeg" in " ".join(child.cmdline()) for child in children))
+    # 受信しなければ、受信する場合に全体を送り終えるより長く待ってもffmpegは書き出しを終えられない
+    time.sleep(max(2, fast_seconds * 2))
+    assert any("ffmpeg" in " ".join(child.cmdline()) for child in child_processes())
+
+    # 受信を再開すれば最後まで届く
+    received = b""
+    while not received.endswith(b"\r\n0\r\n\r\n"):
+        data = sock.recv(64 * 1024)
+        assert data, "ストリームが途中で終わりました"
+        received += data
+    sock.close()
+    wait_for_children(lambda children: not children)
@@ -0,0 +1,59 @@
+import os
+import json
+
+import pytest
+
+import app
+from conftest import CLIP_ID, requires_ytdlp
+
+pytestmark = requires_ytdlp
+
+CLIP_URL = f"https://www.youtube.com/watch?v={CLIP_ID}"
+
+def write_manifest(path, rows):
+    path.write_text("".join(json.dumps(row) + "\n" for row in rows), encoding="utf-8")
+    return str(path)
+
+def test_run_batch_rejects_invalid_rows_before_downloading(fake_ytdlp, tmp_path, capsys):
+    manifest_path = write_manifest(tmp_path / "manifest.jsonl", [
+        {"url": CLIP_URL, "start": "00:00:01", "end": "00:00:03"},
+        {"url": CLIP_URL, "start": 90, "end": "00:02:00"},
+        {"url": CLIP_URL, "start": "00:00:20", "end": "00:00:10"},
+        {"url": CLIP_URL, "start": "00:00:05", "end": "00:00:05"},
+        [CLIP_URL],
+    ])
+
+    with pytest.raises(SystemExit) as exit_info:
+        app.run_batch(manifest_path, str(tmp_path / "journal.jsonl"), 2, 2)
+
+    assert exit_info.value.code == 1
+    output = capsys.readouterr().out
+    assert "1行目" not in output
+    for index in (2, 3, 4, 5):
+        assert f"{index}行目" in output
+    # 1行でも不正があれば、正しい行も含めて何もダウンロードしない
+    assert fake_ytdlp.invocations() == []
+    assert not os.path.exists(tmp_path / "journal.jsonl")
+
+def test_run_batch_reports_unreadable_manifest(fake_ytdlp, tmp_path, capsys):
+    manifest_path = tmp_path / "manifest.jsonl"
+    manifest_path.write_text('{"url": "' + CLIP_URL + '"\n', encoding="utf-8")
+
+    with pytest.raises(SystemExit):
+        app.run_batch(str(manifest_path), str(tmp_path / "journal.jsonl"), 2, 2)
+
+    assert "マニフェストを読み込めませんでした" in capsys.readouterr().out
+    assert fake_ytdlp.invocations() == []
+
+def test_run_batch_downloads_valid_rows(fake_ytdlp, tmp_path, monkeypatch):
+    monkeypatch.setenv("CUT_MODE", "reencode")
+    manifest_path = write_manifest(tmp_path / "manifest.jsonl", [
+        {"url": CLIP_URL, "start": "00:00:01", "end": "00:00:03"},
+        {"url": CLIP_URL, "start": "", "end": ""},
+    ])
+
+    app.run_batch(manifest_path, str(tmp_path / "journal.jsonl"), 2, 2)
+
+    assert len([name for name in os.listdir(tmp_path / "outputs") if name.endswith(".mp4")]) == 2
+    with open(tmp_path / "journal.jsonl", encoding="utf-8") as f:
+        assert [json.loads(line)["status"] for line in f] == ["done", "done"]
@@ -0,0 +1,125 @@
+import os
+import types
+
+import pytest
+
+import clip_cache
+from clip_cache import ClipCache, make_cache_key, section_file_name
+from conftest import requires_ffmpeg
+from fake_media import make_clip
+
+VIDEO_ID = "cache000001"
+FORMAT_SORT = "res:720"
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    """キャッシュが参照する現在時刻を、テストから進められるようにする"""
+    fake_clock = FakeClock()
+    monkeypatch.setattr(clip_cache, "time", types.SimpleNamespace(time=fake_clock.time))
+    return fake_clock
+
+def put_bytes(cache, tmp_path, key, size):
+    """指定サイズのファイルをキャッシュに登録"""
+    src_path = tmp_path / f"{key}.src"
+    src_path.write_bytes(b"x" * size)
+    return cache.put(VIDEO_ID, key, str(src_path), f"{key}.mp4", FORMAT_SORT, "00:01", "00:02")
+
+def cached_keys(cache):
+    """ディスク上に残っているエントリのキー"""
+    return sorted(name[:-len(".json")] for name in os.listdir(os.path.join(cache.root, VIDEO_ID)) if name.endswith(".json"))
+
+def test_cache_key_ignores_time_notation():
+    assert make_cache_key(VIDEO_ID, FORMAT_SORT, "1:30", "2:00") == make_cache_key(VIDEO_ID, FORMAT_SORT, "01:30", "00:02:00")
+    assert make_cache_key(VIDEO_ID, FORMAT_SORT, "00:01:30", "02:00") == make_cache_key(VIDEO_ID, FORMAT_SORT, "01:30", "02:00")
+    assert make_cache_key(VIDEO_ID, FORMAT_SORT, "01:30", "02:00") != make_cache_key(VIDEO_ID, FORMAT_SORT, "01:31", "02:00")
+    assert make_cache_key(VIDEO_ID, FORMAT_SORT, None, None) != make_cache_key(VIDEO_ID, FORMAT_SORT, "00:00", "00:00")
+
+def test_hit_and_miss(tmp_path, clock):
+    cache = ClipCache(str(tmp_path / "cache"), max_bytes=1000, ttl=60)
+    assert cache.get(VIDEO_ID, "a") is None
+    clip_path = put_bytes(cache, tmp_path, "a", 10)
+
+    entry = cache.get(VIDEO_ID, "a")
+    assert entry["path"] == clip_path and entry["size"] == 10
+    assert cache.get_stats()["hits"] == 1 and cache.get_stats()["misses"] == 1
+
+def test_least_recently_used_is_evicted_over_byte_limit(tmp_path, clock):
+    cache = ClipCache(str(tmp_path / "cache"), max_bytes=250, ttl=3600)
+    for key in ("a", "b"):
+        put_bytes(cache, tmp_path, key, 100)
+        clock.now += 1
+    # aを使ったので、最も長く使われていないのはb
+    assert cache.get(VIDEO_ID, "a") is not None
+    clock.now += 1
+
+    put_bytes(cache, tmp_path, "c", 100)
+    assert cached_keys(cache) == ["a", "c"]
+    assert cache.get_stats()["evictions"] == 1
+
+    # 上限を超えるまでは削除しない
+    clock.now += 1
+    put_bytes(cache, tmp_path, "d", 50)
+    assert cached_keys(cache) == ["a", "c", "d"]
+
+def test_expired_entries_are_removed(tmp_path, clock):
+    cache = ClipCache(str(tmp_path / "cache"), max_bytes=1000, ttl=60)
+    put_bytes(cache, tmp_path, "a", 10)
+    clock.now += 30
+    put_bytes(cache, tmp_path, "b", 10)
+
+    clock.now += 31
+    assert cache.get(VIDEO_ID, "a") is None
+    assert cache.get(VIDEO_ID, "b") is not None
+    clock.now += 30
+    put_bytes(cache, tmp_path, "c", 10)
+    assert cached_keys(cache) == ["c"]
+
+def test_eviction_does_not_rescan_cache(tmp_path, clock, monkeypatch):
+    """容量の判定は索引で行い、登録のたびに全エントリのメタデータを読み直さない"""
+    put_bytes(ClipCache(str(tmp_path / "cache"), max_bytes=1000), tmp_path, "old", 10)
+    cache = ClipCache(str(tmp_path / "cache"), max_bytes=25, ttl=3600)
+    scans = []
+    list_entries = cache.list_entries
+    monkeypatch.setattr(cache, "list_entries", lambda video_id=None: scans.append(video_id) or list_entries(video_id))
+
+    for key in ("a", "b", "c"):
+        clock.now += 1
+        put_bytes(cache, tmp_path, key, 10)
+    # 起動後の最初の1回だけディスクから索引を作り、他のプロセスが登録したエントリも数える
+    assert scans == [None]
+    assert cached_keys(cache) == ["b", "c"]
+
+    clock.now += clip_cache.INDEX_RESCAN_INTERVAL + 1
+    put_bytes(cache, tmp_path, "d", 10)
+    assert scans == [None, None]
+
+def test_section_file_name_replaces_covering_section():
+    entry = {"file_name": "Title_720p_(cache000001)_60-120.mp4", "start_seconds": 60, "end_seconds": 120}
+    assert section_file_name(entry, "01:10", "01:20") == "Title_720p_(cache000001)_70-80.mp4"
+    whole = {"file_name": "Title_60-120_(cache000001).mp4", "start_seconds": None, "end_seconds": None}
+    assert section_file_name(whole, "00:02", "00:05") == "Title_60-120_(cache000001)_2-5.mp4"
+
+@requires_ffmpeg
+@pytest.mark.parametrize("covering_section,file_name,section,expected", [
+    (("00:50", "01:00"), "Title_(cache000001)_50-60.mp4", ("00:52", "00:55"), "Title_(cache000001)_52-55.mp4"),
+    ((None, None), "Title_(cache000001).mp4", ("00:02", "00:05"), "Title_(cache000001)_2-5.mp4"),
+])
+def test_cut_from_cache_names_clip_after_requested_section(tmp_path, covering_section, file_name, section, expected):
+    cache = ClipCache(str(tmp_path / "cache"))
+    source = make_clip(str(tmp_path / "source.mp4"), 10, bitrate="300k", gop=30)
+    cache.put(VIDEO_ID, "covering", source, file_name, FORMAT_SORT, *covering_section)
+
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    output_path = cache.cut_from_cache(VIDEO_ID, "clip", FORMAT_SORT, *section, str(output_dir), "reencode")
+
+    assert os.path.basename(output_path) == expected
+    # キャッシュに登録したクリップも、要求した区間の名前で出力される
+    assert cache.get(VIDEO_ID, "clip")["file_name"] == expected
@@ -0,0 +1,40 @@
+import pytest
+
+import cookies
+
+CLOUD_VARIABLES = ("STREAMLIT_SHARING", "RAILWAY_ENVIRONMENT", "PORT")
+
+@pytest.fixture
+def local_environment(monkeypatch, tmp_path):
+    for name in CLOUD_VARIABLES:
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setattr(cookies.os.path, "exists", lambda path: False)
+    return monkeypatch
+
+def test_local_environment_uses_browser_cookies(local_environment):
+    assert cookies.get_cookie_options() == ["--cookies-from-browser", "chrome"]
+
+@pytest.mark.parametrize("name,value", [("STREAMLIT_SHARING", "1"), ("RAILWAY_ENVIRONMENT", "production"), ("PORT", "8080")])
+def test_cloud_environment_skips_browser_cookies(local_environment, name, value):
+    local_environment.setenv(name, value)
+    assert cookies.get_cookie_options() == []
+
+def test_every_entry_point_shares_cloud_detection(local_environment):
+    """CLI・Streamlit・APIサーバーのどれから組み立てたyt-dlpコマンドも、Railway上ではクッキーを読まない"""
+    import app
+    import streamlit_app
+    import api_server
+
+    url = "https://www.youtube.com/watch?v=clip0000001"
+    local_environment.setenv("RAILWAY_ENVIRONMENT", "production")
+    commands = [
+        app.build_command(url, [], "smart"),
+        streamlit_app.build_command(url, [], "smart"),
+        api_server.build_stream_commands(url, [])[0],
+    ]
+    for cmd in commands:
+        assert "--cookies-from-browser" not in cmd
+
+    local_environment.delenv("RAILWAY_ENVIRONMENT")
+    assert "--cookies-from-browser" in api_server.build_stream_commands(url, [])[0]
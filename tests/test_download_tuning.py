@@ -0,0 +1,82 @@
+import os
+import time
+
+import pytest
+
+import download_tuning
+from conftest import requires_ytdlp
+from fake_media import MediaLibrary, MediaServer, has_ffmpeg
+from video_cut import probe_video_stream
+
+pytestmark = requires_ytdlp
+
+VIDEO_IDS = {"hls": "hlsvideo001", "dash": "dashvideo01"}
+VIDEO_SECONDS = 16
+# 断片ごとのリクエストに遅延がある回線（断片は2秒ごと）
+SEGMENT_LATENCY = 0.2
+BANDWIDTH = 2 * 1024 * 1024
+
+@pytest.fixture(scope="module")
+def streaming_library(tmp_path_factory):
+    if not has_ffmpeg():
+        pytest.skip("ffmpeg・ffprobeが必要です")
+    library = MediaLibrary(tmp_path_factory.mktemp("streaming"))
+    for kind, video_id in VIDEO_IDS.items():
+        library.add_video(video_id, VIDEO_SECONDS, bitrate="500k", kind=kind)
+    return library
+
+@pytest.fixture
+def throttled_server(streaming_library, fake_ytdlp, monkeypatch):
+    """遅延と帯域を制限したメディアサーバーに、偽のyt-dlpを向ける"""
+    server = MediaServer(streaming_library.root, latency=SEGMENT_LATENCY, bandwidth=BANDWIDTH).start()
+    monkeypatch.setenv("FAKE_MEDIA_URL", server.url)
+    yield server
+    server.stop()
+
+def download_command(url, output_path, *options):
+    return ["yt-dlp", *options, "-f", "bv+ba", "-o", output_path, url]
+
+def option_value(args, name):
+    return args[args.index(name) + 1]
+
+@pytest.mark.parametrize("kind", ["hls", "dash"])
+def test_fragmented_download_is_measured_and_tuned(kind, throttled_server, fake_ytdlp, tmp_path, monkeypatch):
+    """断片形式のダウンロードのスループットを記録し、次のダウンロードで同時取得数を増やして試す"""
+    # テスト用の動画は小さいため、計測に使う最小サイズを下げる
+    monkeypatch.setattr(download_tuning, "MIN_SAMPLE_BYTES", 0)
+    url = f"https://www.youtube.com/watch?v={VIDEO_IDS[kind]}"
+
+    first_path = str(tmp_path / "first.mp4")
+    download_tuning.run_tuned_command(download_command(url, first_path), url)
+    assert probe_video_stream(first_path)["duration"] == pytest.approx(VIDEO_SECONDS, abs=0.5)
+
+    stats = download_tuning.get_tuner().get_stats()["youtube.com"]
+    assert stats["throughput"] > 0
+    assert stats["fragment_throughput"] is not None
+    # 映像と音声の断片ごとに遅延のあるリクエストが行われる
+    assert throttled_server.stats["requests"] >= VIDEO_SECONDS / 2 * 2
+
+    download_tuning.run_tuned_command(download_command(url, str(tmp_path / "second.mp4")), url)
+    first_args, second_args = fake_ytdlp.invocations()
+    assert option_value(first_args, "--concurrent-fragments") == str(stats["concurrent_fragments"])
+    assert option_value(first_args, "--http-chunk-size") == str(stats["chunk_size"])
+    # 計測済みの設定の隣にある、まだ試していない設定で2回目を実行する
+    tried = (option_value(first_args, "--concurrent-fragments"), option_value(first_args, "--http-chunk-size"))
+    assert (option_value(second_args, "--concurrent-fragments"), option_value(second_args, "--http-chunk-size")) != tried
+    assert len(download_tuning.get_tuner().hosts["youtube.com"]["samples"]) == 2
+    # 計測結果はファイルに保存され、再起動後も使われる
+    assert os.path.exists(os.environ["DOWNLOAD_TUNING_FILE"])
+
+@pytest.mark.parametrize("kind", ["hls", "dash"])
+def test_concurrent_fragments_hide_request_latency(kind, throttled_server, fake_ytdlp, tmp_path, monkeypatch):
+    """断片ごとの遅延がある回線では、同時取得数を増やすとダウンロードが速くなる（調整の前提）"""
+    monkeypatch.setenv("DOWNLOAD_TUNING", "0")
+    url = f"https://www.youtube.com/watch?v={VIDEO_IDS[kind]}"
+
+    elapsed = {}
+    for fragments in (1, 4):
+        started = time.perf_counter()
+        download_tuning.run_tuned_command(download_command(url, str(tmp_path / f"{fragments}.mp4"), "--concurrent-fragments", str(fragments)), url)
+        elapsed[fragments] = time.perf_counter() - started
+
+    assert elapsed[4] < elapsed[1] * 0.75, elapsed
@@ -0,0 +1,31 @@
+import os
+
+from executables import get_executable, resolve_command
+from conftest import CLIP_ID, requires_ffmpeg, requires_ytdlp
+
+def test_get_executable_splits_arguments(monkeypatch):
+    monkeypatch.setenv("YTDLP_BIN", "'/opt/my python' -m yt_dlp")
+    assert get_executable("yt-dlp") == ["/opt/my python", "-m", "yt_dlp"]
+    monkeypatch.delenv("YTDLP_BIN")
+    assert get_executable("yt-dlp") == ["yt-dlp"]
+
+def test_resolve_command_passes_ffmpeg_location_to_ytdlp(monkeypatch):
+    monkeypatch.setenv("FFMPEG_BIN", "/opt/ffmpeg/bin/ffmpeg")
+    assert resolve_command(["yt-dlp", "URL"]) == ["yt-dlp", "--ffmpeg-location", "/opt/ffmpeg/bin/ffmpeg", "URL"]
+    assert resolve_command(["ffmpeg", "-i", "in.mp4"]) == ["/opt/ffmpeg/bin/ffmpeg", "-i", "in.mp4"]
+    # ffprobeは個別に差し替えない限りそのまま
+    assert resolve_command(["ffprobe", "in.mp4"]) == ["ffprobe", "in.mp4"]
+
+@requires_ffmpeg
+@requires_ytdlp
+def test_download_uses_configured_ytdlp(fake_ytdlp):
+    """YTDLP_BINで差し替えたyt-dlp（ローカルの抽出器）で実際にダウンロードできる"""
+    import app
+
+    url = f"https://www.youtube.com/watch?v={CLIP_ID}"
+    final_paths = app.download_clips(url, CLIP_ID, [], "smart")
+
+    assert len(final_paths) == 1 and os.path.getsize(final_paths[0]) > 0
+    invocations = fake_ytdlp.invocations()
+    assert len(invocations) == 1
+    assert url in invocations[0]
@@ -0,0 +1,126 @@
+import time
+import threading
+import urllib.request
+
+import pytest
+
+import file_server
+
+psutil = pytest.importorskip("psutil")
+
+# 疎なファイルなのでディスクは消費しない
+LARGE_FILE_BYTES = 3 * 1024 ** 3
+# 配信中に増えてよいメモリ（送信バッファ等）
+RSS_CEILING_BYTES = 64 * 1024 ** 2
+MARKER = b"clip-marker"
+
+@pytest.fixture
+def large_file(tmp_path):
+    path = tmp_path / "large.mp4"
+    with open(path, "wb") as f:
+        f.truncate(LARGE_FILE_BYTES)
+        # Rangeで取得した位置が正しいか確かめるための目印
+        f.seek(LARGE_FILE_BYTES - 1024)
+        f.write(MARKER)
+    token = file_server.register_file(str(path), "大きな動画.mp4")
+    yield token
+    file_server.unregister_file(token)
+
+class PeakRss:
+    """計測中のRSSの最大値を記録する"""
+
+    def __init__(self):
+        self.process = psutil.Process()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            self.stopped.wait(0.02)
+
+    def __enter__(self):
+        self.baseline = self.peak = self.process.memory_info().rss
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+def download(url, headers=None):
+    """本文を読み捨てながら取得し、（ステータス, ヘッダー, バイト数, 末尾の64バイト）を返す"""
+    received = 0
+    tail = b""
+    with urllib.request.urlopen(urllib.request.Request(url, headers=headers or {})) as response:
+        while True:
+            chunk = response.read(1024 * 1024)
+            if not chunk:
+                break
+            received += len(chunk)
+            tail = (tail + chunk)[-64:]
+        return response.status, response.headers, received, tail
+
+def assert_bounded_delivery(base_url, token):
+    with PeakRss() as rss:
+        status, headers, received, _ = download(f"{base_url}/files/{token}")
+    assert status == 200
+    assert received == LARGE_FILE_BYTES
+    assert "filename*=UTF-8''" in headers["Content-Disposition"]
+    assert rss.peak - rss.baseline < RSS_CEILING_BYTES
+
+    status, headers, received, tail = download(f"{base_url}/files/{token}", {"Range": f"bytes={LARGE_FILE_BYTES - 1024}-{LARGE_FILE_BYTES - 1024 + len(MARKER) - 1}"})
+    assert status == 206
+    assert headers["Content-Range"] == f"bytes {LARGE_FILE_BYTES - 1024}-{LARGE_FILE_BYTES - 1024 + len(MARKER) - 1}/{LARGE_FILE_BYTES}"
+    assert tail == MARKER
+
+def test_parse_range_header():
+    assert file_server.parse_range_header("bytes=0-99", 1000) == (0, 99)
+    assert file_server.parse_range_header("bytes=900-", 1000) == (900, 999)
+    assert file_server.parse_range_header("bytes=-100", 1000) == (900, 999)
+    assert file_server.parse_range_header("bytes=1000-", 1000) is None
+    assert file_server.parse_range_header("bytes=-", 1000) is None
+
+def test_file_url_is_relative_when_served_by_streamlit(monkeypatch):
+    monkeypatch.delenv("FILE_SERVER_PUBLIC_URL", raising=False)
+    monkeypatch.setattr(file_server, "_mounted", False)
+    assert file_server.file_url("abc") == f"http://localhost:{file_server.get_server_port()}/files/abc"
+
+    file_server.file_routes()
+    assert file_server.file_url("abc") == "/files/abc"
+    # 同じポートから配信するため、別ポートのサーバーは起動しない
+    assert file_server.start_server() is None
+
+    monkeypatch.setenv("FILE_SERVER_PUBLIC_URL", "https://clips.example.com/")
+    assert file_server.file_url("abc") == "https://clips.example.com/files/abc"
+
+def test_streamlit_route_memory_is_bounded(large_file, monkeypatch):
+    """Streamlitのサーバー（Starlette）に追加したルートで数GBのファイルを配信してもメモリが増え続けない"""
+    uvicorn = pytest.importorskip("uvicorn")
+    from starlette.applications import Starlette
+
+    monkeypatch.setattr(file_server, "_mounted", False)
+    server = uvicorn.Server(uvicorn.Config(Starlette(routes=file_server.file_routes()), host="127.0.0.1", port=0, log_level="error"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    try:
+        while not server.started:
+            time.sleep(0.05)
+        port = server.servers[0].sockets[0].getsockname()[1]
+        assert_bounded_delivery(f"http://127.0.0.1:{port}", large_file)
+    finally:
+        server.should_exit = True
+        thread.join()
+
+def test_standalone_server_memory_is_bounded(large_file, monkeypatch):
+    """別ポートの配信サーバー（ローカル実行時）でも同様にメモリが増え続けない"""
+    from http.server import ThreadingHTTPServer
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), file_server.FileRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        assert_bounded_delivery(f"http://127.0.0.1:{server.server_address[1]}", large_file)
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,145 @@
+import time
+import functools
+import threading
+
+import pytest
+
+from conftest import CLIP_ID, requires_ytdlp
+from job_queue import FairQueue, Job, JobScheduler, SkipEncode
+from video_cut import probe_video_stream
+
+CLIP_URL = f"https://www.youtube.com/watch?v={CLIP_ID}"
+TIMEOUT = 10
+
+class StageTracker:
+    """偽のジョブの処理を記録し、テストが解放するまで各ジョブを止めておく"""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.gates = {}
+        self.started = []
+        self.active = 0
+        self.max_active = 0
+
+    def gate(self, name):
+        with self.condition:
+            return self.gates.setdefault(name, threading.Event())
+
+    def run(self, name):
+        gate = self.gate(name)
+        with self.condition:
+            self.started.append(name)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            self.condition.notify_all()
+        try:
+            assert gate.wait(TIMEOUT), f"{name}が解放されませんでした"
+        finally:
+            with self.condition:
+                self.active -= 1
+        return name
+
+    def wait_started(self, count):
+        with self.condition:
+            assert self.condition.wait_for(lambda: len(self.started) >= count, TIMEOUT), self.started
+
+    def release(self, *names):
+        for name in names:
+            self.gate(name).set()
+
+def wait_until(predicate):
+    deadline = time.time() + TIMEOUT
+    while not predicate():
+        assert time.time() < deadline, "条件を満たしませんでした"
+        time.sleep(0.01)
+
+def test_fair_queue_round_robin():
+    queue = FairQueue()
+    for session_id, item in [("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b1"), ("c", "c1"), ("b", "b2")]:
+        queue.put(session_id, item)
+
+    assert len(queue) == 6
+    assert [queue.position(item) for item in ("a1", "b1", "c1", "a2", "b2", "a3")] == [0, 1, 2, 3, 4, 5]
+    assert queue.position("missing") is None
+    assert [queue.get() for _ in range(4)] == ["a1", "b1", "c1", "a2"]
+
+    # 後から投入したセッションも、先に投入したセッションの残りを待たずに順番が回ってくる
+    queue.put("d", "d1")
+    assert [queue.get() for _ in range(3)] == ["b2", "a3", "d1"]
+    assert len(queue) == 0
+
+def test_scheduler_takes_turns_between_sessions():
+    scheduler = JobScheduler(download_concurrency=1, encode_concurrency=1)
+    downloads = StageTracker()
+    scheduler.submit("blocker", lambda job: downloads.run("blocker"))
+    downloads.wait_started(1)
+
+    names = ["a1", "a2", "a3", "b1", "b2", "c1"]
+    jobs = [scheduler.get_job(scheduler.submit(name[0], lambda job, name=name: downloads.run(name))) for name in names]
+    expected = ["a1", "b1", "c1", "a2", "b2", "a3"]
+    assert [scheduler.queue_position(job) for job in jobs] == [expected.index(name) for name in names]
+
+    downloads.release("blocker", *names)
+    wait_until(lambda: all(job.is_finished for job in jobs))
+    assert downloads.started == ["blocker"] + expected
+    assert downloads.max_active == 1
+    assert [job.result for job in jobs] == names
+
+def test_scheduler_limits_each_stage():
+    scheduler = JobScheduler(download_concurrency=2, encode_concurrency=1)
+    downloads = StageTracker()
+    encodes = StageTracker()
+    names = ["a1", "b1", "c1", "d1"]
+    jobs = [
+        scheduler.get_job(scheduler.submit(name[0], lambda job, name=name: downloads.run(name), lambda job, state: encodes.run(state)))
+        for name in names
+    ]
+
+    downloads.wait_started(2)
+    assert scheduler.get_stats() == {"queued_downloads": 2, "queued_encodes": 0, "active_downloads": 2, "active_encodes": 0}
+
+    # ダウンロードが終わったジョブは、エンコードの枠が空くまで待つ
+    downloads.release(*names)
+    encodes.wait_started(1)
+    wait_until(lambda: [job.status for job in jobs].count("waiting_encode") == 3)
+    assert scheduler.get_stats() == {"queued_downloads": 0, "queued_encodes": 3, "active_downloads": 0, "active_encodes": 1}
+    assert sorted(scheduler.queue_position(job) for job in jobs if job.status == "waiting_encode") == [0, 1, 2]
+
+    encodes.release(*names)
+    wait_until(lambda: all(job.is_finished for job in jobs))
+    assert downloads.max_active == 2
+    assert encodes.max_active == 1
+    assert sorted(encodes.started) == names
+    assert [job.result for job in jobs] == names
+
+def test_skip_encode_and_errors():
+    scheduler = JobScheduler(download_concurrency=1, encode_concurrency=1)
+    encodes = StageTracker()
+
+    def fail(job):
+        raise RuntimeError("失敗")
+
+    skipped = scheduler.get_job(scheduler.submit("a", lambda job: SkipEncode("saved"), lambda job, state: encodes.run("encoded")))
+    failed = scheduler.get_job(scheduler.submit("a", fail, lambda job, state: encodes.run("encoded")))
+    wait_until(lambda: skipped.is_finished and failed.is_finished)
+
+    assert (skipped.status, skipped.result) == ("done", "saved")
+    assert failed.status == "error" and str(failed.error) == "失敗"
+    assert encodes.started == []
+
+@requires_ytdlp
+def test_reencode_runs_in_encode_stage(fake_ytdlp):
+    """再エンコードもエンコードの枠で行うため、ダウンロード段階ではyt-dlpにキーフレームを挿入させない"""
+    import streamlit_app
+
+    request = {"youtube_url": CLIP_URL, "video_id": CLIP_ID, "sections": [("00:02", "00:05")], "cut_mode": "reencode"}
+    job = Job("session", functools.partial(streamlit_app.download_clip, request=request))
+    state = streamlit_app.download_clip(job, request)
+
+    assert not isinstance(state, SkipEncode)
+    [args] = fake_ytdlp.invocations()
+    assert "*00:02-00:05" in args
+    assert "--force-keyframes-at-cuts" not in args
+
+    [path] = streamlit_app.encode_clip(job, state, request)
+    assert probe_video_stream(path)["duration"] == pytest.approx(3, abs=0.2)
@@ -0,0 +1,120 @@
+import sys
+import json
+import threading
+
+import pytest
+
+import metrics
+from conftest import CLIP_ID, requires_ytdlp
+from executables import run_executable
+from metrics import span, observe, register_gauge, render_prometheus
+
+# 子プロセスとして実行するPythonのコード（CPUを使い続ける・メモリを確保する・待つだけ）
+BUSY_CHILD = "import time\nend = time.process_time() + 0.5\nwhile time.process_time() < end: pass"
+LARGE_CHILD = "import time\ndata = bytearray(200 * 1024 * 1024)\ntime.sleep(0.3)"
+IDLE_CHILD = "import time\ntime.sleep(0.5)"
+LARGE_BYTES = 200 * 1024 * 1024
+
+@pytest.fixture
+def metrics_log(tmp_path, monkeypatch):
+    """集計を空にし、計測結果をJSONログから読めるようにする"""
+    monkeypatch.setattr(metrics, "_phases", {})
+    monkeypatch.setattr(metrics, "_gauges", [])
+    log_path = tmp_path / "metrics.jsonl"
+    monkeypatch.setenv("METRICS_LOG", str(log_path))
+
+    def read_records():
+        return {record["phase"]: record for record in map(json.loads, log_path.read_text(encoding="utf-8").splitlines())}
+    return read_records
+
+def run_python(code):
+    run_executable([sys.executable, "-c", code])
+
+def run_in_span(phase, code):
+    with span(phase):
+        run_python(code)
+
+def test_concurrent_spans_count_only_their_own_children(metrics_log):
+    """同時に実行中の区間があっても、各区間には自分が実行した子プロセスの使用量だけが入る"""
+    threads = [
+        threading.Thread(target=run_in_span, args=(phase, code))
+        for phase, code in (("busy", BUSY_CHILD), ("large", LARGE_CHILD), ("idle", IDLE_CHILD))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with span("no_child"):
+        pass
+
+    records = metrics_log()
+    assert records["busy"]["child_cpu_seconds"] >= 0.4
+    assert records["idle"]["child_cpu_seconds"] < 0.2
+    assert records["large"]["peak_rss_bytes"] >= LARGE_BYTES
+    assert 0 < records["busy"]["peak_rss_bytes"] < LARGE_BYTES
+    assert 0 < records["idle"]["peak_rss_bytes"] < LARGE_BYTES
+    assert records["no_child"]["child_cpu_seconds"] == 0
+    assert records["no_child"]["peak_rss_bytes"] == 0
+
+def test_nested_spans_and_errors(metrics_log):
+    with pytest.raises(RuntimeError):
+        with span("outer", video_id="abc"):
+            with span("inner"):
+                run_python(BUSY_CHILD)
+            raise RuntimeError("失敗")
+
+    records = metrics_log()
+    # 内側の区間の子プロセスは、外側の区間にも含まれる
+    assert records["inner"]["child_cpu_seconds"] >= 0.4
+    assert records["outer"]["child_cpu_seconds"] >= records["inner"]["child_cpu_seconds"]
+    assert records["inner"]["status"] == "ok"
+    assert records["outer"]["status"] == "error"
+    assert records["outer"]["error"] == "失敗"
+    assert records["outer"]["video_id"] == "abc"
+
+@requires_ytdlp
+@pytest.mark.parametrize("backend", ["subprocess", "inprocess"])
+def test_ytdlp_usage_is_recorded_with_each_backend(backend, fake_ytdlp, metrics_log, monkeypatch):
+    from video_info import get_info_cache
+
+    monkeypatch.setenv("YTDLP_BACKEND", backend)
+    get_info_cache().fetch(CLIP_ID, f"https://www.youtube.com/watch?v={CLIP_ID}")
+
+    record = metrics_log()["metadata"]
+    assert record["child_cpu_seconds"] > 0
+    assert record["peak_rss_bytes"] > 0
+
+def record(phase, wall_seconds, status="ok", num_bytes=0, child_cpu_seconds=0.0, peak_rss_bytes=0):
+    return {
+        "phase": phase, "started": 0, "wall_seconds": wall_seconds, "child_cpu_seconds": child_cpu_seconds,
+        "peak_rss_bytes": peak_rss_bytes, "bytes": num_bytes, "status": status,
+    }
+
+def test_render_prometheus(metrics_log):
+    observe(record("download", 0.3, num_bytes=100, child_cpu_seconds=1.5, peak_rss_bytes=2048))
+    observe(record("download", 4, status="error", num_bytes=50, child_cpu_seconds=0.5, peak_rss_bytes=1024))
+    observe(record("cut", 700))
+    register_gauge("clip_jobs_queued", "Queued jobs.", lambda: {"download": 2, "encode": 0}, label="stage")
+    register_gauge("clip_active_streams", "Active streams.", lambda: 3)
+    register_gauge("clip_broken", "Fails to collect.", lambda: 1 / 0)
+
+    lines = render_prometheus().splitlines()
+    # ヒストグラムは累積の件数
+    assert 'clip_phase_seconds_bucket{phase="download",le="0.1"} 0' in lines
+    assert 'clip_phase_seconds_bucket{phase="download",le="0.5"} 1' in lines
+    assert 'clip_phase_seconds_bucket{phase="download",le="5"} 2' in lines
+    assert 'clip_phase_seconds_bucket{phase="download",le="+Inf"} 2' in lines
+    assert 'clip_phase_seconds_bucket{phase="cut",le="600"} 0' in lines
+    assert 'clip_phase_seconds_bucket{phase="cut",le="+Inf"} 1' in lines
+    assert 'clip_phase_seconds_sum{phase="download"} 4.3' in lines
+    assert 'clip_phase_seconds_count{phase="download"} 2' in lines
+    assert 'clip_phase_errors_total{phase="download"} 1' in lines
+    assert 'clip_phase_bytes_total{phase="download"} 150' in lines
+    assert 'clip_phase_child_cpu_seconds_total{phase="download"} 2.0' in lines
+    assert 'clip_phase_peak_rss_bytes{phase="download"} 2048' in lines
+    assert "# TYPE clip_phase_seconds histogram" in lines
+    assert 'clip_jobs_queued{stage="download"} 2' in lines
+    assert 'clip_jobs_queued{stage="encode"} 0' in lines
+    assert "clip_active_streams 3" in lines
+    # 取得に失敗したゲージは出力しない
+    assert not any(line.startswith("clip_broken") or "clip_broken " in line for line in lines)
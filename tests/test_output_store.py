@@ -0,0 +1,40 @@
+import os
+
+import pytest
+
+import output_store
+from output_store import OutputStore
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setenv("OUTPUT_INDEX_DIR", str(tmp_path / "state"))
+    return OutputStore(str(tmp_path / "outputs"))
+
+def save_bytes(store, tmp_path, file_name, data=b"clip"):
+    temp_file = tmp_path / f"temp-{os.urandom(4).hex()}"
+    temp_file.write_bytes(data)
+    return store.save(str(temp_file), file_name)
+
+def test_index_is_kept_out_of_the_output_directory(store, tmp_path):
+    save_bytes(store, tmp_path, "a.mp4")
+    # 索引とWALのファイルは出力先（CLIでは現在のディレクトリ）に置かない
+    assert os.listdir(store.root) == ["a.mp4"]
+    assert any(name.endswith(".sqlite3") for name in os.listdir(tmp_path / "state"))
+
+def test_name_of_deleted_file_is_reused(store, tmp_path):
+    first = save_bytes(store, tmp_path, "a.mp4")
+    assert os.path.basename(save_bytes(store, tmp_path, "a.mp4")) == "a_V2.mp4"
+
+    # 利用者が削除したファイルの名前は、索引に残っていても空きとして扱う
+    os.remove(first)
+    assert os.path.basename(save_bytes(store, tmp_path, "a.mp4")) == "a.mp4"
+
+def test_reserved_name_is_taken_until_it_expires(store, tmp_path, monkeypatch):
+    # 保存中（予約済みでファイルがまだない）の名前は他の保存に渡さない
+    reserved = store.allocate("b.mp4")
+    assert not os.path.exists(reserved)
+    assert os.path.basename(store.allocate("b.mp4")) == "b_V2.mp4"
+
+    # 予約したまま置かれなかった名前は、期限を過ぎれば再び使う
+    monkeypatch.setattr(output_store, "RESERVATION_TIMEOUT", 0)
+    assert os.path.basename(save_bytes(store, tmp_path, "b.mp4")) == "b.mp4"
@@ -0,0 +1,105 @@
+import os
+import time
+import functools
+import subprocess
+
+import pytest
+
+from conftest import PLAYLIST_ID, PLAYLIST_VIDEO_IDS, requires_ytdlp
+from playlist import fetch_entries, parse_entry_ranges, entry_sections, retry_with_backoff
+
+pytestmark = requires_ytdlp
+
+PLAYLIST_URL = f"https://www.youtube.com/playlist?list={PLAYLIST_ID}"
+
+def test_parse_entry_ranges():
+    ranges = parse_entry_ranges("# コメント\nlist0000001: 00:01-00:03, 00:05-00:06\n2 00:02-00:04\n")
+    assert ranges == {"list0000001": [("00:01", "00:03"), ("00:05", "00:06")], "2": [("00:02", "00:04")]}
+    assert entry_sections({"id": "list0000003"}, 3, ranges, [("00:00", "00:01")]) == [("00:00", "00:01")]
+    assert entry_sections({"id": "list0000002"}, 2, ranges, []) == [("00:02", "00:04")]
+    with pytest.raises(ValueError):
+        parse_entry_ranges("区間のない行")
+
+def test_fetch_entries_is_cached(fake_ytdlp):
+    playlist = fetch_entries(PLAYLIST_URL)
+    assert playlist["title"] == f"Test playlist {PLAYLIST_ID}"
+    assert [entry["id"] for entry in playlist["entries"]] == list(PLAYLIST_VIDEO_IDS)
+    fetch_entries(PLAYLIST_URL)
+    assert len(fake_ytdlp.invocations()) == 1
+
+def test_fetch_entries_reports_unparsable_output(fake_ytdlp, monkeypatch):
+    """yt-dlpの出力がJSONでない場合は、JSONDecodeErrorではなく表示用のRuntimeErrorにする"""
+    monkeypatch.setattr("playlist.run_ytdlp_command", lambda cmd: type("Result", (), {"stdout": "[localmedia] Extracting URL"})())
+    with pytest.raises(RuntimeError):
+        fetch_entries(PLAYLIST_URL)
+
+def test_run_playlist_downloads_every_entry(fake_ytdlp, tmp_path, monkeypatch):
+    """CLIの再生リストモードで、各動画の区間を並列にダウンロードする"""
+    import app
+
+    monkeypatch.setenv("CUT_MODE", "reencode")
+    entry_ranges = tmp_path / "ranges.txt"
+    entry_ranges.write_text("list0000002: 00:02-00:04\n", encoding="utf-8")
+    journal_path = str(tmp_path / "playlist.journal.jsonl")
+
+    app.run_playlist(PLAYLIST_URL, "00:01", "00:03", str(entry_ranges), journal_path, 2, 2)
+
+    outputs = sorted(os.listdir(tmp_path / "outputs"))
+    assert len([name for name in outputs if name.endswith(".mp4")]) == 3
+    for video_id in PLAYLIST_VIDEO_IDS:
+        assert any(video_id in name for name in outputs)
+    invocations = fake_ytdlp.invocations()
+    # 一覧の取得1回と、各動画の情報抽出・ダウンロード
+    assert sum("--flat-playlist" in args for args in invocations) == 1
+    downloads = [args for args in invocations if "--download-sections" in args]
+    assert len(downloads) == 3
+    assert any("*00:02-00:04" in args for args in downloads)
+
+    # 再実行しても完了済みの動画はダウンロードし直さない
+    app.run_playlist(PLAYLIST_URL, "00:01", "00:03", str(entry_ranges), journal_path, 2, 2)
+    assert len([args for args in fake_ytdlp.invocations() if "--download-sections" in args]) == 3
+
+def test_streamlit_playlist_jobs_retry_failures(fake_ytdlp, monkeypatch):
+    """Streamlitの再生リストのジョブは、一時的な失敗を待ち時間を空けて再試行する"""
+    import streamlit_app
+    from job_queue import get_scheduler
+
+    playlist = fetch_entries(PLAYLIST_URL)
+    requests = streamlit_app.build_playlist_requests(playlist, {}, [("00:01", "00:03")], "reencode")
+
+    # 最初の1回だけ失敗させる
+    attempts = []
+    run_ytdlp = streamlit_app.run_ytdlp
+    def flaky_run_ytdlp(*args, **kwargs):
+        attempts.append(args)
+        if len(attempts) == 1:
+            raise subprocess.CalledProcessError(1, ["yt-dlp"], "", "ERROR: HTTP Error 503")
+        return run_ytdlp(*args, **kwargs)
+    monkeypatch.setattr(streamlit_app, "run_ytdlp", flaky_run_ytdlp)
+    monkeypatch.setattr(streamlit_app, "retry_with_backoff", functools.partial(retry_with_backoff, base_delay=0.01))
+
+    scheduler = get_scheduler()
+    job_ids = [
+        scheduler.submit("session", functools.partial(streamlit_app.download_playlist_clip, request=request), functools.partial(streamlit_app.encode_clip, request=request))
+        for request in requests
+    ]
+    deadline = time.time() + 120
+    while not all(scheduler.get_job(job_id).is_finished for job_id in job_ids):
+        assert time.time() < deadline
+        time.sleep(0.1)
+
+    jobs = [scheduler.get_job(job_id) for job_id in job_ids]
+    assert [job.status for job in jobs] == ["done"] * len(PLAYLIST_VIDEO_IDS), [job.error for job in jobs]
+    assert len(attempts) == len(PLAYLIST_VIDEO_IDS) + 1
+    assert all(os.path.exists(path) for job in jobs for path in job.result)
+
+def test_run_playlist_rejects_reversed_section(fake_ytdlp, tmp_path, capsys):
+    """共通の区間の終了時間が開始時間以前なら、動画一覧の取得・ダウンロードを始めずに終了する"""
+    import app
+
+    with pytest.raises(SystemExit) as exc_info:
+        app.run_playlist(PLAYLIST_URL, "05:00", "01:00", None, str(tmp_path / "playlist.journal.jsonl"), 2, 2)
+
+    assert exc_info.value.code == 1
+    assert "終了時間は開始時間より後にしてください。" in capsys.readouterr().out
+    assert fake_ytdlp.invocations() == []
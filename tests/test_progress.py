@@ -0,0 +1,74 @@
+import pytest
+
+from progress import DEFAULT_LOG_LINES, PROGRESS_FIELDS, LogBuffer, parse_progress_line, progress_fraction, format_progress
+
+def progress(downloaded_bytes=None, total_bytes=None, total_bytes_estimate=None, speed=None, eta=None, fragment_index=None, fragment_count=None):
+    return {
+        "downloaded_bytes": downloaded_bytes, "total_bytes": total_bytes, "total_bytes_estimate": total_bytes_estimate,
+        "speed": speed, "eta": eta, "fragment_index": fragment_index, "fragment_count": fragment_count,
+    }
+
+@pytest.mark.parametrize("line,expected", [
+    ("[progress] 1024|4096|NA|512.5|6|NA|NA", progress(1024, 4096, speed=512.5, eta=6)),
+    # 合計サイズが推定値しかない場合
+    ("[progress] 1024|NA|8192.0|NA|NA|NA|NA", progress(1024, total_bytes_estimate=8192)),
+    # 合計サイズ・速度・残り時間が不明な断片ダウンロード
+    ("[progress] 300000|NA|NA|NA|NA|3|12", progress(300000, fragment_index=3, fragment_count=12)),
+    ("[progress] NA|NA|NA|NA|NA|NA|NA", progress()),
+    # 行末の改行・空白は無視する
+    ("[progress] 10|20|NA|NA|1|NA|NA\r\n", progress(10, 20, eta=1)),
+    # 数値でない値は不明として扱う
+    ("[progress] abc|20|NA|None|NA|NA|NA", progress(total_bytes=20)),
+])
+def test_parse_progress_line(line, expected):
+    assert parse_progress_line(line) == expected
+
+@pytest.mark.parametrize("line", [
+    "",
+    "[download]  25.0% of 10.00MiB at 1.00MiB/s ETA 00:07",
+    "[info] clip0000001: Downloading 1 format(s): 18",
+    "progress 1|2|3|4|5|6|7",
+    # 途中で切れた行・区切りの多すぎる行
+    "[progress] 1024|4096|NA",
+    "[progress] ",
+    "[progress] 1|2|3|4|5|6|7|8",
+])
+def test_parse_progress_line_ignores_other_lines(line):
+    assert parse_progress_line(line) is None
+
+@pytest.mark.parametrize("value,fraction,text", [
+    (progress(1024, 4096, speed=512, eta=6), 0.25, "1.0KiB / 4.0KiB  512.0B/s  残り 00:06"),
+    (progress(2048, total_bytes_estimate=1024), 1.0, "2.0KiB / 1.0KiB"),
+    (progress(300000, fragment_index=3, fragment_count=12), 0.25, "293.0KiB / ?  断片 3/12"),
+    (progress(512), None, "512.0B / ?"),
+    (progress(), None, "? / ?"),
+])
+def test_progress_with_missing_fields(value, fraction, text):
+    assert progress_fraction(value) == fraction
+    assert format_progress(value) == text
+
+def test_progress_fields_match_template():
+    line = "[progress] " + "|".join(str(index) for index in range(len(PROGRESS_FIELDS)))
+    assert list(parse_progress_line(line).values()) == [float(index) for index in range(len(PROGRESS_FIELDS))]
+
+@pytest.mark.parametrize("max_lines,appended,expected", [
+    (3, [], ""),
+    (3, ["a", "b"], "a\nb"),
+    (3, ["a", "b", "c"], "a\nb\nc"),
+    # 上限を超えたら古い行から捨てる
+    (3, ["a", "b", "c", "d", "e"], "c\nd\ne"),
+    (1, ["a", "b"], "b"),
+])
+def test_log_buffer_keeps_latest_lines(max_lines, appended, expected):
+    buffer = LogBuffer(max_lines)
+    for line in appended:
+        buffer.append(line)
+    assert buffer.text() == expected
+    assert len(buffer.lines) <= max_lines
+
+def test_log_buffer_default_limit():
+    buffer = LogBuffer()
+    for index in range(10000):
+        buffer.append(str(index))
+    assert len(buffer.lines) == DEFAULT_LOG_LINES
+    assert buffer.text().splitlines()[0] == str(10000 - DEFAULT_LOG_LINES)
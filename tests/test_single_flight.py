@@ -0,0 +1,67 @@
+import os
+import time
+import functools
+import subprocess
+
+from conftest import CLIP_ID, requires_ytdlp
+from job_queue import get_scheduler, get_single_flight
+
+pytestmark = requires_ytdlp
+
+CLIP_URL = f"https://www.youtube.com/watch?v={CLIP_ID}"
+SESSIONS = 4
+
+def submit_identical_requests(monkeypatch):
+    """別々のセッションから同じ動画・同じ区間のダウンロードを同時に投入し、全ジョブの完了を待つ"""
+    import streamlit_app
+
+    # 全員のダウンロードが同時に走れる枠を用意する
+    monkeypatch.setenv("DOWNLOAD_CONCURRENCY", str(SESSIONS))
+    scheduler = get_scheduler()
+    request = {"youtube_url": CLIP_URL, "video_id": CLIP_ID, "sections": [("00:02", "00:05")], "cut_mode": "reencode"}
+    job_ids = [
+        scheduler.submit(
+            f"session-{index}",
+            functools.partial(streamlit_app.download_clip, request=request),
+            functools.partial(streamlit_app.encode_clip, request=request)
+        )
+        for index in range(SESSIONS)
+    ]
+    jobs = [scheduler.get_job(job_id) for job_id in job_ids]
+    deadline = time.time() + 60
+    while not all(job.is_finished for job in jobs):
+        assert time.time() < deadline, "ジョブが完了しませんでした"
+        time.sleep(0.05)
+    return jobs
+
+def test_identical_downloads_run_ytdlp_once(fake_ytdlp, monkeypatch):
+    # 最初のyt-dlpが終わる前に、残りのリクエストが届くようにする
+    fake_ytdlp.set_delay(1.5)
+    jobs = submit_identical_requests(monkeypatch)
+
+    assert [job.status for job in jobs] == ["done"] * SESSIONS, [job.error for job in jobs]
+    assert len(fake_ytdlp.invocations()) == 1
+    assert get_single_flight().get_stats() == {"executions": 1, "coalesced": SESSIONS - 1}
+    for job in jobs:
+        assert os.path.getsize(job.result[0]) > 0
+
+def test_download_error_reaches_every_waiter(fake_ytdlp, monkeypatch):
+    fake_ytdlp.set_delay(1.5)
+    fake_ytdlp.set_failure("This video is unavailable")
+    jobs = submit_identical_requests(monkeypatch)
+
+    assert [job.status for job in jobs] == ["error"] * SESSIONS
+    # 失敗した実行も1回だけで、待っていた全員がyt-dlpのエラーを受け取る
+    assert len({id(job.error) for job in jobs}) == 1
+    assert isinstance(jobs[0].error, subprocess.CalledProcessError)
+    assert "This video is unavailable" in jobs[0].error.stderr
+    invocation_count = len(fake_ytdlp.invocations())
+    assert invocation_count == 1
+    assert get_single_flight().get_stats() == {"executions": 1, "coalesced": SESSIONS - 1}
+
+    # 失敗後に届いたリクエストは、失敗を使い回さず改めて実行する
+    monkeypatch.delenv("FAKE_YTDLP_FAIL")
+    fake_ytdlp.set_delay(0)
+    jobs = submit_identical_requests(monkeypatch)
+    assert [job.status for job in jobs] == ["done"] * SESSIONS, [job.error for job in jobs]
+    assert len(fake_ytdlp.invocations()) > invocation_count
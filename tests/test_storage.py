@@ -0,0 +1,133 @@
+import os
+import sys
+import time
+import uuid
+import functools
+import subprocess
+import urllib.request
+
+import pytest
+
+import storage
+from conftest import CLIP_ID, requires_ytdlp, free_port
+from storage import S3Storage, DistributedLock
+
+boto3 = pytest.importorskip("boto3")
+pytest.importorskip("moto")
+
+LOCK_KEY = "locks/clip-test"
+CLIP_URL = f"https://www.youtube.com/watch?v={CLIP_ID}"
+
+@pytest.fixture(scope="module")
+def moto_endpoint():
+    """S3互換のサーバー（moto）を別プロセスで起動する"""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "moto.server", "-H", "127.0.0.1", "-p", str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while True:
+        try:
+            urllib.request.urlopen(url + "/moto-api/", timeout=1)
+            break
+        except OSError:
+            if time.time() > deadline or process.poll() is not None:
+                process.kill()
+                pytest.skip("motoのサーバーを起動できませんでした")
+            time.sleep(0.2)
+    yield url
+    process.kill()
+    process.wait()
+
+@pytest.fixture
+def s3_bucket(moto_endpoint, monkeypatch):
+    """テストごとに空のバケットを作り、S3互換ストレージの環境変数を向ける"""
+    for name, value in {"AWS_ACCESS_KEY_ID": "testing", "AWS_SECRET_ACCESS_KEY": "testing", "AWS_DEFAULT_REGION": "us-east-1"}.items():
+        monkeypatch.setenv(name, value)
+    bucket = f"clips-{uuid.uuid4().hex[:12]}"
+    boto3.client("s3", endpoint_url=moto_endpoint).create_bucket(Bucket=bucket)
+    monkeypatch.setattr(storage, "LOCK_POLL_INTERVAL", 0.1)
+    return bucket
+
+def replica(bucket, endpoint_url):
+    """別のレプリカから見たストレージ（クライアントを共有しない）"""
+    return S3Storage(bucket, endpoint_url=endpoint_url)
+
+def test_release_removes_own_lock(s3_bucket, moto_endpoint):
+    first = replica(s3_bucket, moto_endpoint)
+    assert first.try_lock(LOCK_KEY, "first", 60)
+    assert not replica(s3_bucket, moto_endpoint).try_lock(LOCK_KEY, "second", 60)
+
+    first.release_lock(LOCK_KEY, "first")
+    assert first.read_json(LOCK_KEY) is None
+
+def test_release_keeps_lock_taken_over_after_read(s3_bucket, moto_endpoint, monkeypatch):
+    """期限切れのロックを解放する間に他のレプリカが取得した場合、そのロックを削除しない"""
+    first = replica(s3_bucket, moto_endpoint)
+    second = replica(s3_bucket, moto_endpoint)
+    assert first.try_lock(LOCK_KEY, "first", 0.2)
+    time.sleep(0.3)
+
+    read_json_with_etag = first.read_json_with_etag
+    def read_then_lose(key):
+        result = read_json_with_etag(key)
+        assert second.try_lock(key, "second", 60)
+        return result
+    monkeypatch.setattr(first, "read_json_with_etag", read_then_lose)
+
+    first.release_lock(LOCK_KEY, "first")
+    assert second.read_json(LOCK_KEY)["owner"] == "second"
+
+def test_acquire_gives_up_after_timeout(s3_bucket, moto_endpoint):
+    holder = DistributedLock(replica(s3_bucket, moto_endpoint), "clip-test")
+    waiter = DistributedLock(replica(s3_bucket, moto_endpoint), "clip-test")
+    assert holder.acquire(timeout=0)
+    try:
+        started = time.perf_counter()
+        assert not waiter.acquire(timeout=0.5)
+        assert time.perf_counter() - started < 2
+    finally:
+        holder.release()
+    assert waiter.acquire(timeout=5)
+    waiter.release()
+
+@requires_ytdlp
+def test_download_waits_for_clip_lock_until_timeout(s3_bucket, moto_endpoint, fake_ytdlp, monkeypatch):
+    """他のレプリカが作成中のクリップはそのクリップのロックで待ち、上限を過ぎたら自分で作成する"""
+    import streamlit_app
+    from clip_cache import make_cache_key
+    from job_queue import get_scheduler
+
+    monkeypatch.setenv("STORAGE_BACKEND", "s3")
+    monkeypatch.setenv("S3_BUCKET", s3_bucket)
+    monkeypatch.setenv("S3_ENDPOINT_URL", moto_endpoint)
+    monkeypatch.setenv("CLIP_LOCK_TIMEOUT", "1.5")
+    held_section, free_section = ("00:02", "00:05"), ("00:10", "00:13")
+    # 他のレプリカが、同じクリップを含む別のリクエストを処理している
+    other_replica = DistributedLock(replica(s3_bucket, moto_endpoint), f"clip-{make_cache_key(CLIP_ID, streamlit_app.FORMAT_SORT, *held_section)}")
+    assert other_replica.acquire(timeout=0)
+
+    try:
+        request = {"youtube_url": CLIP_URL, "video_id": CLIP_ID, "sections": [held_section, free_section], "cut_mode": "reencode"}
+        started = time.perf_counter()
+        job = get_scheduler().get_job(get_scheduler().submit(
+            "session",
+            functools.partial(streamlit_app.download_clip, request=request),
+            functools.partial(streamlit_app.encode_clip, request=request)
+        ))
+        while not job.is_finished:
+            assert time.perf_counter() - started < 60, "ジョブが完了しませんでした"
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - started
+
+        assert job.status == "done", job.error
+        assert elapsed >= 1.5
+        assert len(fake_ytdlp.invocations()) == 1
+        assert all(os.path.getsize(path) > 0 for path in job.result)
+        # 取得したロックは完了時にすべて解放され、他のレプリカのロックは残る
+        objects = boto3.client("s3", endpoint_url=moto_endpoint).list_objects_v2(Bucket=s3_bucket, Prefix="locks/").get("Contents", [])
+        assert [item["Key"] for item in objects] == [other_replica.key]
+    finally:
+        other_replica.release()
@@ -0,0 +1,83 @@
+import json
+import subprocess
+
+import pytest
+
+import video_cut
+from conftest import requires_ffmpeg
+from fake_media import make_numbered_clip, read_frame_numbers, expected_frame_numbers
+
+# 29.97fpsでは多くのキーフレーム時刻が小数第3位で割り切れない（15フレームごと: 0.5005, 1.5015, ...）
+SOURCE_SECONDS = 12
+SOURCE_FPS = "30000/1001"
+SOURCE_GOP = 15
+
+# （開始, 終了）: キーフレームの途中から、キーフレーム上、キーフレーム時刻の丸め、動画の末尾まで
+SECTIONS = [(0.3, 2.9), (1.0, 5.0), (1.5015, 4.5045), (2.002, 6.006), (3.5, 9.2), (7.5, SOURCE_SECONDS)]
+
+def frames_at(fps, count, gop):
+    return [(index / fps, index % gop == 0) for index in range(count)]
+
+def test_x264_profile():
+    assert video_cut.x264_profile({"profile": "Constrained Baseline"}) == "baseline"
+    assert video_cut.x264_profile({"profile": "High 4:2:2"}) == "high422"
+    assert video_cut.x264_profile({"profile": "High 4:4:4 Predictive"}) == "high444"
+    assert video_cut.x264_profile({"profile": "High"}) == "high"
+    assert video_cut.x264_profile({"profile": "Stereo High"}) is None
+    assert video_cut.x264_profile({}) is None
+
+def test_plan_smart_cut_counts_frames():
+    frames = frames_at(30000 / 1001, 300, SOURCE_GOP)
+    # 0.5005秒のキーフレームを0.500と丸めて指定しても、前のGOPを含めない
+    assert video_cut.plan_smart_cut(frames, 0.5, 1.001) == (None, (frames[15][0], 15), None)
+    head, middle, tail = video_cut.plan_smart_cut(frames, 0.3, 2.9)
+    assert head == (frames[9][0], 6)
+    assert middle == (frames[15][0], 60)
+    assert tail == (frames[75][0], 12)
+    # 区間が動画の末尾まで続く場合は最後のGOPもコピーする
+    assert video_cut.plan_smart_cut(frames, 9.5, 11)[1:] == ((frames[285][0], 15), None)
+    assert video_cut.plan_chunks(frames, 0.3, 2.9, 2) == [(frames[9][0], 78)]
+
+@pytest.fixture(scope="module", params=["high", "baseline"])
+def numbered_source(request, tmp_path_factory):
+    """フレーム番号を輝度に埋め込んだ29.97fpsの動画（baselineはffprobeでConstrained Baselineと報告される）"""
+    path = tmp_path_factory.mktemp("cut") / f"source-{request.param}.mp4"
+    return str(make_numbered_clip(str(path), SOURCE_SECONDS, fps=SOURCE_FPS, gop=SOURCE_GOP, profile=request.param))
+
+@requires_ffmpeg
+@pytest.mark.parametrize("cut_mode", video_cut.CUT_MODES)
+@pytest.mark.parametrize("start_seconds,end_seconds", SECTIONS)
+def test_cut_section_is_frame_accurate(numbered_source, tmp_path, monkeypatch, cut_mode, start_seconds, end_seconds):
+    """どの切り出しモードでも、区間の境界のフレームが過不足なく、重複もしない"""
+    monkeypatch.setenv("ENCODE_WORKERS", "3")
+    monkeypatch.setattr(video_cut, "MIN_CHUNK_SECONDS", 1)
+    dst_path = str(tmp_path / "clip.mp4")
+    video_cut.cut_section(numbered_source, dst_path, start_seconds, end_seconds - start_seconds, cut_mode)
+    assert read_frame_numbers(dst_path) == expected_frame_numbers(start_seconds, end_seconds, SOURCE_SECONDS, SOURCE_FPS)
+
+def probe_streams(path):
+    """映像・音声ストリームごとの（開始時刻, 長さ）"""
+    result = subprocess.run([
+        "ffprobe", "-v", "error", "-show_entries", "stream=codec_type,start_time,duration", "-of", "json", path
+    ], check=True, capture_output=True, text=True)
+    return {stream["codec_type"]: (float(stream["start_time"]), float(stream["duration"])) for stream in json.loads(result.stdout)["streams"]}
+
+@requires_ffmpeg
+@pytest.mark.parametrize("cut_mode", ["smart", "parallel"])
+def test_cut_section_matches_reencode_duration_and_sync(numbered_source, tmp_path, monkeypatch, cut_mode):
+    """連結して作るモードでも、全体を再エンコードした場合と長さ・映像と音声の開始位置が一致する"""
+    monkeypatch.setenv("ENCODE_WORKERS", "3")
+    monkeypatch.setattr(video_cut, "MIN_CHUNK_SECONDS", 1)
+    start_seconds, duration = 1.3, 8.4
+    reference = probe_streams(video_cut.cut_section(numbered_source, str(tmp_path / "reencode.mp4"), start_seconds, duration, "reencode"))
+    streams = probe_streams(video_cut.cut_section(numbered_source, str(tmp_path / f"{cut_mode}.mp4"), start_seconds, duration, cut_mode))
+
+    frame_seconds = 1001 / 30000
+    # AACの1フレーム（1024サンプル）
+    audio_frame_seconds = 1024 / 44100
+    for codec_type, tolerance in (("video", frame_seconds), ("audio", audio_frame_seconds)):
+        assert streams[codec_type][0] == pytest.approx(reference[codec_type][0], abs=tolerance)
+        assert streams[codec_type][1] == pytest.approx(reference[codec_type][1], abs=tolerance)
+    # 映像と音声の開始位置・長さのずれは1フレーム以内
+    assert abs(streams["video"][0] - streams["audio"][0]) <= frame_seconds
+    assert abs(streams["video"][1] - streams["audio"][1]) <= frame_seconds + audio_frame_seconds
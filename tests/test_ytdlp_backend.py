@@ -0,0 +1,53 @@
+import os
+import json
+
+import pytest
+
+from conftest import CLIP_ID, PLAYLIST_ID, PLAYLIST_VIDEO_IDS, requires_ytdlp
+from ytdlp_backend import OutputLogger, run_ytdlp_command
+from video_info import get_info_cache
+from playlist import fetch_entries
+
+pytestmark = requires_ytdlp
+
+def test_output_logger_keeps_forced_output_when_quiet():
+    logger = OutputLogger(quiet=True)
+    logger.debug("[localmedia] Extracting URL")
+    logger.write('{"id": ')
+    logger.write('"abc"}\nsecond line\n')
+    assert logger.stdout.text() == '{"id": "abc"}\nsecond line'
+
+@pytest.mark.parametrize("backend", ["subprocess", "inprocess"])
+def test_metadata_is_returned_on_stdout_only(backend, fake_ytdlp, monkeypatch, capfd):
+    """動画情報・再生リストのJSONはどちらのバックエンドでも結果の標準出力に入り、サーバーの標準出力には出ない"""
+    monkeypatch.setenv("YTDLP_BACKEND", backend)
+    url = f"https://www.youtube.com/watch?v={CLIP_ID}"
+
+    result = run_ytdlp_command(["yt-dlp", "--dump-single-json", "--no-playlist", url])
+    assert json.loads(result.stdout)["id"] == CLIP_ID
+
+    summary = get_info_cache().fetch(CLIP_ID, url)
+    assert summary["title"] == f"Test video {CLIP_ID}"
+    assert summary["duration"] == 30
+
+    playlist = fetch_entries(f"https://www.youtube.com/playlist?list={PLAYLIST_ID}")
+    assert [entry["id"] for entry in playlist["entries"]] == list(PLAYLIST_VIDEO_IDS)
+
+    assert CLIP_ID not in capfd.readouterr().out
+
+@pytest.mark.parametrize("backend", ["subprocess", "inprocess"])
+def test_download_with_prefetched_info(backend, fake_ytdlp, monkeypatch):
+    """先読みした動画情報（--load-info-json）を使ったダウンロードが、どちらのバックエンドでも成功する"""
+    import app
+
+    monkeypatch.setenv("YTDLP_BACKEND", backend)
+    url = f"https://www.youtube.com/watch?v={CLIP_ID}"
+    video_info = get_info_cache().fetch(CLIP_ID, url)
+
+    final_paths = app.download_clips(url, CLIP_ID, [("00:02", "00:05")], "reencode", video_info=video_info)
+
+    assert len(final_paths) == 1 and os.path.getsize(final_paths[0]) > 0
+    if backend == "subprocess":
+        download_args = fake_ytdlp.invocations()[-1]
+        assert download_args[download_args.index("--load-info-json") + 1] == video_info["path"]
+        assert url not in download_args
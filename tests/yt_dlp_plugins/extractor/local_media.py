@@ -0,0 +1,41 @@
+import os
+
+from yt_dlp.extractor.common import InfoExtractor
+
+# テスト・ベンチマーク用に、YouTubeのURLをローカルのメディアサーバー（FAKE_MEDIA_URL）の目録に対応させる抽出器
+
+class LocalMediaIE(InfoExtractor):
+    IE_NAME = "localmedia"
+    _VALID_URL = r'https?://(?:www\.)?(?:youtube\.com/(?:watch\?v=|shorts/|embed/)|youtu\.be/)(?P<id>[\w-]+)'
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        base_url = os.environ["FAKE_MEDIA_URL"].rstrip("/")
+        entry = self._download_json(f"{base_url}/catalog/{video_id}.json", video_id)
+        if entry.get("mpd"):
+            formats = self._extract_mpd_formats(f"{base_url}/{entry['mpd']}", video_id)
+        else:
+            formats = [
+                {key: value for key, value in dict(format_, url=f"{base_url}/{format_['path']}").items() if key != "path"}
+                for format_ in entry["formats"]
+            ]
+        return {
+            "id": video_id,
+            "title": entry["title"],
+            "duration": entry["duration"],
+            "formats": formats,
+        }
+
+class LocalMediaPlaylistIE(InfoExtractor):
+    IE_NAME = "localmedia:playlist"
+    _VALID_URL = r'https?://(?:www\.)?youtube\.com/playlist\?(?:.*&)?list=(?P<id>[\w-]+)'
+
+    def _real_extract(self, url):
+        playlist_id = self._match_id(url)
+        base_url = os.environ["FAKE_MEDIA_URL"].rstrip("/")
+        playlist = self._download_json(f"{base_url}/playlists/{playlist_id}.json", playlist_id)
+        entries = [
+            self.url_result(f"https://www.youtube.com/watch?v={video_id}", LocalMediaIE, video_id)
+            for video_id in playlist["entries"]
+        ]
+        return self.playlist_result(entries, playlist_id, playlist["title"])
@@ -0,0 +1,302 @@
+import os
+import json
+import bisect
+import shutil
+import tempfile
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from executables import run_executable
+
+CUT_MODES = ("smart", "parallel", "reencode")
+DEFAULT_CUT_MODE = "smart"
+
+# キーフレーム位置と区間境界を同一とみなす誤差（秒）
+KEYFRAME_TOLERANCE = 0.01
+
+# 並列エンコードで1チャンクに割り当てる最短の長さ（秒）
+MIN_CHUNK_SECONDS = 10
+
+# フレームの間隔が分からない場合に仮定する値（30fps）
+DEFAULT_FRAME_INTERVAL = 1 / 30
+
+# ffprobeのH.264プロファイル名とlibx264の-profile:vの対応（ここにないプロファイルは指定しない）
+X264_PROFILES = {
+    "constrained baseline": "baseline",
+    "baseline": "baseline",
+    "main": "main",
+    "high": "high",
+    "high 10": "high10",
+    "high 4:2:2": "high422",
+    "high 4:4:4 predictive": "high444",
+}
+
+def get_cut_mode():
+    """環境変数から切り出しモードを取得（smart: 境界のみ再エンコード、parallel: 全体を並列で再エンコード、reencode: yt-dlpで全体を再エンコード）"""
+    cut_mode = os.environ.get("CUT_MODE", DEFAULT_CUT_MODE)
+    return cut_mode if cut_mode in CUT_MODES else DEFAULT_CUT_MODE
+
+def get_encode_workers():
+    """並列エンコードのワーカー数を取得（既定はCPUコア数）"""
+    return max(1, int(os.environ.get("ENCODE_WORKERS", os.cpu_count() or 1)))
+
+def cut_clip(src_path, dst_path, start_seconds, duration):
+    """ffmpegで動画の一部を切り出す（フレーム単位で正確に切るため再エンコード）"""
+    frames = probe_video_frames(src_path)
+    first, last = select_frames(frames, start_seconds, start_seconds + duration)
+    cmd = ["ffmpeg", "-y", "-v", "error"]
+    if last > first:
+        # 最初のフレームの半フレーム手前にシークし、区間のフレーム数だけ書き出す
+        cmd.extend(["-ss", f"{max(0, frames[first][0] - frame_interval(frames) / 2):.6f}", "-i", src_path, "-frames:v", str(last - first)])
+    else:
+        cmd.extend(["-ss", f"{start_seconds:.6f}", "-i", src_path])
+    cmd.extend([
+        "-t", f"{duration:.6f}",
+        "-map", "0:v:0", "-map", "0:a:0?",
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", "18",
+        # 最初のフレームがシーク位置より後にあっても、固定フレームレートに合わせるための複製をしない
+        "-fps_mode", "passthrough",
+        "-c:a", "aac",
+        "-movflags", "+faststart",
+        dst_path
+    ])
+    run_executable(cmd)
+    return dst_path
+
+def probe_video_frames(src_path):
+    """ffprobeで映像の各フレームの（表示時刻（秒）, キーフレームか）を表示順に取得（デコードせずパケット情報のみ参照）"""
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags:format=start_time",
+        "-of", "json",
+        src_path
+    ]
+    result = run_executable(cmd)
+    probe = json.loads(result.stdout)
+    # ffmpegの-ssは動画の開始時刻からの位置なので、時刻を開始時刻からの相対値にそろえる
+    start_time = float(probe.get("format", {}).get("start_time", 0) or 0)
+    frames = []
+    for packet in probe.get("packets", []):
+        pts_time = packet.get("pts_time")
+        if pts_time in (None, "", "N/A"):
+            continue
+        frames.append((float(pts_time) - start_time, "K" in packet.get("flags", "")))
+    return sorted(frames)
+
+def probe_keyframes(src_path):
+    """ffprobeで映像のキーフレーム時刻（秒）を取得"""
+    return [frame_time for frame_time, keyframe in probe_video_frames(src_path) if keyframe]
+
+def probe_video_stream(src_path):
+    """ffprobeで映像ストリームのコーデック情報と動画の長さを取得"""
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=codec_name,profile,pix_fmt,width,height:format=duration",
+        "-of", "json",
+        src_path
+    ]
+    result = run_executable(cmd)
+    probe = json.loads(result.stdout)
+    stream = probe["streams"][0] if probe.get("streams") else {}
+    stream["duration"] = float(probe.get("format", {}).get("duration", 0) or 0)
+    return stream
+
+def frame_interval(frames):
+    """隣り合うフレームの表示時刻の最小の間隔（秒）"""
+    intervals = [b[0] - a[0] for a, b in zip(frames, frames[1:]) if b[0] > a[0]]
+    return min(intervals) if intervals else DEFAULT_FRAME_INTERVAL
+
+def select_frames(frames, start_seconds, end_seconds):
+    """表示時刻が区間[開始, 終了)に入るフレームの（最初の添字, 最後の添字+1）を返す"""
+    # 指定の秒数がフレームの時刻をわずかに下回っていても、そのフレームから切り出す
+    tolerance = min(KEYFRAME_TOLERANCE, frame_interval(frames) / 2)
+    first = bisect.bisect_left(frames, (start_seconds - tolerance,))
+    last = bisect.bisect_left(frames, (end_seconds - tolerance,))
+    return first, max(first, last)
+
+def plan_smart_cut(frames, start_seconds, end_seconds):
+    """切り出し区間を（再エンコードする先頭, コピーする中間, 再エンコードする末尾）に分割（各部分は（最初のフレームの時刻, フレーム数））"""
+    first, last = select_frames(frames, start_seconds, end_seconds)
+    keyframe_indexes = [index for index in range(first, last) if frames[index][1]]
+    if not keyframe_indexes:
+        # 区間内にキーフレームがない場合は全体を再エンコード
+        return (frames[first][0], last - first) if last > first else None, None, None
+
+    first_keyframe = keyframe_indexes[0]
+    head = (frames[first][0], first_keyframe - first) if first_keyframe > first else None
+
+    if last == len(frames) or frames[last][1]:
+        # 区間の直後がキーフレーム、または動画の末尾の場合は最後のGOPまでコピー
+        return head, (frames[first_keyframe][0], last - first_keyframe), None
+
+    last_keyframe = keyframe_indexes[-1]
+    if last_keyframe == first_keyframe:
+        return head, None, (frames[first_keyframe][0], last - first_keyframe)
+    return head, (frames[first_keyframe][0], last_keyframe - first_keyframe), (frames[last_keyframe][0], last - last_keyframe)
+
+def x264_profile(stream_info):
+    """ffprobeのプロファイル名を、libx264の-profile:vに指定できる名前に変換（対応しない場合はNone）"""
+    return X264_PROFILES.get((stream_info.get("profile") or "").lower())
+
+def encode_segment(src_path, dst_path, segment, stream_info, interval, threads=0):
+    """映像の一部を元の映像と連結できる設定で、指定の時刻のフレームから指定のフレーム数だけ再エンコード"""
+    cmd = [
+        "ffmpeg", "-y", "-v", "error",
+        # 半フレーム手前に正確にシークし、最初のフレームの時刻の丸めで1つ前のフレームが入らないようにする
+        "-ss", f"{max(0, segment[0] - interval / 2):.6f}",
+        "-i", src_path,
+        "-frames:v", str(segment[1]),
+        "-map", "0:v:0", "-an",
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", "18",
+        "-pix_fmt", stream_info.get("pix_fmt", "yuv420p"),
+        "-threads", str(threads),
+    ]
+    profile = x264_profile(stream_info) if stream_info.get("codec_name") == "h264" else None
+    if profile:
+        cmd.extend(["-profile:v", profile])
+    cmd.extend(["-f", "mpegts", dst_path])
+    run_executable(cmd)
+
+def copy_segment(src_path, dst_path, segment, interval):
+    """キーフレームで始まる中間部分の映像を、指定のフレーム数だけ再エンコードせずにコピー"""
+    cmd = [
+        "ffmpeg", "-y", "-v", "error",
+        # コピー時のシークは指定位置以前のキーフレームに移動するため、半フレーム先を指定して1つ前のGOPを含めない
+        "-ss", f"{segment[0] + interval / 2:.6f}",
+        "-i", src_path,
+        "-frames:v", str(segment[1]),
+        "-map", "0:v:0", "-an",
+        "-c", "copy",
+        "-f", "mpegts", dst_path
+    ]
+    run_executable(cmd)
+
+def concat_segments(segment_paths, src_path, dst_path, start_seconds, duration, work_dir):
+    """MPEG-TSの映像セグメントを無劣化で連結し、区間全体の音声と多重化"""
+    concat_list = os.path.join(work_dir, "concat.txt")
+    with open(concat_list, "w", encoding="utf-8") as f:
+        for segment_path in segment_paths:
+            f.write(f"file '{segment_path}'\n")
+
+    # 音声は区間全体をまとめてエンコードし、映像の継ぎ目で音ずれが起きないようにする
+    cmd = [
+        "ffmpeg", "-y", "-v", "error",
+        "-f", "concat", "-safe", "0", "-i", concat_list,
+        "-ss", f"{start_seconds:.6f}", "-t", f"{duration:.6f}", "-i", src_path,
+        "-map", "0:v:0", "-map", "1:a:0?",
+        "-c:v", "copy", "-c:a", "aac",
+        "-movflags", "+faststart",
+        dst_path
+    ]
+    run_executable(cmd)
+
+def smart_cut(src_path, dst_path, start_seconds, duration):
+    """区間内の完全なGOPはコピーし、境界の不完全なGOPのみ再エンコードして切り出す"""
+    stream_info = probe_video_stream(src_path)
+    if stream_info.get("codec_name") != "h264":
+        # 再エンコード部分と連結できないコーデックは全体を再エンコード
+        return cut_clip(src_path, dst_path, start_seconds, duration)
+
+    frames = probe_video_frames(src_path)
+    interval = frame_interval(frames)
+    head, middle, tail = plan_smart_cut(frames, start_seconds, start_seconds + duration)
+
+    if middle is None:
+        return cut_clip(src_path, dst_path, start_seconds, duration)
+
+    if head is None and tail is None:
+        # 区間の両端がキーフレーム上にある場合は再エンコード不要
+        cmd = [
+            "ffmpeg", "-y", "-v", "error",
+            "-ss", f"{middle[0] + interval / 2:.6f}",
+            "-i", src_path,
+            "-frames:v", str(middle[1]),
+            "-t", f"{middle[1] * interval:.6f}",
+            "-map", "0:v:0", "-map", "0:a:0?",
+            "-c", "copy",
+            # シーク位置より手前の時刻になるキーフレームが、負の時刻として捨てられないようにする
+            "-avoid_negative_ts", "make_zero",
+            "-movflags", "+faststart",
+            dst_path
+        ]
+        run_executable(cmd)
+        return dst_path
+
+    work_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(dst_path)))
+    try:
+        # 各部分をMPEG-TSで書き出し、パラメータセットの異なるストリームでも連結できるようにする
+        segment_paths = []
+        for index, (segment, reencode) in enumerate(((head, True), (middle, False), (tail, True))):
+            if segment is None:
+                continue
+            segment_path = os.path.join(work_dir, f"segment_{index}.ts")
+            if reencode:
+                encode_segment(src_path, segment_path, segment, stream_info, interval)
+            else:
+                copy_segment(src_path, segment_path, segment, interval)
+            segment_paths.append(segment_path)
+
+        concat_segments(segment_paths, src_path, dst_path, start_seconds, duration, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return dst_path
+
+def plan_chunks(frames, start_seconds, end_seconds, workers):
+    """区間をワーカー数に応じた、キーフレーム位置で区切られたチャンク（最初のフレームの時刻, フレーム数）に分割"""
+    first, last = select_frames(frames, start_seconds, end_seconds)
+    target_seconds = max(MIN_CHUNK_SECONDS, (end_seconds - start_seconds) / workers)
+    boundaries = [first]
+    for index in range(first + 1, last):
+        if frames[index][1] and frames[index][0] - frames[boundaries[-1]][0] >= target_seconds:
+            boundaries.append(index)
+    boundaries.append(last)
+    return [(frames[a][0], b - a) for a, b in zip(boundaries[:-1], boundaries[1:]) if b > a]
+
+def parallel_encode(src_path, dst_path, start_seconds, duration, workers=None):
+    """区間をキーフレーム単位のチャンクに分け、複数のffmpegプロセスで同時に再エンコード"""
+    workers = workers or get_encode_workers()
+    stream_info = probe_video_stream(src_path)
+    frames = probe_video_frames(src_path)
+    interval = frame_interval(frames)
+    chunks = plan_chunks(frames, start_seconds, start_seconds + duration, workers)
+    if len(chunks) <= 1:
+        return cut_clip(src_path, dst_path, start_seconds, duration)
+
+    # 各ffmpegが使うスレッド数を抑え、コア数以上のスレッドが競合しないようにする
+    threads = max(1, (os.cpu_count() or 1) // min(workers, len(chunks)))
+    work_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(dst_path)))
+    try:
+        segment_paths = [os.path.join(work_dir, f"chunk_{index:04d}.ts") for index in range(len(chunks))]
+        # 実際のエンコードは子プロセスのffmpegが行うため、起動と待機はスレッドで十分
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                # 各スレッドのffmpegの使用量も、呼び出し元の計測区間に加える
+                executor.submit(contextvars.copy_context().run, encode_segment, src_path, segment_path, chunk, stream_info, interval, threads)
+                for segment_path, chunk in zip(segment_paths, chunks)
+            ]
+            for future in futures:
+                future.result()
+
+        concat_segments(segment_paths, src_path, dst_path, start_seconds, duration, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return dst_path
+
+def cut_section(src_path, dst_path, start_seconds, duration, cut_mode=None):
+    """切り出しモードに応じて区間を切り出す"""
+    cut_mode = cut_mode or get_cut_mode()
+    if cut_mode == "smart":
+        return smart_cut(src_path, dst_path, start_seconds, duration)
+    if cut_mode == "parallel":
+        return parallel_encode(src_path, dst_path, start_seconds, duration)
+    return cut_clip(src_path, dst_path, start_seconds, duration)
+
+def trim_in_place(path, duration, cut_mode=None):
+    """キーフレームを揃えずにダウンロードした区間を、正確な長さに切り出し直す"""
+    name, ext = os.path.splitext(path)
+    trimmed_path = f"{name}.trimmed{ext}"
+    cut_section(path, trimmed_path, 0, duration, cut_mode)
+    os.replace(trimmed_path, path)
+    return path
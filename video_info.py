@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ytdlp_backend import run_ytdlp_command
+from metrics import span
+
+DEFAULT_INFO_CACHE_DIR = os.path.join(tempfile.gettempdir(), "video-info-cache")
+# 動画のURLには有効期限があるため、情報の再利用は短時間に限る
+DEFAULT_INFO_TTL = 30 * 60
+PREFETCH_WORKERS = 2
+
+_info_cache = None
+_info_cache_lock = threading.Lock()
+
+class InfoCache:
+    """yt-dlpで抽出した動画情報（info JSON）を動画IDごとに保持するTTL付きキャッシュ"""
+
+    def __init__(self, root=None, ttl=None):
+        self.root = root or os.environ.get("INFO_CACHE_DIR", DEFAULT_INFO_CACHE_DIR)
+        self.ttl = float(ttl if ttl is not None else os.environ.get("INFO_CACHE_TTL", DEFAULT_INFO_TTL))
+        self.summaries = {}
+        self.in_flight = {}
+        # 完了済みのFutureではadd_done_callbackが即座に呼ばれるため再入可能なロックを使う
+        self.lock = threading.RLock()
+        self.executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS)
+        os.makedirs(self.root, exist_ok=True)
+
+    def info_path(self, video_id):
+        return os.path.join(self.root, f"{video_id}.info.json")
+
+    def get(self, video_id):
+        """有効な動画情報の概要（タイトル・長さ・info JSONのパス）を返す（なければNone）"""
+        path = self.info_path(video_id)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        if time.time() - mtime > self.ttl:
+            return None
+
+        with self.lock:
+            summary = self.summaries.get(video_id)
+        if summary is None or summary["mtime"] != mtime:
+            # 他のプロセスが保存した情報を読み込む
+            try:
+                with open(path, encoding="utf-8") as f:
+                    info = json.load(f)
+            except (OSError, ValueError):
+                return None
+            summary = {
+                "title": info.get("title"),
+                "duration": info.get("duration"),
+                "format_count": len(info.get("formats") or []),
+                "path": path,
+                "mtime": mtime,
+            }
+            with self.lock:
+                self.summaries[video_id] = summary
+        return summary
+
+    def fetch(self, video_id, url, options=()):
+        """yt-dlpで動画情報を抽出して保存"""
+        cmd = ["yt-dlp", "--dump-single-json", "--no-playlist", *options, url]
+        with span("metadata", video_id=video_id) as metadata_span:
+            result = run_ytdlp_command(cmd)
+            metadata_span.add_bytes(len(result.stdout))
+            try:
+                # 出力がJSONでなければ保存せず、壊れた情報を再利用しない
+                json.loads(result.stdout)
+            except ValueError as e:
+                raise RuntimeError("動画情報を解析できませんでした。") from e
+
+        # 一時ファイルに書き込んでから置き換え、途中状態が読まれないようにする
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(result.stdout)
+        os.replace(temp_path, self.info_path(video_id))
+        return self.get(video_id)
+
+    def prefetch(self, video_id, url, options=()):
+        """動画情報の抽出をバックグラウンドで開始（取得済み・取得中の場合は何もしない）"""
+        if self.get(video_id) is not None:
+            return None
+        with self.lock:
+            future = self.in_flight.get(video_id)
+            if future is None:
+                future = self.executor.submit(self.fetch, video_id, url, tuple(options))
+                self.in_flight[video_id] = future
+                future.add_done_callback(lambda _: self.finish_prefetch(video_id))
+        return future
+
+    def finish_prefetch(self, video_id):
+        with self.lock:
+            self.in_flight.pop(video_id, None)
+
+    def wait(self, video_id, timeout=None):
+        """取得中の動画情報があれば完了まで待ち、概要を返す（失敗した場合はNone）"""
+        with self.lock:
+            future = self.in_flight.get(video_id)
+        if future is not None:
+            try:
+                future.result(timeout=timeout)
+            except Exception:
+                return None
+        return self.get(video_id)
+
+def with_info_json(cmd, info_path):
+    """URLの代わりに保存済みのinfo JSONを読み込むようにコマンドを書き換える（URLは末尾の引数）"""
+    return cmd[:-1] + ["--load-info-json", info_path]
+
+def get_info_cache():
+    """プロセス全体で共有する動画情報キャッシュを取得"""
+    global _info_cache
+    with _info_cache_lock:
+        if _info_cache is None:
+            _info_cache = InfoCache()
+        return _info_cache
@@ -0,0 +1,243 @@
+import os
+import time
+import queue
+import contextlib
+import subprocess
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from progress import PROGRESS_OPTIONS, LogBuffer, parse_progress_line
+from executables import resolve_command, ytdlp_ffmpeg_options
+from metrics import ProcessSampler, record_child_usage, wait_child
+
+YTDLP_BACKENDS = ("subprocess", "inprocess")
+DEFAULT_YTDLP_BACKEND = "subprocess"
+DEFAULT_WORKERS = 2
+
+_backend = None
+_backend_lock = threading.Lock()
+_rate_limiter = None
+
+# ワーカープロセス内で使い回すyt-dlpモジュール
+_yt_dlp = None
+
+class SubprocessBackend:
+    """リクエストごとにyt-dlpのプロセスを起動するバックエンド"""
+
+    def run(self, cmd, on_progress=None):
+        stdout_log = LogBuffer()
+        stderr_log = LogBuffer()
+        # 出力を終了まで溜め込まず、1行ずつ読み取って進捗を通知する
+        process = subprocess.Popen(
+            resolve_command(cmd) + PROGRESS_OPTIONS,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, bufsize=1
+        )
+        stderr_thread = threading.Thread(target=read_lines, args=(process.stderr, stderr_log.append), daemon=True)
+        stderr_thread.start()
+
+        for line in process.stdout:
+            line = line.rstrip("\n")
+            progress = parse_progress_line(line)
+            if progress is None:
+                stdout_log.append(line)
+            elif on_progress is not None:
+                on_progress(progress)
+
+        # yt-dlpと、それが起動したffmpegの使用量を実行中の計測区間に加える
+        returncode = wait_child(process)
+        stderr_thread.join()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd, stdout_log.text(), stderr_log.text())
+        return subprocess.CompletedProcess(cmd, returncode, stdout_log.text(), stderr_log.text())
+
+    def shutdown(self):
+        pass
+
+def read_lines(stream, callback):
+    """ストリームを1行ずつ読み取ってコールバックに渡す"""
+    for line in stream:
+        callback(line.rstrip("\n"))
+
+class OutputLogger:
+    """yt-dlpのメッセージを標準出力・標準エラー出力の代わりに記録するロガー（quietの場合は進捗以外の画面表示を捨てる）"""
+
+    def __init__(self, progress_queue=None, quiet=False):
+        self.stdout = LogBuffer()
+        self.stderr = LogBuffer()
+        self.progress_queue = progress_queue
+        self.quiet = quiet
+        self.partial_line = ""
+
+    def debug(self, msg):
+        # yt-dlpは通常の出力もdebugで渡すため、"[debug] "付きのもの以外を標準出力として扱う
+        if not msg.startswith("[debug] "):
+            self.info(msg)
+
+    def info(self, msg):
+        progress = parse_progress_line(msg)
+        if progress is None:
+            # サブプロセスで実行した場合と同じく、quietでは画面表示を標準出力に含めない
+            if not self.quiet:
+                self.stdout.append(msg)
+        elif self.progress_queue is not None:
+            self.progress_queue.put(progress)
+
+    def write(self, text):
+        """標準出力の代わりに、yt-dlpが直接書き出す出力（--dump-single-json、--print等）を受け取る"""
+        lines = (self.partial_line + text).split("\n")
+        self.partial_line = lines.pop()
+        for line in lines:
+            self.stdout.append(line)
+
+    def flush(self):
+        pass
+
+    def warning(self, msg):
+        self.stderr.append(f"WARNING: {msg}")
+
+    def error(self, msg):
+        self.stderr.append(msg)
+
+def warm_up():
+    """ワーカープロセスの起動時にyt-dlpと抽出器を読み込んでおく"""
+    global _yt_dlp
+    try:
+        import yt_dlp
+        from yt_dlp.extractor import gen_extractor_classes
+    except ImportError:
+        return
+    gen_extractor_classes()
+    _yt_dlp = yt_dlp
+
+def run_in_worker(cmd, progress_queue=None):
+    """ワーカープロセス内でyt-dlpのコマンドライン引数をそのまま解釈して実行"""
+    if _yt_dlp is None:
+        warm_up()
+    if _yt_dlp is None:
+        raise FileNotFoundError("yt-dlp")
+
+    parsed = _yt_dlp.parse_options(cmd[1:])
+    logger = OutputLogger(progress_queue, quiet=parsed.ydl_opts.get("quiet"))
+    ydl_opts = dict(parsed.ydl_opts, logger=logger)
+    # ワーカーは1件ずつ実行するため、実行中のワーカーと子孫の使用量がこのコマンドの分になる
+    with ProcessSampler([os.getpid()]) as sampler:
+        returncode = run_parsed(parsed, ydl_opts, logger)
+    if logger.partial_line:
+        logger.stdout.append(logger.partial_line)
+    return returncode, logger.stdout.text(), logger.stderr.text(), (sampler.cpu_seconds, sampler.peak_rss_bytes)
+
+def run_parsed(parsed, ydl_opts, logger):
+    """解釈済みのコマンドライン引数でyt-dlpを実行し、終了コードを返す"""
+    try:
+        # --dump-single-json等の出力はロガーを通らずYoutubeDL作成時の標準出力に書かれるため、ワーカーの標準出力を差し替えておく
+        with contextlib.redirect_stdout(logger), _yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            # --load-info-jsonはyt-dlpのコマンドライン処理（_real_main）でのみ扱われるため、ここで同じように読み込む
+            if parsed.options.load_info_filename is not None:
+                returncode = ydl.download_with_info_file(_yt_dlp.utils.expand_path(parsed.options.load_info_filename))
+            else:
+                returncode = ydl.download(parsed.urls)
+    except _yt_dlp.utils.DownloadError:
+        returncode = 1
+    return returncode
+
+class InProcessBackend:
+    """yt-dlpを読み込み済みの常駐ワーカープロセスで、Python APIから実行するバックエンド"""
+
+    def __init__(self, workers=None):
+        workers = int(workers or os.environ.get("YTDLP_WORKERS", DEFAULT_WORKERS))
+        # スレッドを持つプロセスからのforkを避けるためspawnで起動
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=warm_up
+        )
+        self.manager = None
+        self.manager_lock = threading.Lock()
+
+    def get_progress_queue(self):
+        """ワーカープロセスから進捗を受け取るためのキューを作成"""
+        with self.manager_lock:
+            if self.manager is None:
+                self.manager = multiprocessing.get_context("spawn").Manager()
+            return self.manager.Queue()
+
+    def run(self, cmd, on_progress=None):
+        progress_queue = self.get_progress_queue() if on_progress is not None else None
+        future = self.executor.submit(run_in_worker, cmd[:1] + ytdlp_ffmpeg_options() + list(cmd[1:]) + PROGRESS_OPTIONS, progress_queue)
+
+        # 実行中はワーカーから届いた進捗を順に通知
+        while progress_queue is not None:
+            try:
+                on_progress(progress_queue.get(timeout=0.2))
+            except queue.Empty:
+                if future.done():
+                    break
+
+        returncode, stdout, stderr, usage = future.result()
+        record_child_usage(*usage)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd, stdout, stderr)
+        return subprocess.CompletedProcess(cmd, returncode, stdout, stderr)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.manager is not None:
+            self.manager.shutdown()
+
+class RateLimiter:
+    """yt-dlpの起動回数を1分あたりの上限に抑えるトークンバケット（0の場合は制限なし）"""
+
+    def __init__(self, rate_per_minute=0):
+        self.lock = threading.Lock()
+        self.set_rate(rate_per_minute)
+
+    def set_rate(self, rate_per_minute):
+        with self.lock:
+            self.rate = float(rate_per_minute) / 60
+            # 短時間の集中を許す量は1秒分（最低1回）に抑える
+            self.capacity = max(1.0, self.rate)
+            self.tokens = self.capacity
+            self.updated = time.monotonic()
+
+    def acquire(self):
+        """トークンが得られるまで待つ"""
+        while True:
+            with self.lock:
+                if self.rate <= 0:
+                    return
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def get_rate_limiter():
+    """プロセス全体で共有するyt-dlpの起動回数の制限を取得（環境変数YTDLP_RATE_LIMITで1分あたりの回数を指定）"""
+    global _rate_limiter
+    with _backend_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter(os.environ.get("YTDLP_RATE_LIMIT", 0))
+        return _rate_limiter
+
+def get_backend_name():
+    """環境変数からyt-dlpの実行方式を取得（subprocess: 毎回プロセスを起動、inprocess: 常駐ワーカーで実行）"""
+    backend_name = os.environ.get("YTDLP_BACKEND", DEFAULT_YTDLP_BACKEND)
+    return backend_name if backend_name in YTDLP_BACKENDS else DEFAULT_YTDLP_BACKEND
+
+def get_backend():
+    """プロセス全体で共有するyt-dlpの実行バックエンドを取得"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = InProcessBackend() if get_backend_name() == "inprocess" else SubprocessBackend()
+        return _backend
+
+def run_ytdlp_command(cmd, on_progress=None):
+    """選択されたバックエンドでyt-dlpのコマンドを実行し、進捗をon_progressに通知（失敗時はCalledProcessError）"""
+    # 動画情報の抽出もダウンロードも、同じ上限の中で実行する
+    get_rate_limiter().acquire()
+    return get_backend().run(cmd, on_progress)